@@ -1,7 +1,7 @@
 #!/bin/bash
 
 echo "===== BUILDING ====" && \
-  docker build -t local/hypercerts-utils . && \
+  docker build -t local/hypercerts-utils -f Dockerfile ../.. && \
   echo "===== RUNNING =====" && \
   docker run --rm -it \
     --name hypercerts-utils \
@@ -1,7 +1,12 @@
 from dotenv import load_dotenv
 import json
 import os
-import requests
+
+# The IPFS cache and Graph client live in utils/supabase; the Docker image puts
+# them on PYTHONPATH, and local runs need PYTHONPATH=../../supabase
+import graph_client
+import ipfs_cache
+import ipfs_gateways
 
 
 load_dotenv()
@@ -39,15 +44,14 @@ def get_round_data(round_id):
     }
     }
     '''
-    # Query TheGraph API for the round's data by POST request
-    response = requests.post(url, json={'query': query})
-    data = response.json()
+    # Query TheGraph API for the round's data through the shared client
+    data = graph_client.get_client(url).query(query)
 
     print(url)
     records = []
 
     # Iterate through the JSON object and add data to our list
-    for round in data['data']['rounds']:
+    for round in data['rounds']:
         for project in round['projects']:
             records.append({
                 'roundId': round['id'],
@@ -60,21 +64,9 @@ def get_round_data(round_id):
 
 
 def retrieve_ipfs_file(cid):
-    # Build the URL to the file on the Cloudflare IPFS gateway
-    url = CONFIG['hostedCidBaseUrl'] + cid
-    
-    try:    
-        # Send a GET request to the URL
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Parse the JSON data
-        data = json.loads(response.content)
-        return data
-    
-    except requests.exceptions.HTTPError as e:
-        print(e)
-        return None
+    # Fetch the file from the configured gateway, or from the shared IPFS cache
+    # if a previous run (or one of the supabase scripts) already retrieved it
+    return ipfs_cache.retrieve_ipfs_file(cid, base_url=CONFIG['hostedCidBaseUrl'])
 
 
 def get_grants_for_all_rounds():
@@ -99,6 +91,9 @@ def get_grants_for_all_rounds():
     json.dump(data, out_file, indent=4)                
     out_file.close()   
 
+    graph_client.print_stats()
+    ipfs_gateways.print_stats()
+
 
 if __name__ == "__main__":
     get_grants_for_all_rounds()
\ No newline at end of file
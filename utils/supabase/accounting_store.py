@@ -0,0 +1,303 @@
+"""
+SQLite store for hypercert accounting records.
+
+Replaces the monolithic `hypercertAccounting.json`, which had to be loaded and
+rewritten in full on every run. Claims are keyed by claimId and their tokens
+are stored in a separate table indexed by claimId, so a run only writes the
+claims it adds and the token rows that changed. Each claim records the block
+its tokens were last indexed at, and the block they were last fetched in full.
+"""
+
+import base64
+import json
+import sqlite3
+
+from merkle_allowlist import MerkleAllowlist
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS claims (
+    claimId TEXT PRIMARY KEY,
+    createdAt INTEGER,
+    createdDate TEXT,
+    creatorAddress TEXT,
+    ownerAddress TEXT,
+    totalUnits INTEGER,
+    metadataUri TEXT,
+    allowlistUri TEXT,
+    metadata TEXT,
+    allowlistAddresses BLOB,
+    allowlistUnits TEXT,
+    supabaseList TEXT,
+    indexedBlock INTEGER,
+    syncedBlock INTEGER
+);
+CREATE TABLE IF NOT EXISTS claim_tokens (
+    tokenId TEXT PRIMARY KEY,
+    claimId TEXT NOT NULL,
+    owner TEXT,
+    units TEXT,
+    updatedBlock INTEGER
+);
+CREATE INDEX IF NOT EXISTS claim_tokens_claim_id ON claim_tokens (claimId);
+"""
+
+CLAIM_COLUMNS = [
+    "claimId", "createdAt", "createdDate", "creatorAddress", "ownerAddress", "totalUnits",
+    "metadataUri", "allowlistUri", "metadata", "allowlistAddresses", "allowlistUnits",
+    "supabaseList", "indexedBlock", "syncedBlock"
+]
+
+
+class AccountingStore:
+    """
+    Claim records and their tokens, stored in a SQLite database.
+
+    Records go in and come out in the same shape as the entries of
+    `hypercertAccounting.json`, so callers don't depend on the table layout.
+    """
+
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def claim_ids(self) -> set:
+        """Returns the IDs of all stored claims."""
+        return {row[0] for row in self.conn.execute("SELECT claimId FROM claims")}
+
+    def claims_indexed_before(self, block: int) -> list:
+        """
+        Returns the IDs of claims whose tokens were last indexed before `block`.
+
+        Args:
+            block: Block number the subgraph has indexed up to.
+        """
+        rows = self.conn.execute(
+            "SELECT claimId FROM claims WHERE indexedBlock IS NULL OR indexedBlock < ? ORDER BY rowid",
+            (block,)
+        )
+        return [row[0] for row in rows]
+
+    def claims_synced_before(self, block: int) -> list:
+        """
+        Returns the IDs of claims whose tokens were last fetched in full before `block`, or never.
+
+        Args:
+            block: Block number.
+        """
+        rows = self.conn.execute(
+            "SELECT claimId FROM claims WHERE syncedBlock IS NULL OR syncedBlock < ? ORDER BY rowid",
+            (block,)
+        )
+        return [row[0] for row in rows]
+
+    def unindexed_claims(self) -> list:
+        """Returns the IDs of claims whose tokens have never been indexed at a known block."""
+        rows = self.conn.execute("SELECT claimId FROM claims WHERE indexedBlock IS NULL ORDER BY rowid")
+        return [row[0] for row in rows]
+
+    def oldest_indexed_block(self) -> int:
+        """Returns the lowest block any claim's tokens were indexed at, or None."""
+        return self.conn.execute("SELECT MIN(indexedBlock) FROM claims").fetchone()[0]
+
+    def upsert_claim(self, record: dict, block: int = None) -> None:
+        """
+        Inserts or replaces a claim record, including its tokens.
+
+        Args:
+            record: Claim record as built by `hypercert_accounting.create_claim_record`.
+            block: Block number the record's tokens were fetched at.
+        """
+        allowlist = MerkleAllowlist.from_json(record["allowlist"])
+        row = (
+            record["claimId"],
+            record["createdAt"],
+            record["createdDate"],
+            record["creatorAddress"],
+            record["ownerAddress"],
+            record["totalUnits"],
+            record["metadataUri"],
+            record["allowlistUri"],
+            json.dumps(record["metadata"]),
+            allowlist.addresses.tobytes(),
+            json.dumps(allowlist.units.tolist()),
+            json.dumps(record["supabaseList"]),
+            block,
+            block
+        )
+        placeholders = ", ".join("?" for _ in CLAIM_COLUMNS)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in CLAIM_COLUMNS[1:])
+        with self.conn:
+            self.conn.execute(
+                f"INSERT INTO claims ({', '.join(CLAIM_COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT (claimId) DO UPDATE SET {updates}",
+                row
+            )
+            self._sync_tokens(record["claimId"], record["userClaims"], block)
+
+    def sync_tokens(self, claim_id: str, tokens: list, block: int) -> int:
+        """
+        Brings a claim's stored tokens in line with a fresh fetch.
+
+        Only tokens that are new or whose owner or units changed are written,
+        and tokens that no longer exist are removed. The claim's indexed and
+        fully synced blocks are advanced to `block`.
+
+        Args:
+            claim_id: The ID of the claim.
+            tokens: The claim's complete list of tokens at `block`.
+            block: Block number the tokens were fetched at.
+
+        Returns:
+            Number of token rows written or removed.
+        """
+        with self.conn:
+            changed = self._sync_tokens(claim_id, tokens, block)
+            self.conn.execute("UPDATE claims SET indexedBlock = ?, syncedBlock = ? WHERE claimId = ?",
+                              (block, block, claim_id))
+        return changed
+
+    def merge_tokens(self, tokens_by_claim: dict, claim_ids: list, block: int) -> int:
+        """
+        Applies token changes fetched since the claims were last indexed.
+
+        Unlike `sync_tokens`, stored tokens missing from the changes are kept.
+        The indexed block of every claim in `claim_ids` is advanced to `block`.
+
+        Args:
+            tokens_by_claim: Dictionary mapping claim IDs to their changed tokens.
+            claim_ids: IDs of the claims the changes cover.
+            block: Block number the changes were fetched at.
+
+        Returns:
+            Number of token rows written.
+        """
+        with self.conn:
+            changed = sum(
+                self._sync_tokens(claim_id, tokens_by_claim.get(claim_id, []), block, delete=False)
+                for claim_id in claim_ids
+            )
+            self.conn.executemany(
+                "UPDATE claims SET indexedBlock = ? WHERE claimId = ?",
+                [(block, claim_id) for claim_id in claim_ids]
+            )
+        return changed
+
+    def update_supabase_lists(self, supabase_lists: dict) -> int:
+        """
+        Refreshes the cached Supabase addresses of stored claims.
+
+        Args:
+            supabase_lists: Dictionary mapping claim IDs to their current
+                cached addresses; other claims are left as they are.
+
+        Returns:
+            Number of claims whose list changed.
+        """
+        updates = []
+        for claim_id, supabase_list in self.conn.execute("SELECT claimId, supabaseList FROM claims ORDER BY rowid"):
+            addresses = supabase_lists.get(claim_id)
+            if addresses is not None and json.loads(supabase_list) != addresses:
+                updates.append((json.dumps(addresses), claim_id))
+        with self.conn:
+            self.conn.executemany("UPDATE claims SET supabaseList = ? WHERE claimId = ?", updates)
+        return len(updates)
+
+    def _sync_tokens(self, claim_id: str, tokens: list, block: int, delete: bool = True) -> int:
+        if not tokens and not delete:
+            return 0
+        stored = {
+            token_id: (owner, units)
+            for token_id, owner, units in self.conn.execute(
+                "SELECT tokenId, owner, units FROM claim_tokens WHERE claimId = ?", (claim_id,)
+            )
+        }
+        upserts = []
+        for token in tokens:
+            current = (token["owner"], str(token["units"]))
+            if stored.pop(token["id"], None) != current:
+                upserts.append((token["id"], claim_id, *current, block))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO claim_tokens (tokenId, claimId, owner, units, updatedBlock) VALUES (?, ?, ?, ?, ?)",
+            upserts
+        )
+        if not delete:
+            return len(upserts)
+        self.conn.executemany("DELETE FROM claim_tokens WHERE tokenId = ?", [(t,) for t in stored])
+        return len(upserts) + len(stored)
+
+    def iter_claims(self):
+        """
+        Yields every stored claim record, one at a time, in insertion order.
+
+        Records have the same shape as the entries of `hypercertAccounting.json`.
+        """
+        cursor = self.conn.execute(f"SELECT {', '.join(CLAIM_COLUMNS)} FROM claims ORDER BY rowid")
+        for row in cursor:
+            claim = dict(zip(CLAIM_COLUMNS, row))
+            tokens = self.conn.execute(
+                "SELECT tokenId, owner, units FROM claim_tokens WHERE claimId = ? ORDER BY tokenId",
+                (claim["claimId"],)
+            )
+            yield {
+                "claimId": claim["claimId"],
+                "createdAt": claim["createdAt"],
+                "createdDate": claim["createdDate"],
+                "creatorAddress": claim["creatorAddress"],
+                "ownerAddress": claim["ownerAddress"],
+                "totalUnits": claim["totalUnits"],
+                "metadataUri": claim["metadataUri"],
+                "allowlistUri": claim["allowlistUri"],
+                "metadata": json.loads(claim["metadata"]),
+                "allowlist": _allowlist_json(claim["allowlistAddresses"], claim["allowlistUnits"]),
+                "userClaims": [{"id": t, "owner": o, "units": u} for t, o, u in tokens],
+                "supabaseList": json.loads(claim["supabaseList"])
+            }
+
+    def import_json(self, json_filepath: str) -> int:
+        """
+        Loads claim records from a `hypercertAccounting.json` file.
+
+        Args:
+            json_filepath: Path to the JSON file.
+
+        Returns:
+            Number of claims imported.
+        """
+        with open(json_filepath) as f:
+            claims_data = json.load(f)
+        for record in claims_data:
+            self.upsert_claim(record)
+        return len(claims_data)
+
+    def export_json(self, json_filepath: str) -> int:
+        """
+        Writes all claim records to a JSON file in the `hypercertAccounting.json` layout.
+
+        Records are streamed to the file one at a time. The output is the same
+        as `json.dump(records, f, indent=4)`. Allowlists are written in the
+        compact `MerkleAllowlist.to_json` form (base64 addresses and a list of
+        units) rather than as `[address, units]` pairs; `import_json` reads both.
+
+        Args:
+            json_filepath: Path to the JSON file.
+
+        Returns:
+            Number of claims exported.
+        """
+        count = 0
+        with open(json_filepath, "w") as f:
+            f.write("[")
+            for record in self.iter_claims():
+                f.write(",\n    " if count else "\n    ")
+                f.write(json.dumps(record, indent=4).replace("\n", "\n    "))
+                count += 1
+            f.write("\n]" if count else "]")
+        return count
+
+
+def _allowlist_json(addresses: bytes, units: str) -> dict:
+    return {"addresses": base64.b64encode(addresses).decode(), "units": json.loads(units)}
@@ -0,0 +1,199 @@
+"""
+Append-only writer for the CSV files produced by the scripts.
+
+Rows are appended to the CSV in place instead of reloading and rewriting the
+whole file, and rows whose key is already in the file are skipped. The keys
+are read once, when the writer is opened. The header of an existing file is
+kept as is, so appended rows always line up with it.
+
+Every appended batch is also written as a Parquet part file in a directory
+next to the CSV (`userTokenData.csv` -> `userTokenData.parquet/`), which can be read
+in one call with `pd.read_parquet`. The mirror holds the same text as the CSV,
+with empty cells as nulls, and is rebuilt from the CSV if the two disagree.
+"""
+
+import csv
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MIRROR_CHUNK_ROWS = 100000
+APPEND_CHUNK_ROWS = 10000
+
+
+def parquet_mirror_path(csv_filepath: str) -> str:
+    """Returns the Parquet mirror directory of a CSV file."""
+    return os.path.splitext(csv_filepath)[0] + ".parquet"
+
+
+class AppendWriter:
+    """
+    Appends records to a CSV file, skipping keys the file already contains.
+
+    Args:
+        csv_filepath: Path to the CSV file; created on the first append.
+        key: Column that identifies a record.
+        columns: Header for a new file; defaults to the keys of the first record
+            appended. Ignored if the file exists.
+        mirror: Whether to keep the Parquet mirror up to date.
+    """
+
+    def __init__(self, csv_filepath: str, key: str, columns: list = None, mirror: bool = True):
+        self.csv_filepath = csv_filepath
+        self.key = key
+        self.columns = None
+        self.keys = set()
+        self.mirror_path = parquet_mirror_path(csv_filepath) if mirror else None
+
+        n_rows = 0
+        if os.path.exists(csv_filepath) and os.path.getsize(csv_filepath):
+            with open(csv_filepath, newline="") as f:
+                self.columns = next(csv.reader(f))
+            if key not in self.columns:
+                raise ValueError(f"{csv_filepath} has no {key} column")
+            keys = pd.read_csv(csv_filepath, usecols=[key], dtype=str)[key]
+            self.keys = set(keys.dropna())
+            n_rows = len(keys)
+        elif columns:
+            self.columns = list(columns)
+        if self.mirror_path and _mirror_rows(self.mirror_path) != n_rows:
+            rebuild_mirror(csv_filepath)
+
+    def append(self, records, chunk_rows: int = APPEND_CHUNK_ROWS) -> int:
+        """
+        Appends the records whose key is not in the file yet.
+
+        Records are consumed lazily and written `chunk_rows` at a time, so a
+        generator can be streamed into the file.
+
+        Args:
+            records: Iterable of record dictionaries.
+            chunk_rows: Number of rows per write and per Parquet part file.
+
+        Returns:
+            Number of records written.
+        """
+        written = 0
+        new_rows = []
+        for record in records:
+            key = str(record[self.key])
+            if key in self.keys:
+                continue
+            self.keys.add(key)
+            if self.columns is None:
+                self.columns = [self.key] + [c for c in record if c != self.key]
+            new_rows.append(record)
+            if len(new_rows) >= chunk_rows:
+                written += self._write(new_rows)
+                new_rows = []
+        if new_rows:
+            written += self._write(new_rows)
+        return written
+
+    def replace(self, records) -> int:
+        """
+        Replaces the rows of the given records' keys with the records.
+
+        The file is streamed through a temporary copy without the old rows,
+        and the records are written at its end. Records with new keys are
+        simply appended. The Parquet mirror is rebuilt afterwards.
+
+        Args:
+            records: Iterable of record dictionaries.
+
+        Returns:
+            Number of records written.
+        """
+        by_key = {str(record[self.key]): record for record in records}
+        if not by_key:
+            return 0
+        if self.columns is None:
+            return self.append(by_key.values())
+
+        tmp_path = f"{self.csv_filepath}.tmp"
+        with open(tmp_path, "w", newline="") as out:
+            csv.writer(out, lineterminator="\n").writerow(self.columns)
+            if os.path.exists(self.csv_filepath) and os.path.getsize(self.csv_filepath):
+                chunks = pd.read_csv(self.csv_filepath, dtype=str, keep_default_na=False, chunksize=MIRROR_CHUNK_ROWS)
+                for chunk in chunks:
+                    chunk = chunk[~chunk[self.key].isin(by_key)]
+                    chunk.to_csv(out, header=False, index=False, lineterminator="\n")
+            writer = csv.DictWriter(out, fieldnames=self.columns, extrasaction="ignore", lineterminator="\n")
+            writer.writerows(by_key.values())
+        os.replace(tmp_path, self.csv_filepath)
+        self.keys.update(by_key)
+        if self.mirror_path:
+            rebuild_mirror(self.csv_filepath)
+        return len(by_key)
+
+    def _write(self, rows: list) -> int:
+        dropped = set().union(*(r.keys() for r in rows)) - set(self.columns)
+        if dropped:
+            print(f"Columns not in the header of {self.csv_filepath} are not written: {sorted(dropped)}")
+
+        write_header = not os.path.exists(self.csv_filepath) or not os.path.getsize(self.csv_filepath)
+        with open(self.csv_filepath, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns, extrasaction="ignore", lineterminator="\n")
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+
+        if self.mirror_path:
+            write_mirror_part(self.mirror_path, pd.DataFrame(
+                [[cell_text(r.get(c)) for c in self.columns] for r in rows],
+                columns=self.columns
+            ))
+        return len(rows)
+
+
+def rebuild_mirror(csv_filepath: str, chunksize: int = MIRROR_CHUNK_ROWS) -> None:
+    """
+    Replaces the Parquet mirror of a CSV file with a fresh copy of the file.
+
+    Args:
+        csv_filepath: Path to the CSV file; if it is missing, the mirror is emptied.
+        chunksize: Number of rows per part file.
+    """
+    mirror_path = parquet_mirror_path(csv_filepath)
+    print(f"Rebuilding Parquet mirror of {csv_filepath}...")
+    if os.path.isdir(mirror_path):
+        for name in os.listdir(mirror_path):
+            os.remove(os.path.join(mirror_path, name))
+    if os.path.exists(csv_filepath) and os.path.getsize(csv_filepath):
+        for df in pd.read_csv(csv_filepath, dtype=str, chunksize=chunksize):
+            write_mirror_part(mirror_path, df.astype("object").where(df.notna(), None))
+
+
+def write_mirror_part(mirror_path: str, df: pd.DataFrame) -> None:
+    """
+    Adds a DataFrame of CSV cell text to a Parquet mirror directory as a new part file.
+
+    Args:
+        mirror_path: The mirror directory; created if missing.
+        df: Rows to write, with None for empty cells.
+    """
+    os.makedirs(mirror_path, exist_ok=True)
+    n = sum(1 for name in os.listdir(mirror_path) if name.endswith(".parquet"))
+    part_path = os.path.join(mirror_path, f"part-{n:05d}.parquet")
+    tmp_path = os.path.join(mirror_path, f".part-{n:05d}.tmp")
+    schema = pa.schema([(c, pa.string()) for c in df.columns])
+    pq.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False), tmp_path)
+    os.replace(tmp_path, part_path)
+
+
+def cell_text(value) -> str:
+    """Returns the text of a CSV cell as stored in the Parquet mirror, with None for empty cells."""
+    if value is None or value == "" or value != value:
+        return None
+    return str(value)
+
+
+def _mirror_rows(mirror_path: str) -> int:
+    if not os.path.isdir(mirror_path):
+        return 0
+    return sum(
+        pq.read_metadata(os.path.join(mirror_path, name)).num_rows
+        for name in os.listdir(mirror_path) if name.endswith(".parquet")
+    )
@@ -0,0 +1,518 @@
+"""
+Local stand-ins for The Graph, an IPFS gateway and Supabase's PostgREST API.
+
+The servers serve a synthetic, deterministic portfolio of hypercerts so the
+accounting scripts can be run end to end without touching production
+endpoints. Only the parts of each protocol the scripts use are implemented:
+
+- GraphQL: `_meta`, `allowlists`, `claims` and (aliased) `claimTokens`
+  selections with `first`, `skip`, `orderBy`, `id_gt`, `creation`,
+  `creation_gt`, `creation_gte` and `_change_block` arguments
+- IPFS: `GET /ipfs/<cid>` for claim metadata and StandardMerkleTree allowlists
+- PostgREST: `GET`, `POST` (insert/upsert) and `PATCH` on `/rest/v1/<table>`
+  with `eq`, `neq`, `gt`, `gte`, `lt`, `lte`, `in` and `is` filters,
+  `order`, `offset`/`limit`, `Prefer: count=exact` and a max-rows cap
+
+Every server counts requests and bytes in both directions.
+"""
+
+import json
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlparse
+
+CONTRACT = "0x822f17a9a5eecfd66dbaff7946a8071c265d1d07"
+BASE_CREATION = 1680000000
+INDEXED_BLOCK = 110000000
+POSTGREST_MAX_ROWS = 1000
+
+
+def address(n: int) -> str:
+    return "0x" + format(n * 2654435761 % (1 << 160), "040x")
+
+
+class Portfolio:
+    """
+    A synthetic set of hypercert claims with allowlists and tokens.
+
+    Args:
+        n_claims: Number of claims.
+        allowlist_size: Allowlist entries per claim.
+        tokens_per_claim: Claimed tokens per claim.
+        image_bytes: Size of the base64 image embedded in each metadata file.
+        existing_fraction: Share of claims already present in the claims table.
+    """
+
+    def __init__(self, n_claims: int, allowlist_size: int = 50, tokens_per_claim: int = 20,
+                 image_bytes: int = 20000, existing_fraction: float = 0.1):
+        self.n_claims = n_claims
+        self.allowlist_size = allowlist_size
+        self.tokens_per_claim = tokens_per_claim
+        self.image_bytes = image_bytes
+        self.existing_fraction = existing_fraction
+        self.block = INDEXED_BLOCK
+        # tokenId -> (block, owner) of ownership changes made after creation
+        self.token_changes = {}
+        self.claims = [self._claim(i) for i in range(n_claims)]
+        self.claims_by_id = {c["id"]: c for c in self.claims}
+        self.index = {c["id"]: i for i, c in enumerate(self.claims)}
+
+    def _claim(self, i: int) -> dict:
+        return {
+            "id": f"{CONTRACT}-{(i + 1) << 128}",
+            "creation": str(BASE_CREATION + i // 3 * 60),
+            "creator": address(i),
+            "owner": address(i),
+            "totalUnits": "10000",
+            "uri": f"ipfs://bafymeta{i:07d}"
+        }
+
+    def allowlist(self, i: int) -> list:
+        return [[address(i * 7 + j), str(1 + j % 9)] for j in range(self.allowlist_size)]
+
+    def tokens(self, claim_id: str) -> list:
+        i = self.index[claim_id]
+        tokens = [
+            {
+                "id": f"{claim_id}-{j:06d}",
+                "owner": address(i * 7 + j),
+                "units": str(1 + j % 9),
+                "claim": {"id": claim_id, "totalUnits": "10000", "creator": address(i)}
+            }
+            for j in range(self.tokens_per_claim)
+        ]
+        for token in tokens:
+            if token["id"] in self.token_changes:
+                token["owner"] = self.token_changes[token["id"]][1]
+        return tokens
+
+    def transfer(self, token_id: str, owner: str) -> None:
+        """Changes the owner of a token in a new block."""
+        self.block += 1
+        self.token_changes[token_id] = (self.block, owner)
+
+    def changed_tokens(self, since_block: int) -> list:
+        changed = {}
+        for token_id, (block, _) in self.token_changes.items():
+            if block >= since_block:
+                claim_id = token_id.rsplit("-", 1)[0]
+                changed.setdefault(claim_id, set()).add(token_id)
+        return [t for claim_id, ids in changed.items() for t in self.tokens(claim_id) if t["id"] in ids]
+
+    def metadata(self, i: int) -> dict:
+        return {
+            "name": f"Hypercert {i}",
+            "description": f"Synthetic hypercert number {i} for benchmarking",
+            "image": "data:image/png;base64," + "A" * self.image_bytes,
+            "external_url": "",
+            "allowList": f"ipfs://bafyallowlist{i:07d}",
+            "properties": [{"trait_type": "Collection", "value": "Benchmark"}],
+            "hypercert": {
+                "work_scope": {"name": "Work Scope", "value": [f"scope-{i % 13}"], "display_value": f"scope-{i % 13}"},
+                "impact_scope": {"name": "Impact Scope", "value": ["all"], "display_value": "all"},
+                "work_timeframe": {"name": "Work Timeframe", "value": [BASE_CREATION, BASE_CREATION + 86400]},
+                "impact_timeframe": {"name": "Impact Timeframe", "value": [BASE_CREATION, 0]},
+                "contributors": {"name": "Contributors", "value": [address(i)]},
+                "rights": {"name": "Rights", "value": ["Public Display"]}
+            }
+        }
+
+    def merkle_dump(self, i: int) -> str:
+        values = self.allowlist(i)
+        dump = {
+            "format": "standard-v1",
+            "tree": ["0x" + format(i * 31 + k, "064x") for k in range(2 * len(values) - 1)],
+            "values": [{"value": v, "treeIndex": len(values) - 1 + k} for k, v in enumerate(values)],
+            "leafEncoding": ["address", "uint256"]
+        }
+        return json.dumps(dump)
+
+    def postgrest_tables(self) -> dict:
+        cache = []
+        for i, claim in enumerate(self.claims):
+            for addr, _ in self.allowlist(i)[::2]:
+                cache.append({"id": len(cache) + 1, "claimId": claim["id"], "address": addr})
+        allowlist_source = [
+            {"id": n + 1, "address": row["address"], "project": f"project-{n % 97}"}
+            for n, row in enumerate(cache[::3])
+        ]
+        existing = [
+            {
+                "id": i + 1,
+                "claimId": claim["id"],
+                "createdAt": int(claim["creation"]),
+                "creatorAddress": claim["creator"],
+                "totalUnits": int(claim["totalUnits"]),
+                "title": f"Hypercert {i}",
+                "hidden": i % 20 == 0
+            }
+            for i, claim in enumerate(self.claims[:int(self.n_claims * self.existing_fraction)])
+        ]
+        return {
+            "optimism-allowlistCache": cache,
+            "gtc-alpha-allowlist": allowlist_source,
+            "claims-metadata-mapping": existing
+        }
+
+
+class Counters:
+    """Thread-safe request and byte counters for one server."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, bytes_in: int, bytes_out: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def as_dict(self) -> dict:
+        return {"requests": self.requests, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status: int, body: bytes, bytes_in: int, headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.service.counters.add(bytes_in, len(body))
+
+
+_selection = re.compile(r"(?:(\w+)\s*:\s*)?(_meta|allowlists|claims|claimTokens)\s*(\((.*?)\))?\s*\{", re.S)
+_argument = {
+    "first": re.compile(r"first:\s*(\d+)"),
+    "skip": re.compile(r"skip:\s*(\d+)"),
+    "claim": re.compile(r'claim:\s*"([^"]*)"'),
+    "claim_in": re.compile(r"claim_in:\s*\[([^\]]*)\]"),
+    "id_gt": re.compile(r'id_gt:\s*"([^"]*)"'),
+    "creation_gt": re.compile(r'creation_gt:\s*"?(\d+)"?'),
+    "creation_gte": re.compile(r'creation_gte:\s*"?(\d+)"?'),
+    "creation": re.compile(r'\bcreation:\s*"?(\d+)"?'),
+    "order_by": re.compile(r"orderBy:\s*(\w+)"),
+    "change_block": re.compile(r"_change_block:\s*\{\s*number_gte:\s*(\d+)"),
+}
+
+
+class FakeGraph:
+    """A GraphQL endpoint serving the portfolio's claims and claim tokens."""
+
+    def __init__(self, portfolio: Portfolio):
+        self.portfolio = portfolio
+        self.counters = Counters()
+
+    def handle(self, query: str) -> dict:
+        data = {}
+        for match in _selection.finditer(query):
+            alias, field, _, args = match.groups()
+            args = {k: p.search(args or "") for k, p in _argument.items()}
+            args = {k: m.group(1) for k, m in args.items() if m}
+            data[alias or field] = getattr(self, f"_{field.strip('_')}")(args)
+        return {"data": data}
+
+    def _meta(self, args: dict) -> dict:
+        return {"block": {"number": self.portfolio.block}}
+
+    def _claims_page(self, args: dict) -> list:
+        claims = self.portfolio.claims
+        if "creation_gt" in args:
+            claims = [c for c in claims if int(c["creation"]) > int(args["creation_gt"])]
+        if "creation_gte" in args:
+            claims = [c for c in claims if int(c["creation"]) >= int(args["creation_gte"])]
+        if "creation" in args:
+            claims = [c for c in claims if int(c["creation"]) == int(args["creation"])]
+        if "id_gt" in args:
+            claims = [c for c in claims if c["id"] > args["id_gt"]]
+        # Like graph-node, ties in the sort column are broken by id
+        key = args.get("order_by", "id").split("__")[-1]
+        claims = sorted(claims, key=lambda c: (int(c["creation"]) if key == "creation" else c[key], c["id"]))
+        skip = int(args.get("skip", 0))
+        return claims[skip:skip + int(args.get("first", 100))]
+
+    def _allowlists(self, args: dict) -> list:
+        # An allowlist shares its claim's ID
+        return [{"id": claim["id"], "claim": claim} for claim in self._claims_page(args)]
+
+    def _claims(self, args: dict) -> list:
+        return self._claims_page(args)
+
+    def _claimTokens(self, args: dict) -> list:
+        if "claim" in args:
+            claim_ids = [args["claim"]]
+        elif "claim_in" in args:
+            claim_ids = re.findall(r'"([^"]*)"', args["claim_in"])
+        else:
+            claim_ids = [c["id"] for c in self.portfolio.claims]
+        if "change_block" in args:
+            claim_ids = set(claim_ids)
+            tokens = [t for t in self.portfolio.changed_tokens(int(args["change_block"]))
+                      if t["claim"]["id"] in claim_ids]
+        else:
+            tokens = [t for claim_id in claim_ids if claim_id in self.portfolio.index
+                      for t in self.portfolio.tokens(claim_id)]
+        tokens = [t for t in tokens if t["id"] > args.get("id_gt", "")]
+        tokens.sort(key=lambda t: t["id"])
+        return tokens[:int(args.get("first", 100))]
+
+    def handler(self):
+        service = self
+
+        class Handler(_Handler):
+            def do_POST(self):
+                body = self._body()
+                response = service.handle(json.loads(body)["query"])
+                self._send(200, json.dumps(response).encode(), len(body))
+
+        Handler.service = service
+        return Handler
+
+
+class FakeIPFS:
+    """An IPFS gateway serving the portfolio's metadata and merkle tree dumps."""
+
+    def __init__(self, portfolio: Portfolio):
+        self.portfolio = portfolio
+        self.counters = Counters()
+
+    def content(self, cid: str) -> bytes:
+        if cid.startswith("bafymeta"):
+            return json.dumps(self.portfolio.metadata(int(cid[len("bafymeta"):]))).encode()
+        if cid.startswith("bafyallowlist"):
+            return json.dumps(self.portfolio.merkle_dump(int(cid[len("bafyallowlist"):]))).encode()
+        return None
+
+    def handler(self):
+        service = self
+
+        class Handler(_Handler):
+            def do_GET(self):
+                cid = urlparse(self.path).path.split("/ipfs/", 1)[-1]
+                body = service.content(cid)
+                if body is None:
+                    self._send(404, b'{"error": "not found"}', 0)
+                else:
+                    self._send(200, body, 0)
+
+        Handler.service = service
+        return Handler
+
+
+def _split_list(value: str) -> list:
+    items = re.findall(r'"((?:[^"\\]|\\.)*)"|([^,]+)', value)
+    return [quoted or bare for quoted, bare in items]
+
+
+def _coerce(value, target):
+    if isinstance(target, bool):
+        return value == "true"
+    if isinstance(target, int):
+        return int(value)
+    return value
+
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, value = expression.partition(".")
+    current = row.get(column)
+    if op == "is":
+        result = current is None if value == "null" else current is (value == "true")
+    elif op == "in":
+        result = current in [_coerce(v, current) for v in _split_list(value[1:-1])]
+    elif current is None:
+        result = False
+    else:
+        value = _coerce(value, current)
+        result = {
+            "eq": current == value, "neq": current != value, "gt": current > value,
+            "gte": current >= value, "lt": current < value, "lte": current <= value
+        }[op]
+    return result != negate
+
+
+class FakePostgREST:
+    """A PostgREST endpoint backed by in-memory tables."""
+
+    def __init__(self, tables: dict, max_rows: int = POSTGREST_MAX_ROWS):
+        self.tables = tables
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.counters = Counters()
+
+    def _filtered(self, table: str, params: list) -> list:
+        rows = self.tables.setdefault(table, [])
+        for column, expression in params:
+            if column in ("select", "order", "offset", "limit", "on_conflict", "columns"):
+                continue
+            rows = [row for row in rows if _matches(row, column, expression)]
+        return rows
+
+    def select(self, table: str, params: list) -> tuple:
+        with self.lock:
+            rows = self._filtered(table, params)
+        args = dict(params)
+        for term in reversed(args.get("order", "").split(",")):
+            if term:
+                column, _, direction = term.partition(".")
+                rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)),
+                              reverse=direction.startswith("desc"))
+        total = len(rows)
+        offset = int(args.get("offset", 0))
+        limit = min(int(args.get("limit", self.max_rows)), self.max_rows)
+        rows = rows[offset:offset + limit]
+        columns = [c.strip() for c in args.get("select", "*").split(",")]
+        if columns != ["*"]:
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+        return rows, total, offset
+
+    def insert(self, table: str, params: list, payload, prefer: str) -> list:
+        records = payload if isinstance(payload, list) else [payload]
+        conflict = [c for c in dict(params).get("on_conflict", "").split(",") if c]
+        with self.lock:
+            rows = self.tables.setdefault(table, [])
+            if conflict:
+                keyed = {tuple(r.get(c) for c in conflict): r for r in rows}
+            for record in records:
+                key = tuple(record.get(c) for c in conflict)
+                if conflict and key in keyed:
+                    if "resolution=merge-duplicates" in prefer:
+                        keyed[key].update(record)
+                    continue
+                row = dict(record)
+                row.setdefault("id", len(rows) + 1)
+                rows.append(row)
+                if conflict:
+                    keyed[key] = row
+        return records
+
+    def update(self, table: str, params: list, payload: dict) -> list:
+        with self.lock:
+            rows = self._filtered(table, params)
+            for row in rows:
+                row.update(payload)
+        return rows
+
+    def handler(self):
+        service = self
+
+        class Handler(_Handler):
+            def _request(self):
+                url = urlparse(self.path)
+                table = unquote(url.path.rsplit("/", 1)[-1])
+                return table, parse_qsl(url.query, keep_blank_values=True)
+
+            def do_GET(self):
+                table, params = self._request()
+                rows, total, offset = service.select(table, params)
+                headers = {"Content-Range": f"{offset}-{offset + len(rows) - 1}/{total}"}
+                self._send(200, json.dumps(rows).encode(), 0, headers)
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_POST(self):
+                table, params = self._request()
+                body = self._body()
+                payload = json.loads(body)
+                if isinstance(payload, list) and len({tuple(sorted(r)) for r in payload}) > 1:
+                    # PostgREST needs the same keys in every object of a bulk payload
+                    error = {"code": "PGRST102", "message": "All object keys must match"}
+                    self._send(400, json.dumps(error).encode(), len(body))
+                    return
+                records = service.insert(table, params, payload, self.headers.get("Prefer", ""))
+                self._send(201, json.dumps(records).encode(), len(body))
+
+            def do_PATCH(self):
+                table, params = self._request()
+                body = self._body()
+                rows = service.update(table, params, json.loads(body))
+                self._send(200, json.dumps(rows).encode(), len(body))
+
+        Handler.service = service
+        return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients killed mid-request (e.g. by a benchmark timeout) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeServices:
+    """
+    Runs the fake Graph, IPFS and PostgREST servers on local ports.
+
+    Attributes:
+        env: Environment variables pointing the scripts at the fake servers.
+    """
+
+    def __init__(self, portfolio: Portfolio):
+        self.portfolio = portfolio
+        self.graph = FakeGraph(portfolio)
+        self.ipfs = FakeIPFS(portfolio)
+        self.postgrest = FakePostgREST(portfolio.postgrest_tables())
+        self.servers = []
+        self.env = {}
+
+    def start(self) -> "FakeServices":
+        urls = []
+        for service in (self.graph, self.ipfs, self.postgrest):
+            server = _Server(("127.0.0.1", 0), service.handler())
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+            urls.append(f"http://127.0.0.1:{server.server_port}")
+        self.env = {
+            "HYPERCERTS_SUBGRAPH_URL": f"{urls[0]}/subgraphs/name/hypercerts",
+            "IPFS_GATEWAY": f"{urls[1]}/ipfs/",
+            "IPFS_GATEWAYS": f"{urls[1]}/ipfs/",
+            "SUPABASE_URL": urls[2],
+            "SUPABASE_KEY": "benchmark-anon-key",
+        }
+        return self
+
+    def stop(self) -> None:
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def reset_counters(self) -> None:
+        for service in (self.graph, self.ipfs, self.postgrest):
+            service.counters.reset()
+
+    def counters(self) -> dict:
+        return {
+            "graph": self.graph.counters.as_dict(),
+            "ipfs": self.ipfs.counters.as_dict(),
+            "postgrest": self.postgrest.counters.as_dict()
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
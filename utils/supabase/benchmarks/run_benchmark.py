@@ -0,0 +1,148 @@
+"""
+Offline benchmark for the accounting scripts.
+
+Runs each pipeline against the local fake services in `fake_services.py` at
+several portfolio sizes and reports throughput, request counts, bytes
+transferred and peak memory. Every run happens in a fresh child process with
+its own working directory and IPFS cache, and is repeated once with both kept
+to measure a warm rerun.
+
+Usage:
+
+    python benchmarks/run_benchmark.py [--sizes 100 1000 10000] [--pipelines accounting mapper]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_services import FakeServices, Portfolio
+
+SUPABASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = [100, 1000, 10000]
+PIPELINES = ["accounting", "mapper"]
+DEFAULT_TIMEOUT = 900
+
+
+def run_pipeline(pipeline: str) -> None:
+    """Runs one pipeline in the current process and working directory."""
+    sys.path.insert(0, SUPABASE_DIR)
+    if pipeline == "accounting":
+        import hypercert_accounting
+        hypercert_accounting.update_hypercert_accounting()
+        hypercert_accounting.reconcile_claims()
+    elif pipeline == "mapper":
+        import claims_metadata_mapper
+        claims_metadata_mapper.main()
+    else:
+        raise ValueError(f"Unknown pipeline {pipeline}")
+
+
+def child_main(pipeline: str, result_path: str) -> None:
+    """Entry point of a benchmark child process; writes timing and peak RSS to `result_path`."""
+    start = time.perf_counter()
+    run_pipeline(pipeline)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    with open(result_path, "w") as f:
+        json.dump({"seconds": elapsed, "peak_rss": peak_rss}, f)
+
+
+def claims_processed(pipeline: str, services: FakeServices, workdir: str) -> int:
+    """Counts the claims a pipeline has recorded."""
+    if pipeline == "accounting":
+        db_path = os.path.join(workdir, "data", "hypercertAccounting.db")
+        if not os.path.exists(db_path):
+            return 0
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM claims").fetchone()[0]
+        finally:
+            conn.close()
+    return len(services.postgrest.tables.get("claims-metadata-mapping", []))
+
+
+def run_once(pipeline: str, services: FakeServices, workdir: str, cache_dir: str, timeout: int) -> dict:
+    """Runs a pipeline in a child process against the fake services."""
+    services.reset_counters()
+    before = claims_processed(pipeline, services, workdir)
+    result_path = os.path.join(workdir, "result.json")
+    env = dict(os.environ, **services.env, IPFS_CACHE_DIR=cache_dir, GRAPH_RATE_LIMIT="100000")
+    command = [sys.executable, os.path.abspath(__file__), "--child", pipeline, result_path]
+    start = time.perf_counter()
+    try:
+        subprocess.run(command, cwd=workdir, env=env, check=True, timeout=timeout,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        with open(result_path) as f:
+            result = json.load(f)
+        result["status"] = "ok"
+    except subprocess.TimeoutExpired:
+        result = {"seconds": time.perf_counter() - start, "peak_rss": None, "status": "timeout"}
+    except subprocess.CalledProcessError as e:
+        error = e.stderr.decode(errors="replace").strip().splitlines()
+        result = {"seconds": time.perf_counter() - start, "peak_rss": None,
+                  "status": "failed: " + (error[-1] if error else str(e))}
+    result["claims"] = claims_processed(pipeline, services, workdir) - before
+    result["claims_per_second"] = result["claims"] / result["seconds"] if result["seconds"] else 0
+    result["services"] = services.counters()
+    return result
+
+
+def benchmark(pipeline: str, size: int, timeout: int) -> list:
+    """Benchmarks a cold and a warm run of a pipeline at one portfolio size."""
+    results = []
+    with FakeServices(Portfolio(size)) as services, tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.join(tmp, "work")
+        os.makedirs(os.path.join(workdir, "data"))
+        cache_dir = os.path.join(tmp, "ipfs")
+        for run in ("cold", "warm"):
+            result = run_once(pipeline, services, workdir, cache_dir, timeout)
+            result.update({"pipeline": pipeline, "size": size, "run": run})
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result: dict) -> None:
+    services = result["services"]
+    requests = " ".join(f"{name}={s['requests']}" for name, s in services.items())
+    transferred = sum(s["bytes_in"] + s["bytes_out"] for s in services.values())
+    rss = f"{result['peak_rss'] / 2 ** 20:.0f} MiB" if result["peak_rss"] else "-"
+    print(f"{result['pipeline']:<10} {result['size']:>6} {result['run']:<4} "
+          f"{result['claims']:>6} claims {result['seconds']:>8.2f}s {result['claims_per_second']:>8.1f} claims/s "
+          f"requests: {requests} bytes: {transferred} peak RSS: {rss} [{result['status']}]", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="portfolio sizes (claims)")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=PIPELINES)
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="seconds allowed per run")
+    parser.add_argument("--output", help="write all results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for pipeline in args.pipelines:
+        for size in args.sizes:
+            results.extend(benchmark(pipeline, size, args.timeout))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child_main(*sys.argv[2:4])
+    else:
+        main()
@@ -1,75 +1,95 @@
 import json
-import pandas as pd
-import re
+import sys
+
+from claim_tags import tag_claims
+from claims_table import load_claims
+from collisions import HYPERCERT, find_collisions
+from near_duplicates import DEFAULT_THRESHOLD, claim_texts, find_near_duplicates
 
 CSV_FILEPATH = "data/claimsData.csv"
 OUTPATH = "data/collisionsData.json"
+NEAR_DUPLICATES_OUTPATH = "data/nearDuplicatesData.json"
 COLS = ['claimId', 'title', 'creatorAddress', 'date', 'totalUnits', 'properties', 'hypercert']
-
-
-def tagger(x):
-    search = lambda ss, s: re.search(ss, s, re.IGNORECASE)
-    if isinstance(x['title'], str):
-        if isinstance(x['properties'], str) and search("gitcoin", x['properties']):
-            return "1. Gitcoin"
-        if search("givegratitude", x['title']):
-            return "2. GiveGratitude.io"
-        if search("zuzalu", x['title']) or search("zuzalu", x['hypercert']):
-            return "3. Zuzalu"
-        if x['totalUnits'] != 10000:
-            return "4. Other Community Generated"
-    return "5. Random (No Collection, No Allowlist)"
+# Read when the snapshot has them; work scopes come from the typed snapshot
+OPTIONAL_COLS = ['description', 'work_scope']
 
 
 def load_csv(path=CSV_FILEPATH):
-    df = pd.read_csv(path, index_col='claimId', usecols=COLS)
-    df['tag'] = df.apply(tagger, axis=1)
+    df = load_claims(path, columns=COLS + OPTIONAL_COLS).set_index('claimId')
+    df['tag'] = tag_claims(df)
     df.sort_values(by='date', inplace=True)
     return df
 
 
 def check_collisions(df):
-    collision_list = []
+    ids = df.index.to_numpy()
+    creators = df['creatorAddress'].to_numpy()
+    hypercerts = df['hypercert'].to_numpy()
+    titles = df['title'].to_numpy()
+    tags = df['tag'].to_numpy()
+
+    collision_list = [False] * len(df)
+    collisions = []
+    for i, j, match in find_collisions(df['hypercert'], df['title']):
+        creator = "same" if creators[i] == creators[j] else "diff"
+        if match == HYPERCERT:
+            case = f'duplicate claim in hyperspace ({creator} creator)'
+            details = hypercerts[i]
+        else:
+            case = f'duplicate title in hypercerts ({creator} creator)'
+            details = f"Title is {titles[i]}"
+        collisions.append({
+            'id': ids[i],
+            'creator': creators[i],
+            'collision': ids[j],
+            'case': case,
+            'details': details,
+            'tag': tags[i]
+        })
+        collision_list[i] = True
+    return collision_list, collisions
+
+
+def check_near_duplicates(df, threshold=DEFAULT_THRESHOLD):
+    ids = df.index.to_numpy()
+    creators = df['creatorAddress'].to_numpy()
+    titles = df['title'].to_numpy()
+    tags = df['tag'].to_numpy()
+
+    collision_list = [False] * len(df)
     collisions = []
-    for i, (id1, row1) in enumerate(df.iterrows()):
-        collision = False
-        tag = row1['tag']
-        for (id2, row2) in df.head(i).iterrows():
-            creator = "same" if row1['creatorAddress'] == row2['creatorAddress'] else "diff"
-            if row1['hypercert'] == row2['hypercert']:
-                collisions.append({
-                    'id': id1,
-                    'creator': row1['creatorAddress'],
-                    'collision': id2,
-                    'case': f'duplicate claim in hyperspace ({creator} creator)',
-                    'details': row1['hypercert'],
-                    'tag': tag
-                })
-                collision = True
-            elif row1['title'] == row2['title'] and row1['title'] != 'The name of your hypercert':
-                collisions.append({
-                    'id': id1,
-                    'creator': row1['creatorAddress'],
-                    'collision': id2,
-                    'case': f'duplicate title in hypercerts ({creator} creator)',
-                    'details': f"Title is {row1['title']}",
-                    'tag': tag
-                })
-                collision = True
-        collision_list.append(collision)
+    for i, j, similarity in find_near_duplicates(claim_texts(df), threshold):
+        creator = "same" if creators[i] == creators[j] else "diff"
+        collisions.append({
+            'id': ids[i],
+            'creator': creators[i],
+            'collision': ids[j],
+            'case': f'near-duplicate claim ({creator} creator)',
+            'details': f"Similarity {similarity:.2f}; titles are {titles[i]} and {titles[j]}",
+            'tag': tags[i]
+        })
+        collision_list[i] = True
     return collision_list, collisions
 
 
-def run_analysis():
+def run_analysis(near_duplicates=False, threshold=DEFAULT_THRESHOLD):
     df = load_csv()
-    collision_list, collisions_data = check_collisions(df)
+    if near_duplicates:
+        collision_list, collisions_data = check_near_duplicates(df, threshold)
+        outpath = NEAR_DUPLICATES_OUTPATH
+    else:
+        collision_list, collisions_data = check_collisions(df)
+        outpath = OUTPATH
     df['collisions'] = collision_list
 
     pdf = df.pivot_table(index='tag', columns='collisions', values='date', aggfunc='count')
     print(pdf)
-    with open(OUTPATH, 'w') as f:
+    with open(outpath, 'w') as f:
         json.dump(collisions_data, f, indent=4)
 
 
 if __name__ == "__main__":
-    run_analysis()
+    if sys.argv[1:2] == ["near-duplicates"]:
+        run_analysis(near_duplicates=True, threshold=float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THRESHOLD)
+    else:
+        run_analysis()
@@ -0,0 +1,94 @@
+"""
+Vectorized tagging of claims by collection.
+
+Tags are assigned by a declarative rule table (`tag_rules.json` by default):
+
+    {"default": "...", "requires": ["title"], "rules": [{"tag": "...", "any": [condition, ...]}, ...]}
+
+A claim gets the tag of the first rule with any matching condition, or the
+default tag if none matches or a column in `requires` is not text. A condition
+is one of:
+
+    {"column": "properties", "contains": "gitcoin"}    case-insensitive regex search in a text column
+    {"column": "totalUnits", "equal": 10000}
+    {"column": "totalUnits", "not_equal": 10000}
+
+Patterns are compiled once and every condition is evaluated over whole
+columns, so adding a collection adds one vectorized pass rather than per-row work.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+TAG_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tag_rules.json")
+
+
+def load_tag_rules(path: str = TAG_RULES_PATH) -> dict:
+    """
+    Loads a tag rule table, compiling its patterns.
+
+    Args:
+        path: Path to the JSON rule table.
+
+    Returns:
+        The rule table, with each `contains` pattern compiled.
+    """
+    with open(path) as f:
+        table = json.load(f)
+    for rule in table["rules"]:
+        for condition in rule["any"]:
+            if "contains" in condition:
+                condition["contains"] = re.compile(condition["contains"], re.IGNORECASE)
+            elif "equal" not in condition and "not_equal" not in condition:
+                raise ValueError(f"Unknown condition in tag rule {rule['tag']}: {condition}")
+    return table
+
+
+def _is_text(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_string_dtype(values.dtype) and values.dtype != object:
+        return values.notna()
+    return values.map(lambda v: isinstance(v, str)).astype(bool)
+
+
+def _matches(df: pd.DataFrame, condition: dict) -> pd.Series:
+    values = df[condition["column"]]
+    if "contains" in condition:
+        # Only text is searched; a column with no text at all is not a string column
+        text = _is_text(values)
+        matched = pd.Series(False, index=values.index)
+        matched[text] = values[text].astype(str).str.contains(condition["contains"])
+        return matched
+    if "equal" in condition:
+        return values == condition["equal"]
+    return values != condition["not_equal"]
+
+
+def tag_claims(df: pd.DataFrame, rules: dict = None) -> pd.Series:
+    """
+    Tags every claim with the first matching rule of a rule table.
+
+    Args:
+        df: Claims with the columns the rules refer to.
+        rules: Rule table as returned by `load_tag_rules`; defaults to `tag_rules.json`.
+
+    Returns:
+        Series of tags, aligned with `df`.
+    """
+    if rules is None:
+        rules = load_tag_rules()
+    eligible = np.ones(len(df), dtype=bool)
+    for column in rules.get("requires", []):
+        eligible &= _is_text(df[column]).to_numpy()
+
+    conditions = []
+    for rule in rules["rules"]:
+        matched = np.zeros(len(df), dtype=bool)
+        for condition in rule["any"]:
+            matched |= _matches(df, condition).to_numpy()
+        conditions.append(eligible & matched)
+    tags = np.select(conditions, [rule["tag"] for rule in rules["rules"]], default=rules["default"])
+    return pd.Series(tags, index=df.index, dtype=object)
@@ -1,11 +1,22 @@
 import os
 import json
-import pandas as pd
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 from supabase import create_client, Client
 
+import claims_table
+import graph_client
+import ipfs_cache
+import ipfs_gateways
+import subgraph
+import supabase_prefetch
+import supabase_snapshot
+from append_writer import AppendWriter
+
 load_dotenv()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
@@ -13,6 +24,20 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 TABLE_NAME = "claims-metadata-mapping"
 CSV_FILEPATH = "data/claimsData.csv"
+WATERMARK_PATH = "data/claimsWatermark.json"
+METADATA_KEYS = ["name", "properties", "hypercert"]
+
+PAGE_SIZE = subgraph.PAGE_SIZE
+
+# Claim records are upserted in chunks of UPSERT_BATCH_SIZE, up to
+# UPSERT_MAX_WORKERS chunks at a time; overridable with CLAIMS_UPSERT_BATCH_SIZE
+# and CLAIMS_UPSERT_MAX_WORKERS
+UPSERT_BATCH_SIZE = 500
+UPSERT_MAX_WORKERS = 4
+UPSERT_MAX_RETRIES = 3
+UPSERT_RETRY_DELAY = 1
+# Postgres error raised when no unique constraint matches the ON CONFLICT columns
+NO_UNIQUE_CONSTRAINT = "42P10"
 
 
 def timestamp_to_date_string(timestamp: str) -> str:
@@ -21,26 +46,26 @@ def timestamp_to_date_string(timestamp: str) -> str:
     return datetime.fromtimestamp(int(timestamp)).strftime(fmt)
 
 
-def get_claims_with_offset(offset: int = 0) -> list:
-    """Fetches claims from The Graph with a given offset."""
-    # query = f'''
-    #     {{
-    #         claims(          
-    #             first: 1000
-    #             skip: {offset}
-    #             orderBy: creation
-    #         ) {{
-    #             id
-    #             totalUnits
-    #             uri
-    #             creator
-    #             creation    
-    #         }}
-    #     }}
-    #'''
+def get_claims_page(creation: int = 0, last_id: str = None) -> list:
+    """
+    Fetches a page of allowlists and their claims, ordered by claim creation time, then allowlist ID.
 
+    Pages are keyed on (creation, id): with `last_id`, the page holds the
+    allowlists of claims created at exactly `creation` with IDs after
+    `last_id`; without it, those of claims created after `creation`.
+    """
+    if last_id is None:
+        where = f'claim_: {{ creation_gt: "{creation}" }}'
+    else:
+        where = f'claim_: {{ creation: "{creation}" }}, id_gt: "{last_id}"'
     query = f'''{{
-          allowlists(first: 1000) {{
+          allowlists(
+            first: {PAGE_SIZE}
+            orderBy: claim__creation
+            orderDirection: asc
+            where: {{ {where} }}
+          ) {{
+            id
             claim {{
               id
               totalUnits
@@ -52,43 +77,63 @@ def get_claims_with_offset(offset: int = 0) -> list:
         }}
     '''
 
-    url = "https://api.thegraph.com/subgraphs/name/hypercerts-admin/hypercerts-optimism-mainnet"
-    response = requests.post(url, json={'query': query})
-    json_data = response.json()
-    data = [x['claim'] for x in json_data['data']['allowlists']]
+    json_data = subgraph.query_subgraph(query)
+    data = json_data['allowlists']
     print(f"Total of {len(data)} claims fetched this request.")
     return data
 
 
-def get_all_claims() -> list:
-    """Fetches all claims from The Graph."""
+def get_all_claims(watermark: dict = None) -> list:
+    """
+    Fetches all claims with allowlists from The Graph created since the watermark.
+
+    Each claim carries the ID of its allowlist as `allowlistId`; claims are
+    returned in the order they were paged.
+    """
+    watermark = watermark or {"creation": 0}
+    creation, last_id = int(watermark["creation"]), watermark.get("id", "")
     all_claims = []
-    offset = 0
     while True:
-        claims = get_claims_with_offset(offset)
-        if not claims:
-            break
-        all_claims.extend(claims)
-        if len(claims) < 1000:
+        page = get_claims_page(creation, last_id)
+        all_claims.extend(dict(a["claim"], allowlistId=a["id"]) for a in page)
+        if len(page) == PAGE_SIZE:
+            creation, last_id = int(page[-1]["claim"]["creation"]), page[-1]["id"]
+        elif last_id is not None:
+            # Every claim at this creation time has been read; move on to later ones
+            last_id = None
+        else:
             break
-        offset += 1000
-    print(f"The Graph shows a total of {len(all_claims)} hypercert claims with allowlists.")
+    print(f"The Graph shows a total of {len(all_claims)} new hypercert claims with allowlists.")
     return all_claims
 
 
-def retrieve_ipfs_file(cid: str) -> dict:
-    """Fetches JSON data from IPFS using the given content identifier (CID)."""
-    url = f"https://cloudflare-ipfs.com/ipfs/{cid}"
-    print(f"Fetching: {url}")
+def load_watermark(watermark_path: str = WATERMARK_PATH) -> dict:
+    """Loads the paging cursor of the last sync, or None if there is none."""
+    if not os.path.exists(watermark_path):
+        return None
+    with open(watermark_path) as f:
+        return json.load(f)
+
+
+def advance_watermark(watermark: dict, claims: list) -> dict:
+    """Moves the watermark to the (creation, allowlist ID) cursor of the last of the claims fetched by `get_all_claims`."""
+    if not claims:
+        return watermark
+    return {"creation": int(claims[-1]["creation"]), "id": claims[-1]["allowlistId"]}
+
+
+def save_watermark(watermark: dict, watermark_path: str = WATERMARK_PATH) -> None:
+    """Atomically writes the watermark to disk."""
+    tmp_path = f"{watermark_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermark, f)
+    os.replace(tmp_path, watermark_path)
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = json.loads(response.content)
-        return data
-    except requests.exceptions.HTTPError as e:
-        print(e)
-    return None
+
+def retrieve_ipfs_file(cid: str) -> dict:
+    """Fetches the metadata fields used by `create_claim_record` from IPFS, via the local cache."""
+    print(f"Fetching: {cid}")
+    return ipfs_cache.retrieve_ipfs_metadata(cid, keys=METADATA_KEYS)
 
 
 def create_claim_record(claim: dict, metadata: dict) -> dict:
@@ -125,56 +170,118 @@ def parse_claims(list_of_claims: list, existing_claims: list) -> list:
     return claims
 
 
-def store_claims_in_supabase(claims: list):
-    """Stores the claim records in the Supabase table."""
-    for claim in claims:
-        print(f"Adding {claim['title']} claim to Supabase.")
-        supabase.table(TABLE_NAME).insert(claim).execute()
+def upsert_claims_chunk(claims: list) -> None:
+    """
+    Upserts one chunk of claim records into the Supabase table in a single request.
+
+    The upsert relies on a unique constraint on `claimId`, which
+    `claims-metadata-mapping` must have.
+    """
+    supabase.table(TABLE_NAME).upsert(claims, on_conflict="claimId", returning=ReturnMethod.minimal).execute()
+
+
+def store_claims_in_supabase(claims: list, batch_size: int = None, max_workers: int = None,
+                             max_retries: int = UPSERT_MAX_RETRIES) -> None:
+    """
+    Upserts the claim records into the Supabase table in parallel chunks, retrying failed chunks.
+
+    PostgREST rejects a bulk payload whose objects have different keys, so
+    fields some records lack (e.g. the metadata fields of claims whose
+    metadata could not be fetched) are set to None first. A missing unique
+    constraint on `claimId` fails the run at once instead of being retried.
+    """
+    columns = list(dict.fromkeys(key for claim in claims for key in claim))
+    claims = [{column: claim.get(column) for column in columns} for claim in claims]
+    batch_size = batch_size or int(os.environ.get("CLAIMS_UPSERT_BATCH_SIZE") or UPSERT_BATCH_SIZE)
+    max_workers = max_workers or int(os.environ.get("CLAIMS_UPSERT_MAX_WORKERS") or UPSERT_MAX_WORKERS)
+    chunks = [claims[i:i + batch_size] for i in range(0, len(claims), batch_size)]
+    pending = list(range(len(chunks)))
+    written = 0
+    start = time.monotonic()
+    for attempt in range(max_retries + 1):
+        if attempt:
+            print(f"Retrying {len(pending)} failed chunks...")
+            time.sleep(UPSERT_RETRY_DELAY * 2 ** (attempt - 1))
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(upsert_claims_chunk, chunks[i]): i for i in pending}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    future.result()
+                    written += len(chunks[i])
+                except APIError as e:
+                    if e.code == NO_UNIQUE_CONSTRAINT:
+                        raise RuntimeError(f"{TABLE_NAME} needs a unique constraint on claimId: {e.message}") from e
+                    print(f"Failed to upsert chunk {i} ({len(chunks[i])} claims): {e}")
+                    failed.append(i)
+                except Exception as e:
+                    print(f"Failed to upsert chunk {i} ({len(chunks[i])} claims): {e}")
+                    failed.append(i)
+        pending = sorted(failed)
+        if not pending:
+            break
+
+    elapsed = time.monotonic() - start
+    rate = written / elapsed if elapsed else 0
+    print(f"Upserted {written} claims to Supabase in {elapsed:.1f}s ({rate:.1f} rows/s).")
+    if pending:
+        raise RuntimeError(f"{len(pending)} of {len(chunks)} chunks could not be stored in Supabase")
 
 
-def fetch_claim_ids_from_supabase() -> list:
-    """Fetches claim IDs from the Supabase table."""
-    response = supabase.table(TABLE_NAME).select("claimId").execute()
-    claims = response.data
-    claim_ids = [c["claimId"] for c in claims]
+def fetch_claim_ids_from_supabase(claim_ids: list = None) -> list:
+    """Fetches claim IDs from the Supabase table, optionally only those among `claim_ids`."""
+    if claim_ids is None:
+        build_query = lambda: supabase.table(TABLE_NAME).select("claimId", count="exact").order("claimId")
+        rows = supabase_prefetch.fetch_all_rows(build_query)
+    else:
+        rows = []
+        chunk_size = supabase_prefetch.CLAIM_CHUNK_SIZE
+        for i in range(0, len(claim_ids), chunk_size):
+            chunk = claim_ids[i:i + chunk_size]
+            build_query = lambda: (supabase.table(TABLE_NAME)
+                                   .select("claimId", count="exact")
+                                   .in_("claimId", chunk)
+                                   .order("claimId"))
+            rows.extend(supabase_prefetch.fetch_all_rows(build_query))
+    claim_ids = [c["claimId"] for c in rows]
     print(f"Supabase shows a total of {len(claim_ids)} hypercert claims.")
     return claim_ids
 
 
 def save_supabase_snapshot_to_csv(csv_filepath: str = CSV_FILEPATH) -> None:
-    """Saves a snapshot of the Supabase table to a CSV file."""
-    response = supabase.table(TABLE_NAME).select("*").execute()
-    claims = response.data
-    df = pd.DataFrame(claims)
-    df.set_index("claimId", inplace=True)
-    df.to_csv(csv_filepath)
+    """Saves a snapshot of the Supabase table to a CSV file, fetching only changed rows when possible."""
+    change_column = os.environ.get("CLAIMS_SNAPSHOT_CHANGE_COLUMN")
+    supabase_snapshot.update_table(supabase, TABLE_NAME, csv_filepath, key="claimId", change_column=change_column)
 
 
 def append_to_csv_file(claims: list, csv_filepath: str = CSV_FILEPATH) -> None:
-    """Appends the claim records to the local CSV file."""
-    if not os.path.exists(csv_filepath):
-        df = pd.DataFrame(columns=claims[0].keys())
-        df.set_index("claimId", inplace=True)
-        df.to_csv(csv_filepath)
-
-    df = pd.read_csv(csv_filepath, index_col="claimId")
-    for claim in claims:
-        new_row = pd.Series(claim, name=claim["claimId"])
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        df.to_csv(csv_filepath)
+    """Appends the new claim records to the local CSV file and its typed copy."""
+    current = claims_table.is_current(csv_filepath)
+    added = AppendWriter(csv_filepath, key="claimId", mirror=False).append(claims)
+    if current:
+        claims_table.add_rows(claims, csv_filepath)
+    print(f"Appended {added} claim records to {csv_filepath}.")
 
 
 def main():
     
     save_supabase_snapshot_to_csv()
     
-    claims_data = get_all_claims()
-    existing_claim_ids = fetch_claim_ids_from_supabase()
+    watermark = load_watermark()
+    claims_data = get_all_claims(watermark)
+    existing_claim_ids = set(fetch_claim_ids_from_supabase([c["id"] for c in claims_data]))
     new_claims = parse_claims(claims_data, existing_claim_ids)
 
     if new_claims:
         store_claims_in_supabase(new_claims)
         append_to_csv_file(new_claims)
+    watermark = advance_watermark(watermark, claims_data)
+    if watermark:
+        save_watermark(watermark)
+
+    graph_client.print_stats()
+    ipfs_gateways.print_stats()
     
 
 if __name__ == "__main__":
@@ -0,0 +1,283 @@
+"""
+Typed, columnar copy of the claims snapshot for the analysis scripts.
+
+`data/claimsData.csv` holds every value as text, with the `properties` and
+`hypercert` fields as stringified dictionaries. The Supabase snapshot and the
+claims metadata mapper write their rows to a Parquet file with typed columns
+as they write the CSV, from the parsed values, and a load only converts the
+CSV itself, chunk by chunk, if the Parquet file is missing or older:
+
+- `creatorAddress` as a dictionary (categorical) column
+- `createdAt` and `totalUnits` as int64, `date` as a timestamp
+- the `hypercert` dimensions as structured columns: `work_scope`,
+  `impact_scope`, `contributors` and `rights` as lists of strings, and
+  `work_timeframe_start`/`_end` and `impact_timeframe_start`/`_end` as
+  timestamps (an open-ended timeframe has a null end)
+
+The `properties` and `hypercert` text is kept as is, since the collision and
+tagging rules compare and search it. Other columns are kept as text.
+
+Loads are memory-mapped and read only the requested columns, and can keep
+only the claims with a given work scope without parsing any text.
+"""
+
+import ast
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from append_writer import cell_text
+
+CSV_FILEPATH = "data/claimsData.csv"
+CHUNK_ROWS = 100000
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+DIMENSIONS = ["work_scope", "impact_scope", "contributors", "rights"]
+TIMEFRAMES = ["work_timeframe", "impact_timeframe"]
+
+COLUMN_TYPES = {
+    "claimId": pa.string(),
+    "title": pa.string(),
+    "creatorAddress": pa.dictionary(pa.int32(), pa.string()),
+    "createdAt": pa.int64(),
+    "date": pa.timestamp("s"),
+    "totalUnits": pa.int64(),
+    "properties": pa.string(),
+    "hypercert": pa.string(),
+}
+HYPERCERT_TYPES = {
+    **{dimension: pa.list_(pa.string()) for dimension in DIMENSIONS},
+    **{f"{timeframe}_{end}": pa.timestamp("s") for timeframe in TIMEFRAMES for end in ("start", "end")},
+}
+
+
+def table_path(csv_filepath: str = CSV_FILEPATH) -> str:
+    """Returns the path of the typed Parquet copy of a claims CSV file."""
+    return os.path.splitext(csv_filepath)[0] + ".typed.parquet"
+
+
+def parse_field(value):
+    """
+    Parses a `properties` or `hypercert` field as stored in the claims CSV.
+
+    Args:
+        value: JSON or Python literal text, or an already parsed value.
+
+    Returns:
+        The parsed value, or None if it is missing or unreadable.
+    """
+    if not isinstance(value, str):
+        return value if isinstance(value, (dict, list)) else None
+    try:
+        return json.loads(value)
+    except ValueError:
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return None
+
+
+def dimension_values(hypercert: dict, dimension: str) -> list:
+    """Returns the values of one dimension of a parsed `hypercert` field, or None if it has none."""
+    if not isinstance(hypercert, dict):
+        return None
+    field = hypercert.get(dimension)
+    values = field.get("value") if isinstance(field, dict) else field
+    if values is None:
+        return None
+    return [str(v) for v in values] if isinstance(values, list) else [str(values)]
+
+
+def _timestamp(value) -> int:
+    try:
+        seconds = int(value)
+    except (TypeError, ValueError):
+        return None
+    # The minting form uses 0 for an indefinite end
+    return seconds if seconds > 0 else None
+
+
+def _typed_chunk(chunk: pd.DataFrame, hypercerts: list = None) -> pa.Table:
+    arrays, fields = [], []
+    for column in chunk.columns:
+        values = chunk[column]
+        arrow_type = COLUMN_TYPES.get(column, pa.string())
+        if arrow_type == pa.int64():
+            values = pd.to_numeric(values, errors="coerce").astype("Int64")
+        elif arrow_type == pa.timestamp("s"):
+            values = pd.to_datetime(values, format=DATE_FORMAT, errors="coerce").astype("datetime64[s]")
+        else:
+            values = values.astype(object).where(values.notna(), None)
+        arrays.append(pa.array(values, type=arrow_type, from_pandas=True))
+        fields.append(pa.field(column, arrow_type))
+
+    if "hypercert" in chunk.columns:
+        if hypercerts is None:
+            hypercerts = [parse_field(value) for value in chunk["hypercert"]]
+        for dimension in DIMENSIONS:
+            arrays.append(pa.array([dimension_values(h, dimension) for h in hypercerts], type=pa.list_(pa.string())))
+            fields.append(pa.field(dimension, pa.list_(pa.string())))
+        for timeframe in TIMEFRAMES:
+            bounds = [dimension_values(h, timeframe) or [] for h in hypercerts]
+            for k, end in enumerate(("start", "end")):
+                seconds = [_timestamp(b[k]) if len(b) > k else None for b in bounds]
+                arrays.append(pa.array(seconds, type=pa.int64()).cast(pa.timestamp("s")))
+                fields.append(pa.field(f"{timeframe}_{end}", pa.timestamp("s")))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def typed_rows(records: list, columns: list) -> pa.Table:
+    """
+    Converts claim records into typed rows, as they would be read from the CSV they are written to.
+
+    Every value is converted from the text it is written as, except the
+    `hypercert` dimensions, which are taken from the parsed field.
+
+    Args:
+        records: Record dictionaries, e.g. rows of the Supabase table.
+        columns: Header of the CSV file; other fields are left out.
+
+    Returns:
+        Table of the records, with the schema of the typed copy.
+    """
+    chunk = pd.DataFrame([[cell_text(record.get(c)) for c in columns] for record in records],
+                         columns=columns, dtype=object)
+    hypercerts = [parse_field(record.get("hypercert")) for record in records]
+    return _typed_chunk(chunk, hypercerts)
+
+
+def is_current(csv_filepath: str = CSV_FILEPATH) -> bool:
+    """Returns whether a claims CSV file and its typed copy exist, and the copy is not older than the CSV."""
+    path = table_path(csv_filepath)
+    return (os.path.exists(csv_filepath) and os.path.exists(path)
+            and os.path.getmtime(path) >= os.path.getmtime(csv_filepath))
+
+
+def add_rows(records: list, csv_filepath: str = CSV_FILEPATH, key: str = "claimId", replace: bool = False) -> int:
+    """
+    Applies records just written to a claims CSV file to its typed copy.
+
+    Like `AppendWriter`, records whose key is already in the table are
+    skipped, or with `replace` take the place of the old rows at the end of
+    the table. Only call this if the copy was current before the CSV was
+    written; otherwise it is rebuilt from the CSV on the next load.
+
+    Args:
+        records: Record dictionaries written to the CSV.
+        csv_filepath: Path to the claims CSV file.
+        key: Column that identifies a record.
+        replace: Whether records replace existing rows with the same key.
+
+    Returns:
+        Number of rows written.
+    """
+    path = table_path(csv_filepath)
+    table = pq.read_table(path)
+    by_key = {}
+    for record in records:
+        # The last record of a key replaces, the first is appended
+        if replace or str(record[key]) not in by_key:
+            by_key[str(record[key])] = record
+    existing = pc.is_in(table[key], value_set=pa.array(list(by_key), type=pa.string()))
+    if replace:
+        table = table.filter(pc.invert(existing))
+    else:
+        for known in table[key].filter(existing).to_pylist():
+            del by_key[known]
+    records = list(by_key.values())
+    columns = [c for c in table.column_names if c not in HYPERCERT_TYPES]
+    table = pa.concat_tables([table, typed_rows(records, columns).cast(table.schema)])
+    pq.write_table(table, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    return len(records)
+
+
+def write_claims_table(csv_filepath: str = CSV_FILEPATH, path: str = None, chunksize: int = CHUNK_ROWS) -> int:
+    """
+    Converts a claims CSV file into its typed Parquet copy.
+
+    The CSV is read `chunksize` rows at a time, each chunk becoming a row
+    group, and the file is swapped in when complete.
+
+    Args:
+        csv_filepath: Path to the claims CSV file.
+        path: Path of the Parquet file; defaults to `table_path(csv_filepath)`.
+        chunksize: Number of rows per row group.
+
+    Returns:
+        Number of rows written.
+    """
+    path = path or table_path(csv_filepath)
+    tmp_path = f"{path}.tmp"
+    count = 0
+    writer = None
+    try:
+        for chunk in pd.read_csv(csv_filepath, dtype=str, chunksize=chunksize):
+            table = _typed_chunk(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+            count += len(chunk)
+        if writer is None:
+            columns = pd.read_csv(csv_filepath, dtype=str, nrows=0)
+            writer = pq.ParquetWriter(tmp_path, _typed_chunk(columns).schema)
+        writer.close()
+        writer = None
+        os.replace(tmp_path, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"Wrote {count} claims to {path}.")
+    return count
+
+
+def ensure_claims_table(csv_filepath: str = CSV_FILEPATH) -> str:
+    """Rebuilds the typed Parquet copy of a claims CSV file if it is missing or older than the CSV, and returns its path."""
+    path = table_path(csv_filepath)
+    if not is_current(csv_filepath):
+        write_claims_table(csv_filepath, path)
+    return path
+
+
+def _contains(lists: pa.ChunkedArray, value: str) -> np.ndarray:
+    lists = lists.combine_chunks()
+    mask = np.zeros(len(lists), dtype=bool)
+    parents = pc.list_parent_indices(lists)
+    matches = pc.equal(pc.list_flatten(lists), value)
+    mask[parents.filter(matches).to_numpy()] = True
+    return mask
+
+
+def load_claims(csv_filepath: str = CSV_FILEPATH, columns: list = None, work_scope: str = None) -> pd.DataFrame:
+    """
+    Loads claims from the typed Parquet copy of a claims CSV file.
+
+    Args:
+        csv_filepath: Path to the claims CSV file; its typed copy is rebuilt if stale.
+        columns: Columns to read; columns missing from the snapshot are left out.
+            Defaults to every column.
+        work_scope: If given, only claims with this work scope are returned.
+
+    Returns:
+        DataFrame of claims, with `creatorAddress` as a categorical column.
+    """
+    path = ensure_claims_table(csv_filepath)
+    available = pq.read_schema(path).names
+    if columns is not None:
+        columns = [c for c in columns if c in available]
+    read_columns = columns
+    if work_scope is not None and columns is not None and "work_scope" not in columns:
+        read_columns = columns + ["work_scope"]
+    table = pq.read_table(path, columns=read_columns, memory_map=True)
+    if work_scope is not None:
+        table = table.filter(pa.array(_contains(table["work_scope"], work_scope)))
+        if columns is not None:
+            table = table.select(columns)
+    return table.to_pandas()
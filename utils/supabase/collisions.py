@@ -0,0 +1,201 @@
+"""
+Collision detection shared by `claim_stats.py` and `gtc_collisions.py`.
+
+A claim collides with every earlier claim (in DataFrame order) that has the
+same `hypercert` value, or failing that the same title. Instead of comparing
+every pair of rows, rows are grouped by hypercert and by title through
+`pd.factorize`, and only rows in a group of two or more are visited. A row's
+collisions are the earlier members of its two groups, so the cost is a sort of
+the rows plus the number of collisions reported.
+
+Missing values never match, and neither does the placeholder title of the
+hypercert minting form.
+
+`CollisionIndex` keeps the hypercerts and titles already checked on disk,
+looked up by hash, so that later runs only check the claims added since.
+"""
+
+import hashlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+HYPERCERT = "hypercert"
+TITLE = "title"
+IGNORED_TITLES = ["The name of your hypercert"]
+
+
+def _groups(codes: np.ndarray) -> dict:
+    # Maps every row in a group of two or more rows sharing a code (-1 never
+    # matches) to its group's positions in ascending order and its rank in it
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    groups = {}
+    for start, end in zip(starts, ends):
+        if end - start > 1 and sorted_codes[start] >= 0:
+            group = order[start:end]
+            for rank, position in enumerate(group.tolist()):
+                groups[position] = (group, rank)
+    return groups
+
+
+def _earlier(groups: dict, position: int) -> np.ndarray:
+    group, rank = groups.get(position, (None, 0))
+    return group[:rank] if rank else np.empty(0, dtype=np.intp)
+
+
+def find_collisions(hypercerts: pd.Series, titles: pd.Series, ignored_titles: list = IGNORED_TITLES):
+    """
+    Finds the earlier rows each row collides with.
+
+    Args:
+        hypercerts: The `hypercert` column, in the order rows are compared.
+        titles: The `title` column, in the same order.
+        ignored_titles: Titles that never count as a match.
+
+    Yields:
+        (i, j, case) tuples, where row `j` comes before row `i` and `case` is
+        `HYPERCERT` if their hypercerts are equal or `TITLE` if only their
+        titles are. Tuples are ordered by `i`, then by `j`.
+    """
+    hypercert_codes = pd.factorize(np.asarray(hypercerts, dtype=object))[0]
+    title_codes = pd.factorize(np.asarray(titles, dtype=object))[0]
+    title_codes[np.asarray(pd.Series(titles).isin(ignored_titles))] = -1
+
+    hypercert_groups = _groups(hypercert_codes)
+    title_groups = _groups(title_codes)
+    for i in sorted(hypercert_groups.keys() | title_groups.keys()):
+        same_hypercert = _earlier(hypercert_groups, i)
+        same_title = _earlier(title_groups, i)
+        if not len(same_title):
+            for j in same_hypercert.tolist():
+                yield i, j, HYPERCERT
+        elif not len(same_hypercert):
+            for j in same_title.tolist():
+                yield i, j, TITLE
+        else:
+            hypercert_matches = set(same_hypercert.tolist())
+            for j in np.union1d(same_hypercert, same_title).tolist():
+                yield i, j, HYPERCERT if j in hypercert_matches else TITLE
+
+
+def _text(value) -> str:
+    # The value as stored in a `CollisionIndex`; missing values (None or NaN) are NULL
+    if value is None or value != value:
+        return None
+    return str(value)
+
+
+def fingerprint(value) -> int:
+    """Returns a signed 64-bit hash of a hypercert or title value, as stored in a `CollisionIndex`."""
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class CollisionIndex:
+    """
+    Persistent fingerprints of the claims already checked for collisions.
+
+    The index is a SQLite database holding, for every checked claim, its
+    position in the order claims were checked, its creator, its hypercert and
+    title, and 64-bit hashes of both. New claims are checked against it by hash
+    lookups, and a hash hit only counts if the stored value is equal too, so a
+    run costs time proportional to the new claims and their collisions, not to
+    the whole snapshot.
+
+    Changes made by `add` are only saved by `commit`, so that a caller can
+    write its results first.
+
+    Args:
+        db_path: Path to the SQLite database; created if missing.
+        ignored_titles: Titles that never count as a match.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS claims (
+        position INTEGER PRIMARY KEY,
+        claimId TEXT NOT NULL UNIQUE,
+        creatorAddress TEXT,
+        hypercert TEXT,
+        title TEXT
+    );
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        kind INTEGER,
+        hash INTEGER,
+        position INTEGER,
+        PRIMARY KEY (kind, hash, position)
+    ) WITHOUT ROWID;
+    """
+
+    KINDS = {HYPERCERT: 0, TITLE: 1}
+
+    def __init__(self, db_path: str, ignored_titles: list = IGNORED_TITLES):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(self.SCHEMA)
+        self.ignored_titles = set(ignored_titles)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM claims").fetchone()[0]
+
+    def claim_ids(self) -> set:
+        """Returns the IDs of every claim in the index."""
+        return {claim_id for claim_id, in self.conn.execute("SELECT claimId FROM claims")}
+
+    def _fingerprints(self, hypercert, title) -> list:
+        fingerprints = []
+        if _text(hypercert) is not None:
+            fingerprints.append((self.KINDS[HYPERCERT], fingerprint(hypercert), _text(hypercert)))
+        if _text(title) is not None and title not in self.ignored_titles:
+            fingerprints.append((self.KINDS[TITLE], fingerprint(title), _text(title)))
+        return fingerprints
+
+    def add(self, claim_ids, creators, hypercerts, titles):
+        """
+        Adds new claims to the index, after the claims already in it, and finds their collisions.
+
+        Args:
+            claim_ids: IDs of the new claims, in the order they are checked.
+            creators: Creator addresses of the new claims.
+            hypercerts: `hypercert` values of the new claims.
+            titles: Titles of the new claims.
+
+        Yields:
+            (k, claim_id, creator, case) tuples for each new claim `k` (its
+            position in the arguments) and each earlier claim it collides with,
+            ordered by `k`, then by the earlier claim's position. `case` is
+            `HYPERCERT` or `TITLE`, as in `find_collisions`.
+        """
+        position = self.conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM claims").fetchone()[0]
+        for k, (claim_id, creator, hypercert, title) in enumerate(zip(claim_ids, creators, hypercerts, titles)):
+            fingerprints = self._fingerprints(hypercert, title)
+            matches = {}
+            for kind, value, text in fingerprints:
+                # The hash narrows the lookup down; the stored value rules out hash collisions
+                column = "hypercert" if kind == 0 else "title"
+                rows = self.conn.execute(
+                    "SELECT f.position, c.claimId, c.creatorAddress FROM fingerprints f "
+                    f"JOIN claims c ON c.position = f.position WHERE f.kind = ? AND f.hash = ? AND c.{column} = ?",
+                    (kind, value, text)
+                )
+                for earlier, earlier_id, earlier_creator in rows:
+                    # Hypercert fingerprints are looked up first and take precedence
+                    matches.setdefault(earlier, (earlier_id, earlier_creator, HYPERCERT if kind == 0 else TITLE))
+            for earlier in sorted(matches):
+                yield (k, *matches[earlier])
+
+            self.conn.execute(
+                "INSERT INTO claims (position, claimId, creatorAddress, hypercert, title) VALUES (?, ?, ?, ?, ?)",
+                (position, claim_id, None if creator != creator else creator, _text(hypercert), _text(title))
+            )
+            self.conn.executemany("INSERT INTO fingerprints (kind, hash, position) VALUES (?, ?, ?)",
+                                  [(kind, value, position) for kind, value, _ in fingerprints])
+            position += 1
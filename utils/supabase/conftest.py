@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Several scripts create their Supabase client at import time; tests that
+# need one point it at a fake server
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
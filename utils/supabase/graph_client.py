@@ -0,0 +1,223 @@
+"""
+Shared GraphQL client for The Graph.
+
+Every script that queries a subgraph goes through `GraphClient`, which keeps a
+pooled keep-alive session, asks for gzip-compressed responses, limits the
+request rate with a token bucket shared by all threads, retries 429/5xx
+responses and connection failures with jittered exponential backoff, raises
+GraphQL `errors` instead of returning empty data, and records per-query
+latency.
+"""
+
+import os
+import random
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_MAX_RETRIES = 5
+REQUEST_TIMEOUT = 60
+POOL_SIZE = 16
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_query_name = re.compile(r"\{\s*(?:\w+\s*:\s*)?(\w+)")
+
+
+class GraphQLError(Exception):
+    """Raised when a GraphQL endpoint fails or returns `errors`."""
+
+    def __init__(self, message: str, errors: list = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how often requests may start.
+
+    Args:
+        rate: Tokens added per second.
+        capacity: Maximum number of tokens, i.e. the largest burst allowed.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class GraphClient:
+    """
+    Client for one GraphQL endpoint, safe to share across threads.
+
+    Args:
+        url: The GraphQL endpoint.
+        rate_limit: Maximum requests per second; None or 0 disables limiting.
+        max_retries: Number of retries for retryable failures.
+        timeout: Per-request timeout in seconds.
+        pool_size: Maximum number of pooled keep-alive connections.
+    """
+
+    def __init__(self, url: str, rate_limit: float = DEFAULT_RATE_LIMIT, max_retries: int = DEFAULT_MAX_RETRIES,
+                 timeout: float = REQUEST_TIMEOUT, pool_size: int = POOL_SIZE):
+        self.url = url
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def query(self, query: str, variables: dict = None, name: str = None) -> dict:
+        """
+        Sends a GraphQL query and returns its data.
+
+        Args:
+            query: The GraphQL query string.
+            variables: Optional query variables.
+            name: Name to record latency under; defaults to the first field queried.
+
+        Returns:
+            Response data in dictionary format.
+
+        Raises:
+            GraphQLError: If the request keeps failing or the response contains `errors`.
+        """
+        name = name or _name_of(query)
+        payload = {"query": query}
+        if variables:
+            payload["variables"] = variables
+
+        for attempt in range(self.max_retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            start = time.monotonic()
+            retry_after = None
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+                elapsed = time.monotonic() - start
+                if response.status_code in RETRY_STATUS_CODES:
+                    failure = f"HTTP {response.status_code}"
+                    retry_after = _retry_after(response)
+                else:
+                    response.raise_for_status()
+                    json_data = response.json()
+                    self._record(name, elapsed, len(response.content), attempt)
+                    if json_data.get("errors"):
+                        messages = "; ".join(e.get("message", str(e)) for e in json_data["errors"])
+                        raise GraphQLError(f"{name}: {messages}", json_data["errors"])
+                    return json_data.get("data") or {}
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                failure = str(e)
+            except (requests.exceptions.HTTPError, ValueError) as e:
+                raise GraphQLError(f"{name}: {e}") from e
+
+            if attempt == self.max_retries:
+                break
+            delay = retry_after if retry_after is not None else _backoff(attempt)
+            print(f"Retrying {name} in {delay:.1f}s after {failure}")
+            time.sleep(delay)
+
+        with self._stats_lock:
+            self._stats.setdefault(name, _new_stats())["failures"] += 1
+        raise GraphQLError(f"{name}: giving up after {self.max_retries + 1} attempts ({failure})")
+
+    def _record(self, name: str, elapsed: float, size: int, retries: int) -> None:
+        with self._stats_lock:
+            stats = self._stats.setdefault(name, _new_stats())
+            stats["requests"] += 1
+            stats["retries"] += retries
+            stats["bytes"] += size
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def stats(self) -> dict:
+        """Returns a copy of the per-query metrics recorded so far."""
+        with self._stats_lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def print_stats(self) -> None:
+        """Prints a per-query latency summary."""
+        for name, stats in sorted(self.stats().items()):
+            mean = stats["total_seconds"] / stats["requests"] if stats["requests"] else 0
+            print(f"{name}: {stats['requests']} requests, {stats['retries']} retries, "
+                  f"{stats['failures']} failures, mean {mean:.3f}s, max {stats['max_seconds']:.3f}s, "
+                  f"{stats['bytes']} bytes")
+
+
+def _new_stats() -> dict:
+    return {"requests": 0, "retries": 0, "failures": 0, "bytes": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+
+
+def _name_of(query: str) -> str:
+    match = _query_name.search(query)
+    return match.group(1) if match else "query"
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: a random delay up to the exponential bound
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_after(response) -> float:
+    try:
+        return min(BACKOFF_MAX, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url: str) -> GraphClient:
+    """
+    Returns the process-wide client for an endpoint, creating it on first use.
+
+    The rate limit and retry count are read from `GRAPH_RATE_LIMIT` and
+    `GRAPH_MAX_RETRIES` when the client is created.
+
+    Args:
+        url: The GraphQL endpoint.
+    """
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = GraphClient(
+                url,
+                rate_limit=float(os.environ.get("GRAPH_RATE_LIMIT") or DEFAULT_RATE_LIMIT),
+                max_retries=int(os.environ.get("GRAPH_MAX_RETRIES") or DEFAULT_MAX_RETRIES)
+            )
+        return _clients[url]
+
+
+def print_stats() -> None:
+    """Prints the latency summary of every client created with `get_client`."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        client.print_stats()
@@ -1,67 +1,137 @@
 import json
-import pandas as pd
-import re
+import os
+import sys
 
+from claim_tags import tag_claims
 from claims_metadata_mapper import save_supabase_snapshot_to_csv
+from claims_table import DATE_FORMAT, load_claims
+from collisions import HYPERCERT, CollisionIndex, find_collisions
+from near_duplicates import DEFAULT_THRESHOLD, claim_texts, find_near_duplicates
 
 
 CSV_FILEPATH = "data/claimsData.csv"
 OUTPATH = "data/gitcoinCollisionsData.json"
+NEAR_DUPLICATES_OUTPATH = "data/gitcoinNearDuplicatesData.json"
+INDEX_PATH = "data/gitcoinCollisionIndex.db"
 COLS = ['claimId', 'title', 'creatorAddress', 'date', 'totalUnits', 'properties', 'hypercert']
-
-
-def tagger(x):
-    search = lambda ss, s: re.search(ss, s, re.IGNORECASE)
-    if isinstance(x['title'], str):
-        if isinstance(x['properties'], str) and search("gitcoin", x['properties']):
-            return True
-    return False
+# Read when the snapshot has them; work scopes come from the typed snapshot
+OPTIONAL_COLS = ['description', 'work_scope']
+GITCOIN_TAG = "1. Gitcoin"
 
 
 def load_csv(path=CSV_FILEPATH):
-    df = pd.read_csv(path, index_col='claimId', usecols=COLS)
-    df['tag'] = df.apply(tagger, axis=1)
+    df = load_claims(path, columns=COLS + OPTIONAL_COLS).set_index('claimId')
+    df['tag'] = tag_claims(df) == GITCOIN_TAG
     df = df[df['tag'] == True]
-    df.sort_values(by='date', inplace=True)
+    # A stable sort keeps the order of claims with the same date from run to run
+    df.sort_values(by='date', inplace=True, kind='stable')
     return df
 
 
+def collision_record(id1, id2, creator1, creator2, date, title, match):
+    if creator1 == creator2:
+        creator = "same creator"
+    else:
+        creator = f"by {creator1} & {creator2}"
+    if match == HYPERCERT:
+        case = f'duplicate claim in hyperspace ({creator} creator)'
+    else:
+        case = f'duplicate title in hypercerts ({creator})'
+    return {
+        'id': id1,
+        'collision': id2,
+        'creator': creator1,
+        'date': date,
+        'title': title,
+        'case': case
+        #'details': eval(row1['hypercert'])
+    }
+
+
 def check_collisions(df):
+    ids = df.index.to_numpy()
+    creators = df['creatorAddress'].to_numpy()
+    titles = df['title'].to_numpy()
+    dates = df['date'].dt.strftime(DATE_FORMAT).to_numpy()
+
     collisions = []
-    for i, (id1, row1) in enumerate(df.iterrows()):
-        tag = row1['tag']
-        for (id2, row2) in df.head(i).iterrows():
-            if row1['creatorAddress'] == row2['creatorAddress']:
-                creator = "same creator"
-            else:                
-                creator = f"by {row1['creatorAddress']} & {row2['creatorAddress']}"
-            if row1['hypercert'] == row2['hypercert']:
-                case = f'duplicate claim in hyperspace ({creator} creator)'
-            elif row1['title'] == row2['title'] and row1['title'] != 'The name of your hypercert':
-                case = f'duplicate title in hypercerts ({creator})'
-            else:
-                continue
-            collisions.append({
-                'id': id1,
-                'collision': id2,                
-                'creator': row1['creatorAddress'],
-                'date': row1['date'],
-                'title': row1['title'],
-                'case': case
-                #'details': eval(row1['hypercert'])
-            })
-                
+    for i, j, match in find_collisions(df['hypercert'], df['title']):
+        collisions.append(collision_record(ids[i], ids[j], creators[i], creators[j], dates[i], titles[i], match))
+
+    return collisions
+
+
+def update_collisions(df, index_path=INDEX_PATH, outpath=OUTPATH):
+    """Checks the claims not in the collision index yet and appends their collisions to the output file."""
+    if os.path.exists(index_path) and not os.path.exists(outpath):
+        # The collisions of the indexed claims are lost, so check every claim again
+        os.remove(index_path)
+    collisions = []
+    if os.path.exists(outpath):
+        with open(outpath) as f:
+            collisions = json.load(f)
+
+    index = CollisionIndex(index_path)
+    try:
+        new = df[~df.index.isin(index.claim_ids())]
+        ids = new.index.to_numpy()
+        creators = new['creatorAddress'].to_numpy()
+        titles = new['title'].to_numpy()
+        dates = new['date'].dt.strftime(DATE_FORMAT).to_numpy()
+        matches = index.add(ids, creators, new['hypercert'].to_numpy(), titles)
+        found = [
+            collision_record(ids[k], earlier_id, creators[k], earlier_creator, dates[k], titles[k], match)
+            for k, earlier_id, earlier_creator, match in matches
+        ]
+        collisions.extend(found)
+        with open(f"{outpath}.tmp", 'w') as f:
+            json.dump(collisions, f, indent=4)
+        os.replace(f"{outpath}.tmp", outpath)
+        index.commit()
+    finally:
+        index.close()
+    print(f"Checked {len(new)} new claims, found {len(found)} new collisions.")
+    return collisions
+
+
+def check_near_duplicates(df, threshold=DEFAULT_THRESHOLD):
+    ids = df.index.to_numpy()
+    creators = df['creatorAddress'].to_numpy()
+    titles = df['title'].to_numpy()
+    dates = df['date'].dt.strftime(DATE_FORMAT).to_numpy()
+
+    collisions = []
+    for i, j, similarity in find_near_duplicates(claim_texts(df), threshold):
+        if creators[i] == creators[j]:
+            creator = "same creator"
+        else:
+            creator = f"by {creators[i]} & {creators[j]}"
+        collisions.append({
+            'id': ids[i],
+            'collision': ids[j],
+            'creator': creators[i],
+            'date': dates[i],
+            'title': titles[i],
+            'case': f'near-duplicate claim ({creator}, similarity {similarity:.2f})'
+        })
+
     return collisions
 
 
-def run_analysis():
+def run_analysis(near_duplicates=False, threshold=DEFAULT_THRESHOLD):
 
     save_supabase_snapshot_to_csv()
     df = load_csv()
-    collisions_data = check_collisions(df)
-    with open(OUTPATH, 'w') as f:
-        json.dump(collisions_data, f, indent=4)
+    if near_duplicates:
+        collisions_data = check_near_duplicates(df, threshold)
+        with open(NEAR_DUPLICATES_OUTPATH, 'w') as f:
+            json.dump(collisions_data, f, indent=4)
+    else:
+        update_collisions(df)
 
 
 if __name__ == "__main__":
-    run_analysis()
+    if sys.argv[1:2] == ["near-duplicates"]:
+        run_analysis(near_duplicates=True, threshold=float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THRESHOLD)
+    else:
+        run_analysis()
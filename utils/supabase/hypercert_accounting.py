@@ -1,21 +1,41 @@
 import os
-import json
+import sys
+import numpy as np
 import pandas as pd
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+import graph_client
+import ipfs_cache
+import ipfs_gateways
+import subgraph
+import supabase_prefetch
+from accounting_store import AccountingStore
+from merkle_allowlist import MerkleAllowlist, decode_standard_merkle_tree
+
 load_dotenv()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+DB_PATH = "data/hypercertAccounting.db"
 JSON_OUTPATH = "data/hypercertAccounting.json"
 CSV_OUTPATH = "data/hypercertAccounting.csv"
 SUPABASE_UPDATE = "data/hypercertErrors.csv"
 
-RATE_LIMIT = 1000
+TOKEN_FIELDS = "id owner units"
+
+# Claim records are built concurrently; each worker blocks on network I/O,
+# so the pool can be wider than the per-host limit without overloading hosts.
+# IPFS gateways are limited per host by `ipfs_gateways` instead.
+MAX_WORKERS = int(os.environ.get("ACCOUNTING_MAX_WORKERS", 8))
+MAX_REQUESTS_PER_HOST = int(os.environ.get("ACCOUNTING_MAX_REQUESTS_PER_HOST", 4))
+# Number of claims whose tokens are fetched per subgraph request; 1 disables batching
+BATCH_SIZE = int(os.environ.get("ACCOUNTING_BATCH_SIZE", subgraph.BATCH_SIZE))
+# In full token sync mode, claims are re-fetched in full at least this often (about a week of Optimism blocks)
+FULL_SYNC_BLOCKS = int(os.environ.get("TOKEN_FULL_SYNC_BLOCKS", 302400))
 
 
 def timestamp_to_date_string(timestamp: str) -> str:
@@ -34,7 +54,7 @@ def timestamp_to_date_string(timestamp: str) -> str:
 
 def get_graph_data(query: str) -> dict:
     """
-    Sends a POST request to The Graph API and returns the response data.
+    Sends a query to The Graph API and returns the response data.
 
     Args:
         query: The GraphQL query string.
@@ -42,10 +62,8 @@ def get_graph_data(query: str) -> dict:
     Returns:
         Response data in dictionary format.
     """
-    url = "https://api.thegraph.com/subgraphs/name/hypercerts-admin/hypercerts-optimism-mainnet"
-    response = requests.post(url, json={'query': query})
-    json_data = response.json()
-    return json_data.get('data', {})
+    with ipfs_gateways.host_limit(subgraph.get_subgraph_url(), MAX_REQUESTS_PER_HOST):
+        return subgraph.query_subgraph(query)
 
 
 def get_hypercerts() -> list:
@@ -74,62 +92,61 @@ def get_hypercerts() -> list:
     return data
 
 
-def get_claims(claim_id: str, offset: int = 0) -> list:
+def get_claims(claim_id: str, block: int = None) -> list:
     """
-    Fetches claims for a given claim ID from The Graph.
+    Fetches all claim tokens for a given claim ID from The Graph.
+
+    Pages are fetched with keyset pagination on the token ID.
 
     Args:
         claim_id: The ID of the claim.
-        offset: Offset value for pagination.
+        block: Block number to pin the pages to.
 
     Returns:
         List of claim data.
     """
-    query = f'''
-        {{
-          claimTokens(          
-             where: {{
-                  claim_: {{
-                      id: "{claim_id}"
-                  }}
-              }}
-              first: 1000
-              skip: {offset}
-              orderBy: units
-              orderDirection: desc
-          ) {{
-              id
-              owner
-              units
-            }}
-        }}
-    '''
-    json_data = get_graph_data(query)
-    data = json_data.get('claimTokens', [])
-    return data
+    all_user_claims = []
+    last_id = ""
+    while True:
+        user_claims = subgraph.get_claim_tokens_page(claim_id, TOKEN_FIELDS, last_id, block, query=get_graph_data)
+        all_user_claims.extend(user_claims)
+        if len(user_claims) < subgraph.PAGE_SIZE:
+            return all_user_claims
+        last_id = user_claims[-1]['id']
 
 
 def retrieve_ipfs_file(uri: str) -> dict:
     """
-    Fetches JSON data from IPFS using the given content identifier in the URI.
+    Fetches claim metadata from IPFS using the given content identifier in the URI.
+
+    The response is parsed as it streams in and only the kept fields are cached
+    on disk. The `image` field and any other keys in `METADATA_SKIP_KEYS` are
+    skipped without being decoded or held in memory.
 
     Args:
         uri: The IPFS URI.
 
     Returns:
-        JSON data as a dictionary.
+        Metadata as a dictionary, without the skipped fields.
     """
-    cid = uri.replace("ipfs://", "")
-    url = f"https://cloudflare-ipfs.com/ipfs/{cid}"
+    return ipfs_cache.retrieve_ipfs_metadata(uri)
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = json.loads(response.content)
-        return data
-    except requests.exceptions.HTTPError as e:
-        print(e)
-    return None
+
+def retrieve_allowlist(uri: str) -> MerkleAllowlist:
+    """
+    Fetches and decodes a StandardMerkleTree allowlist from IPFS.
+
+    Args:
+        uri: The IPFS URI of the merkle tree dump.
+
+    Returns:
+        The allowlist in columnar form, or None if it could not be fetched.
+    """
+    # A gateway's HTML error page is refetched elsewhere rather than cached under the CID
+    content = ipfs_cache.retrieve_ipfs_content(uri, validate=ipfs_cache.looks_like_json)
+    if content is None:
+        return None
+    return decode_standard_merkle_tree(content)
 
 
 def fetch_addresses_from_supabase(claim_id: str) -> list:
@@ -142,37 +159,51 @@ def fetch_addresses_from_supabase(claim_id: str) -> list:
     Returns:
         List of addresses.
     """
-    response = (supabase
-                .table("optimism-allowlistCache")
-                .select("address")
-                .eq("claimId", claim_id)
-                .execute())
+    with ipfs_gateways.host_limit(SUPABASE_URL, MAX_REQUESTS_PER_HOST):
+        response = (supabase
+                    .table("optimism-allowlistCache")
+                    .select("address")
+                    .eq("claimId", claim_id)
+                    .execute())
     addresses = [x["address"] for x in response.data]
     return addresses
 
 
-def fetch_hidden_hypercerts() -> list:
+def fetch_hidden_hypercerts() -> set:
     """
     Fetches hypercerts that are supposed to be hidden from users.
 
     Returns:
-        List of claimIds.
-    """
-    response = (supabase
-                .table("claims-metadata-mapping")
-                .select("claimId")
-                .eq("hidden", True)
-                .execute())
-    claims = [x["claimId"] for x in response.data]
-    return claims
+        Set of claimIds.
+    """
+    with ipfs_gateways.host_limit(SUPABASE_URL, MAX_REQUESTS_PER_HOST):
+        return supabase_prefetch.fetch_hidden_claim_ids(supabase)
 
 
-def create_claim_record(claim: dict) -> dict:
+def prefetch_supabase_addresses(claim_ids: list) -> supabase_prefetch.AllowlistCacheIndex:
+    """
+    Fetches the Supabase allowlist cache for many claims in bulk.
+
+    Args:
+        claim_ids: IDs of the claims.
+
+    Returns:
+        The cached addresses, indexed by claimId and address.
+    """
+    with ipfs_gateways.host_limit(SUPABASE_URL, MAX_REQUESTS_PER_HOST):
+        return supabase_prefetch.load_allowlist_cache(supabase, claim_ids)
+
+
+def create_claim_record(claim: dict, user_claims: list = None, block: int = None,
+                        supabase_addresses: list = None) -> dict:
     """
     Creates a claim record from the given claim and metadata.
 
     Args:
         claim: Claim data as a dictionary.
+        user_claims: The claim's tokens, if already fetched in a batch.
+        block: Block number to pin token queries to.
+        supabase_addresses: The claim's cached Supabase addresses, if already prefetched.
 
     Returns:
         Claim record as a dictionary.
@@ -181,28 +212,22 @@ def create_claim_record(claim: dict) -> dict:
     print("Fetching claim data from:", metadata_uri)
     try:
         metadata = retrieve_ipfs_file(metadata_uri)
-        metadata.pop('image')
+        allowlist_uri = metadata.get("allowList")
     except:
         print("Error retrieving metadata at:", metadata_uri)
         return None
 
-    allowlist_uri = metadata.get("allowList")
     try:
-        merkle_tree = eval(retrieve_ipfs_file(allowlist_uri))
-        allowlist = [x['value'] for x in merkle_tree['values']]
+        allowlist = retrieve_allowlist(allowlist_uri).to_json()
     except:
         print("Error retrieving allowlist at:", allowlist_uri)
         return None
 
-    user_claims = get_claims(claim["id"])
-    all_user_claims = user_claims
-    offset = 0
-    while len(user_claims) == RATE_LIMIT:
-        offset += RATE_LIMIT
-        user_claims = get_claims(claim["id"], offset=offset)
-        all_user_claims.extend(user_claims)
+    if user_claims is None:
+        user_claims = get_claims(claim["id"], block)
 
-    supabase_addresses = fetch_addresses_from_supabase(claim["id"])
+    if supabase_addresses is None:
+        supabase_addresses = fetch_addresses_from_supabase(claim["id"])
 
     return {
         "claimId": claim["id"],
@@ -215,118 +240,285 @@ def create_claim_record(claim: dict) -> dict:
         "allowlistUri": allowlist_uri,
         "metadata": metadata,
         "allowlist": allowlist,
-        "userClaims": all_user_claims,
+        "userClaims": user_claims,
         "supabaseList": supabase_addresses
     }
 
 
-def parse_claims(list_of_claims: list, existing_claims: list) -> list:
+def parse_claims(list_of_claims: list, existing_claims: list, max_workers: int = MAX_WORKERS,
+                 batch_size: int = BATCH_SIZE, block: int = None,
+                 allowlist_cache: supabase_prefetch.AllowlistCacheIndex = None) -> list:
     """
     Parses claims, filtering out existing ones, and creates claim records.
 
+    Claim records are built on a pool of `max_workers` threads. Results are
+    collected in the order of `list_of_claims`, so the output does not depend
+    on which fetches finish first. Token queries are pinned to `block`, or to
+    the block the subgraph has indexed when the run starts. With a `batch_size` above 1,
+    tokens for all new claims are fetched up front, `batch_size` claims per
+    request.
+
     Args:
         list_of_claims: List of claim data.
         existing_claims: List of existing claim IDs.
+        max_workers: Number of claims to fetch concurrently.
+        batch_size: Number of claims whose tokens are fetched per request.
+        block: Block number to pin token queries to.
+        allowlist_cache: Supabase allowlist cache prefetched for the new
+            claims; fetched here if not given.
 
     Returns:
         List of claim records.
     """
     print("Parsing new claims...")
-    claims = []
-    for claim_dict in list_of_claims:
-        claim = claim_dict['claim']
-        claim_id = claim['id']
-        if claim_id not in existing_claims:
-            claim_record = create_claim_record(claim)
-            if claim_record:
-                claims.append(claim_record)
+    existing_claims = set(existing_claims)
+    new_claims = [c['claim'] for c in list_of_claims if c['claim']['id'] not in existing_claims]
+    if block is None:
+        block = subgraph.get_indexed_block(query=get_graph_data)
+
+    claim_ids = [c['id'] for c in new_claims]
+    if allowlist_cache is None and claim_ids:
+        allowlist_cache = prefetch_supabase_addresses(claim_ids)
+
+    if batch_size > 1:
+        tokens_by_claim = subgraph.fetch_claim_tokens(claim_ids, TOKEN_FIELDS, block, batch_size, query=get_graph_data)
+        get_tokens = lambda c: tokens_by_claim[c['id']]
+    else:
+        get_tokens = lambda c: None
+    build_record = lambda c: create_claim_record(c, get_tokens(c), block, allowlist_cache.addresses_for(c['id']))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        claim_records = list(executor.map(build_record, new_claims))
+    claims = [record for record in claim_records if record]
     print(f"Total of {len(claims)} new claims extracted.")
     return claims
 
 
-def update_hypercert_accounting(json_filepath: str = JSON_OUTPATH) -> None:
+def refresh_claim_tokens(store: AccountingStore, block: int, batch_size: int = BATCH_SIZE,
+                         mode: str = None) -> None:
+    """
+    Re-syncs the tokens of stored claims that were last indexed before `block`.
+
+    In delta mode, only tokens changed since the oldest indexed block are
+    fetched, with the subgraph's `_change_block` filter, and merged into the
+    store; claims that were never indexed at a known block are re-fetched in
+    full. In full mode every stale claim is re-fetched, which also drops
+    tokens that no longer exist; to keep that affordable, only claims with
+    token changes since the oldest indexed block, and claims not fetched in
+    full for `FULL_SYNC_BLOCKS` blocks, are re-fetched. Only token rows whose
+    owner or units changed are written to the store.
+
+    Args:
+        store: The accounting store.
+        block: Block number to fetch tokens at.
+        batch_size: Number of claims whose tokens are fetched per request.
+        mode: "delta" or "full"; defaults to `TOKEN_SYNC_MODE` or "delta".
     """
-    Store hypercert data in a local JSON file.
+    mode = mode or os.environ.get("TOKEN_SYNC_MODE") or "delta"
+    claim_ids = store.claims_indexed_before(block)
+    changed = 0
+    if mode == "delta":
+        full = set(store.unindexed_claims())
+        stale = [claim_id for claim_id in claim_ids if claim_id not in full]
+        since = store.oldest_indexed_block()
+        if stale:
+            print(f"Fetching token changes since block {since} for {len(stale)} existing claims...")
+            tokens_by_claim = {}
+            for tokens in subgraph.iter_changed_tokens(TOKEN_FIELDS + " claim { id }", since, block,
+                                                       query=get_graph_data):
+                for token in tokens:
+                    tokens_by_claim.setdefault(token['claim']['id'], []).append(token)
+            changed += store.merge_tokens(tokens_by_claim, stale, block)
+        claim_ids = [claim_id for claim_id in claim_ids if claim_id in full]
+    elif claim_ids:
+        due = set(store.claims_synced_before(block - FULL_SYNC_BLOCKS))
+        since = store.oldest_indexed_block()
+        changed_claims = set()
+        if since is not None and not due.issuperset(claim_ids):
+            print(f"Finding claims with token changes since block {since}...")
+            for tokens in subgraph.iter_changed_tokens("id claim { id }", since, block, query=get_graph_data):
+                changed_claims.update(token['claim']['id'] for token in tokens)
+        unchanged = [claim_id for claim_id in claim_ids if claim_id not in due and claim_id not in changed_claims]
+        # Nothing to fetch for these; their tokens are known to be current at `block`
+        store.merge_tokens({}, unchanged, block)
+        claim_ids = [claim_id for claim_id in claim_ids if claim_id in due or claim_id in changed_claims]
+
+    print(f"Refreshing tokens for {len(claim_ids)} existing claims...")
+    pages = {}
+    for claim_id, tokens in subgraph.iter_claim_token_pages(claim_ids, TOKEN_FIELDS, block, batch_size,
+                                                            query=get_graph_data):
+        pages.setdefault(claim_id, []).extend(tokens)
+        if len(tokens) < subgraph.PAGE_SIZE:
+            changed += store.sync_tokens(claim_id, pages.pop(claim_id), block)
+    print(f"Total of {changed} token records changed.")
+
+
+def update_hypercert_accounting(db_path: str = DB_PATH, json_filepath: str = JSON_OUTPATH) -> None:
+    """
+    Store hypercert data in the local accounting database.
+
+    New claims are added, and the tokens and Supabase addresses of existing
+    claims are brought up to date, tokens as of the block the subgraph has
+    indexed. A `hypercertAccounting.json` left by
+    earlier versions is imported into an empty database.
 
     Args:
-        json_filepath: Path to the JSON file.
+        db_path: Path to the SQLite database.
+        json_filepath: Path to a legacy JSON file to import.
     """
+    store = AccountingStore(db_path)
+    existing_claims = store.claim_ids()
+    if not existing_claims and os.path.exists(json_filepath):
+        print(f"Importing {store.import_json(json_filepath)} claims from {json_filepath}.")
+        existing_claims = store.claim_ids()
+
+    block = subgraph.get_indexed_block(query=get_graph_data)
     hypercerts = get_hypercerts()
-    if not os.path.exists(json_filepath):
-        claims_data = parse_claims(hypercerts, [])
-    else:
-        with open(json_filepath) as f:
-            claims_data = json.load(f)
-        existing_claims = [c['claimId'] for c in claims_data]
-        new_claims = parse_claims(hypercerts, existing_claims)
-        claims_data.extend(new_claims)
+    # One prefetch serves the new claims and refreshes the addresses stored for existing ones
+    allowlist_cache = prefetch_supabase_addresses([h['claim']['id'] for h in hypercerts])
+    for claim_record in parse_claims(hypercerts, existing_claims, block=block, allowlist_cache=allowlist_cache):
+        store.upsert_claim(claim_record, block)
+    refreshed = store.update_supabase_lists({
+        claim_id: allowlist_cache.addresses_for(claim_id)
+        for claim_id in allowlist_cache.claim_ids if claim_id in existing_claims
+    })
+    print(f"Updated the Supabase addresses of {refreshed} existing claims.")
+
+    if block is not None:
+        refresh_claim_tokens(store, block)
+    store.close()
+
+
+def export_hypercert_accounting(json_filepath: str = JSON_OUTPATH, db_path: str = DB_PATH) -> None:
+    """
+    Exports the accounting database to a JSON file in the `hypercertAccounting.json` layout.
 
-    with open(json_filepath, 'w') as f:
-        json.dump(claims_data, f, indent=4)
+    Allowlists are written in the compact `MerkleAllowlist.to_json` form, not
+    as the `[address, units]` pairs of earlier versions.
 
+    Args:
+        json_filepath: Path to the JSON file.
+        db_path: Path to the SQLite database.
+    """
+    store = AccountingStore(db_path)
+    count = store.export_json(json_filepath)
+    store.close()
+    print(f"Exported {count} claims to {json_filepath}.")
+
+
+RECONCILIATION_COLUMNS = ['address', 'claimId', 'claimName', 'creator', 'units', 'claimed', 'supabase', 'slots']
 
-def reconcile_claims(json_filepath: str = JSON_OUTPATH) -> None:
+
+def build_reconciliation(claims_data, hidden_claims) -> pd.DataFrame:
     """
-    Reconciles claims data and generates a CSV report.
+    Builds the reconciliation table for a set of claims.
+
+    The allowlists, claimed tokens and Supabase addresses of all claims are
+    exploded into (claim, address) frames, aggregated with groupby and
+    left-joined together. There is one row per address that is on a claim's
+    allowlist or holds one of its tokens. Within a claim, allowlisted
+    addresses come first in allowlist order, then token holders that are not
+    on the allowlist in token order.
 
     Args:
-        json_filepath: Path to the JSON file containing claims data.
+        claims_data: Iterable of claim records.
+        hidden_claims: IDs of claims to leave out.
 
     Returns:
-        None
+        Reconciliation table with one row per (claimId, address); empty, with
+        the same columns, if every claim is hidden.
     """
-    with open(json_filepath) as f:
-        claims_data = json.load(f)
-
-    hidden_claims = fetch_hidden_hypercerts()
-
-    results = []
+    claims = []
+    allowlist_frames = []
+    token_frames = []
+    supabase_frames = []
     for claim in claims_data:
-        if claim['claimId'] in hidden_claims:
-            continue
-            
-        allowlist = {}
-
-        def create_entry(address, units, slots):
-            return {
-                'address': address,
-                'claimId': claim['claimId'],
-                'claimName': claim['metadata']['name'],
-                'creator': claim['creatorAddress'] == address,
-                'units': units,
-                'claimed': 0,
-                'supabase': False,
-                'slots': slots
-            }
-
-        for (address, units) in claim['allowlist']:
-            if address in allowlist:
-                allowlist[address]['units'] += units
-                allowlist[address]['slots'] += 1
-            else:
-                allowlist[address] = create_entry(address, units, 1)
-
-        for user_claim in claim['userClaims']:
-            owner = user_claim['owner']
-            num_units = int(user_claim['units'])
-            if owner not in allowlist:
-                allowlist[owner] = create_entry(owner, 0, 0)
-            allowlist[owner]['claimed'] += num_units
+        claims.append((claim['claimId'], claim['metadata']['name'], claim['creatorAddress']))
+        position = len(claims) - 1
+        leaves = MerkleAllowlist.from_json(claim['allowlist'])
+        allowlist_frames.append(pd.DataFrame({
+            'claim': position,
+            'address': leaves.hex_address_array(),
+            'units': leaves.units
+        }))
+        token_frames.append(pd.DataFrame({
+            'claim': position,
+            'address': [t['owner'] for t in claim['userClaims']],
+            'claimed': [int(t['units']) for t in claim['userClaims']]
+        }))
+        supabase_frames.append(pd.DataFrame({'claim': position, 'address': claim['supabaseList']}))
+
+    if not claims:
+        return pd.DataFrame(columns=RECONCILIATION_COLUMNS + ['error'])
+
+    df_claims = pd.DataFrame(claims, columns=['claimId', 'claimName', 'creatorAddress'])
+    visible = np.flatnonzero(~df_claims['claimId'].isin(hidden_claims))
+
+    def explode(frames):
+        df = pd.concat(frames, ignore_index=True)
+        df = df[df['claim'].isin(visible)]
+        return df.assign(order=np.arange(len(df)))
+
+    keys = ['claim', 'address']
+    allowlist = (explode(allowlist_frames)
+                 .groupby(keys, sort=False)
+                 .agg(units=('units', 'sum'), slots=('units', 'size'), order=('order', 'min'))
+                 .assign(source=0))
+    claimed = (explode(token_frames)
+               .groupby(keys, sort=False)
+               .agg(claimed=('claimed', 'sum'), order=('order', 'min')))
+    supabase = explode(supabase_frames)[keys].drop_duplicates().set_index(keys)
+
+    unlisted = claimed.index.difference(allowlist.index, sort=False)
+    df = pd.concat([
+        allowlist,
+        pd.DataFrame({
+            'units': 0,
+            'slots': 0,
+            'order': claimed.loc[unlisted, 'order'],
+            'source': 1
+        }, index=unlisted)
+    ])
+    df = df.join(claimed[['claimed']], how='left')
+    df['claimed'] = df['claimed'].fillna(0).astype(np.int64)
+    df['supabase'] = df.index.isin(supabase.index)
+    df = df.reset_index().sort_values(['claim', 'source', 'order'], kind='stable')
+
+    claim_info = df_claims.iloc[df['claim']]
+    df['claimId'] = claim_info['claimId'].to_numpy()
+    df['claimName'] = claim_info['claimName'].to_numpy()
+    df['creator'] = claim_info['creatorAddress'].to_numpy() == df['address'].to_numpy()
+    df = df[RECONCILIATION_COLUMNS].reset_index(drop=True)
+    df['error'] = ~df['supabase'] & (df['claimed'] == 0)
+    return df
+
+
+def reconcile_claims(db_path: str = DB_PATH) -> None:
+    """
+    Reconciles claims data and generates a CSV report.
 
-        for address in claim['supabaseList']:
-            if address in allowlist:
-                allowlist[address]['supabase'] = True
+    Args:
+        db_path: Path to the SQLite database containing claims data.
 
-        results.extend(allowlist.values())
+    Returns:
+        None
+    """
+    store = AccountingStore(db_path)
+    hidden_claims = fetch_hidden_hypercerts()
+    df = build_reconciliation(store.iter_claims(), hidden_claims)
+    store.close()
 
-    df = pd.DataFrame(results)
-    df['error'] = df.apply(lambda x: not(x['supabase']) and not(x['claimed']), axis=1)
     df.to_csv(CSV_OUTPATH, index=False)
-    
+
     df_error = df[df['error']][['address', 'claimId']].sort_values(by='address')
     df_error.to_csv(SUPABASE_UPDATE, index=False)
-    
+
 
 if __name__ == "__main__":
-    update_hypercert_accounting()
-    reconcile_claims()
+    if sys.argv[1:2] == ["export"]:
+        export_hypercert_accounting(*sys.argv[2:3])
+    else:
+        update_hypercert_accounting()
+        reconcile_claims()
+        graph_client.print_stats()
+        ipfs_gateways.print_stats()
@@ -1,24 +1,161 @@
+"""
+Loads an allowlist CSV (one `address` column) into an allowlist table for a claim.
+
+With `DATABASE_URL` set to a direct Postgres connection string, the addresses
+are streamed into a temporary staging table with `COPY ... FROM STDIN` and
+merged into the table with `INSERT ... ON CONFLICT DO NOTHING`, in a single
+transaction. This needs `psycopg2` (`pip install psycopg2-binary`).
+
+Without it, addresses are inserted through PostgREST in chunks. Either way,
+addresses the table already holds for the claim are skipped, so a load can be
+rerun safely.
+
+Usage:
+
+   python insert_allowlist.py <csv file> <table name> <claim id>
+"""
+
 from dotenv import load_dotenv
+import csv
+import io
+import itertools
 import os
-import pandas as pd
+import time
+from postgrest.types import ReturnMethod
 from supabase import create_client, Client
 import sys
 
+import supabase_prefetch
+
 load_dotenv()
 url = os.environ.get("SUPABASE_URL")
 key = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
+CHUNK_SIZE = 1000
+COPY_BUFFER_ROWS = 10000
+
+
+def read_addresses(csv_file):
+   """
+   Yields the addresses of an allowlist CSV file, in file order and without repeats.
+
+   Addresses are lowercased, as `lookup_gtc_user.py` and the subgraph hold them.
+   A byte order mark, as written by Excel, is ignored.
+
+   Raises:
+      ValueError: If the file has no `address` column.
+   """
+   seen = set()
+   with open(csv_file, newline="", encoding="utf-8-sig") as f:
+      reader = csv.DictReader(f)
+      if "address" not in (reader.fieldnames or []):
+         raise ValueError(f"{csv_file} has no address column")
+      for row in reader:
+         addr = (row.get("address") or "").strip().lower()
+         if addr and addr not in seen:
+            seen.add(addr)
+            yield addr
+
+
+class _CopyStream:
+   """File-like object that feeds (address, claimId) CSV rows to `copy_expert` as they are read."""
+
+   def __init__(self, addresses, claim_id):
+      self.rows_iter = ((addr, claim_id) for addr in addresses)
+      self.buffer = ""
+      self.rows = 0
+
+   def read(self, size=-1):
+      while size < 0 or len(self.buffer) < size:
+         batch = list(itertools.islice(self.rows_iter, COPY_BUFFER_ROWS))
+         if not batch:
+            break
+         out = io.StringIO()
+         csv.writer(out, lineterminator="\n").writerows(batch)
+         self.rows += len(batch)
+         self.buffer += out.getvalue()
+      if size < 0:
+         size = len(self.buffer)
+      data, self.buffer = self.buffer[:size], self.buffer[size:]
+      return data
+
+
+def copy_allowlist(csv_file, table_name, claim_id, database_url):
+   """
+   Loads addresses with COPY into a staging table and merges the new ones into the table.
+
+   Returns:
+      (rows read, rows inserted)
+   """
+   import psycopg2
+   from psycopg2 import sql
+
+   table = sql.Identifier(table_name)
+   stream = _CopyStream(read_addresses(csv_file), claim_id)
+   conn = psycopg2.connect(database_url)
+   try:
+      with conn, conn.cursor() as cur:
+         cur.execute('CREATE TEMP TABLE allowlist_staging (address text, "claimId" text) ON COMMIT DROP')
+         cur.copy_expert('COPY allowlist_staging (address, "claimId") FROM STDIN WITH (FORMAT csv)', stream)
+         # NOT EXISTS keeps reruns idempotent even if the table has no unique constraint
+         cur.execute(sql.SQL(
+            'INSERT INTO {table} (address, "claimId") '
+            'SELECT s.address, s."claimId" FROM allowlist_staging s '
+            'WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.address = s.address AND t."claimId" = s."claimId") '
+            'ON CONFLICT DO NOTHING'
+         ).format(table=table))
+         inserted = cur.rowcount
+   finally:
+      conn.close()
+   return stream.rows, inserted
+
+
+def upsert_allowlist(csv_file, table_name, claim_id, chunk_size=CHUNK_SIZE):
+   """
+   Inserts the addresses the table doesn't hold yet through PostgREST, `chunk_size` rows per request.
+
+   Returns:
+      (rows read, rows inserted)
+   """
+   build_query = lambda: (supabase
+                          .table(table_name)
+                          .select("address", count="exact")
+                          .eq("claimId", claim_id)
+                          .order("address"))
+   existing = {row["address"] for row in supabase_prefetch.fetch_all_rows(build_query)}
+
+   read = inserted = 0
+   chunk = []
+   for addr in read_addresses(csv_file):
+      read += 1
+      if addr in existing:
+         continue
+      chunk.append({"address": addr, "claimId": claim_id})
+      if len(chunk) >= chunk_size:
+         supabase.table(table_name).insert(chunk, returning=ReturnMethod.minimal).execute()
+         inserted += len(chunk)
+         chunk = []
+   if chunk:
+      supabase.table(table_name).insert(chunk, returning=ReturnMethod.minimal).execute()
+      inserted += len(chunk)
+   return read, inserted
+
 
 def insert_allowlist(csv_file, table_name, claim_id):
-   df = pd.read_csv(csv_file)
-   addresses = list(df["address"])
-   for addr in addresses:
-      data, count = (supabase
-                     .table(table_name)
-                     .insert({"address": addr, "claimId": claim_id})
-                     .execute())
-   print(f"Successfully added {len(addresses)} rows to {table_name}")
+   database_url = os.environ.get("DATABASE_URL")
+   start = time.perf_counter()
+   if database_url:
+      read, inserted = copy_allowlist(csv_file, table_name, claim_id, database_url)
+      method = "COPY"
+   else:
+      read, inserted = upsert_allowlist(csv_file, table_name, claim_id)
+      method = "PostgREST"
+   elapsed = time.perf_counter() - start
+   rate = read / elapsed if elapsed else 0
+   print(f"Successfully added {inserted} rows to {table_name} ({read - inserted} already present) "
+         f"via {method} in {elapsed:.2f}s, {rate:.0f} rows/s")
+   return inserted
 
 
 if __name__ == "__main__":
@@ -27,5 +164,3 @@ if __name__ == "__main__":
       table_name=sys.argv[2],
       claim_id=sys.argv[3]
    )
-
-
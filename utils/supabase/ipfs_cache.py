@@ -0,0 +1,299 @@
+"""
+Content-addressed on-disk cache for files fetched from IPFS.
+
+Content behind a CID never changes, so once a file has been fetched from a
+gateway it can be served from disk on every later run. Entries are keyed by
+CID, written atomically, checked against a SHA-256 digest on read, and evicted
+least-recently-used first once the cache grows past its size bound.
+
+The cache is shared by the supabase and gitcoin scripts. Point both at the same
+directory with `IPFS_CACHE_DIR` to reuse fetched files across them. Misses are
+fetched with hedged requests across the gateways in `IPFS_GATEWAYS` (see
+`ipfs_gateways`).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import ipfs_gateways
+import metadata_parser
+
+# Settings are read from the environment when first used, so that scripts can
+# import this module before calling `load_dotenv()`
+DEFAULT_IPFS_GATEWAYS = ["https://cloudflare-ipfs.com/ipfs/", "https://ipfs.io/ipfs/", "https://dweb.link/ipfs/"]
+DEFAULT_IPFS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hypercerts", "ipfs")
+DEFAULT_IPFS_CACHE_MAX_BYTES = 1024 ** 3
+
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def get_gateways() -> list:
+    """
+    Returns the IPFS gateway URL prefixes configured in the environment, in order of preference.
+
+    `IPFS_GATEWAYS` is a comma-separated list; a single `IPFS_GATEWAY` is also accepted.
+    """
+    gateways = os.environ.get("IPFS_GATEWAYS") or os.environ.get("IPFS_GATEWAY")
+    if not gateways:
+        return list(DEFAULT_IPFS_GATEWAYS)
+    return [gateway.strip() for gateway in gateways.split(",") if gateway.strip()]
+
+
+def normalize_cid(uri: str) -> str:
+    """
+    Strips the scheme and gateway prefix from an IPFS URI.
+
+    Args:
+        uri: A bare CID, an `ipfs://` URI or an `/ipfs/` path.
+
+    Returns:
+        The CID, including any path inside it.
+    """
+    cid = uri.strip()
+    if cid.startswith("ipfs://"):
+        cid = cid[len("ipfs://"):]
+    if cid.startswith("/ipfs/"):
+        cid = cid[len("/ipfs/"):]
+    return cid
+
+
+class IPFSCache:
+    """
+    A size-bounded LRU cache of IPFS file contents stored on local disk.
+
+    Each entry is stored as the SHA-256 digest of the content followed by the
+    content itself. Reads that fail the digest check are treated as misses and
+    the entry is removed. Hits refresh the entry's modification time, which is
+    used as its recency when evicting.
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        if cache_dir is None:
+            cache_dir = os.environ.get("IPFS_CACHE_DIR") or DEFAULT_IPFS_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("IPFS_CACHE_MAX_BYTES") or DEFAULT_IPFS_CACHE_MAX_BYTES)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, cid: str) -> str:
+        key = hashlib.sha256(normalize_cid(cid).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _entries(self) -> list:
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _remove(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    def get(self, cid: str) -> bytes:
+        """
+        Reads a file from the cache.
+
+        Args:
+            cid: The content identifier of the file.
+
+        Returns:
+            The file contents, or None if the CID is not cached or the entry is corrupt.
+        """
+        path = self._path(cid)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return None
+
+        digest, content = blob[:DIGEST_SIZE], blob[DIGEST_SIZE:]
+        if hashlib.sha256(content).digest() != digest:
+            with self._lock:
+                removed = self._remove(path)
+                if self._size is not None:
+                    self._size -= removed
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def put(self, cid: str, content: bytes) -> None:
+        """
+        Atomically writes a file to the cache, evicting old entries if needed.
+
+        Args:
+            cid: The content identifier of the file.
+            content: The file contents.
+        """
+        path = self._path(cid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(hashlib.sha256(content).digest())
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                replaced = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(tmp_path, path)
+                if self._size is None:
+                    self._size = sum(size for _, size, _ in self._entries())
+                else:
+                    self._size += DIGEST_SIZE + len(content) - replaced
+                if self._size > self.max_bytes:
+                    self._evict()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self) -> None:
+        # Evict down to 90% of the bound so a full cache doesn't rescan on every write
+        target = int(self.max_bytes * 0.9)
+        for _, _, path in sorted(self._entries()):
+            if self._size <= target:
+                break
+            self._size -= self._remove(path)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> IPFSCache:
+    """Returns the process-wide cache configured from the environment."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = IPFSCache()
+        return _default_cache
+
+
+def retrieve_ipfs_content(cid: str, base_url: str = None, cache: IPFSCache = None, validate=None) -> bytes:
+    """
+    Fetches the raw bytes of a file from IPFS, serving it from the local cache when possible.
+
+    Args:
+        cid: The content identifier (or `ipfs://` URI) of the file.
+        base_url: Gateway URL prefix to try first on a cache miss, ahead of `IPFS_GATEWAYS`.
+        cache: Cache to use; defaults to the process-wide cache.
+        validate: Optional function that returns whether fetched content is
+            acceptable; rejected content is refetched from another gateway.
+
+    Returns:
+        The file contents, or None if the file could not be fetched.
+    """
+    cid = normalize_cid(cid)
+    cache = cache or get_default_cache()
+
+    content = cache.get(cid)
+    if content is None:
+        gateways = ([base_url] if base_url else []) + get_gateways()
+        content = ipfs_gateways.get_fetcher(gateways).fetch(cid, validate)
+        if content is None:
+            print(f"Could not fetch {cid} from any of {len(set(gateways))} gateways")
+            return None
+        cache.put(cid, content)
+    return content
+
+
+def looks_like_json(content: bytes) -> bool:
+    """Cheap check, for `validate`, that rejects HTML error pages served with a 200 status."""
+    return content.lstrip()[:1] in (b"{", b"[", b'"')
+
+
+def retrieve_ipfs_file(cid: str, base_url: str = None, cache: IPFSCache = None) -> dict:
+    """
+    Fetches JSON data from IPFS, serving it from the local cache when possible.
+
+    Args:
+        cid: The content identifier (or `ipfs://` URI) of the file.
+        base_url: Gateway URL prefix to try first on a cache miss, ahead of `IPFS_GATEWAYS`.
+        cache: Cache to use; defaults to the process-wide cache.
+
+    Returns:
+        JSON data as a dictionary, or None if the file could not be fetched.
+    """
+    content = retrieve_ipfs_content(cid, base_url, cache, validate=looks_like_json)
+    if content is None:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError as e:
+        print(f"Invalid JSON at {cid}: {e}")
+        return None
+
+
+def _metadata_key(cid: str, keys: list, skip_keys: list) -> str:
+    # Cache entries of parsed metadata are keyed by the CID and the field selection
+    wanted = "*" if keys is None else ",".join(sorted(keys))
+    return f"{cid}#metadata?keys={wanted}&skip={','.join(sorted(skip_keys))}"
+
+
+def retrieve_ipfs_metadata(cid: str, keys: list = None, skip_keys: list = None, base_url: str = None,
+                           cache: IPFSCache = None) -> dict:
+    """
+    Fetches a hypercert metadata file from IPFS, decoding only the wanted top-level fields.
+
+    The response is parsed as it arrives, so skipped fields such as `image` are
+    never held in memory (see `metadata_parser`). The cache stores only the kept
+    fields, under a key made of the CID and the field selection; a file already
+    cached whole, e.g. by `retrieve_ipfs_content`, is parsed from the cache.
+
+    Args:
+        cid: The content identifier (or `ipfs://` URI) of the file.
+        keys: If given, only these top-level fields are decoded.
+        skip_keys: Top-level fields to skip; defaults to `METADATA_SKIP_KEYS`.
+        base_url: Gateway URL prefix to try first on a cache miss, ahead of `IPFS_GATEWAYS`.
+        cache: Cache to use; defaults to the process-wide cache.
+
+    Returns:
+        The metadata as a dictionary, or None if the file could not be fetched.
+    """
+    cid = normalize_cid(cid)
+    cache = cache or get_default_cache()
+    if skip_keys is None:
+        skip_keys = metadata_parser.get_skip_keys()
+    key = _metadata_key(cid, keys, skip_keys)
+
+    content = cache.get(key)
+    if content is not None:
+        return json.loads(content)
+    content = cache.get(cid)
+    if content is not None:
+        try:
+            return metadata_parser.parse_metadata(content, skip_keys=skip_keys, keys=keys)
+        except ValueError as e:
+            print(f"Invalid JSON at {cid}: {e}")
+            return None
+
+    def read(chunks):
+        return metadata_parser.parse_metadata(chunks, skip_keys=skip_keys, keys=keys)
+
+    gateways = ([base_url] if base_url else []) + get_gateways()
+    metadata = ipfs_gateways.get_fetcher(gateways).fetch(cid, read=read)
+    if metadata is None:
+        print(f"Could not fetch valid metadata for {cid} from any of {len(set(gateways))} gateways")
+        return None
+    cache.put(key, json.dumps(metadata).encode())
+    return metadata
@@ -0,0 +1,303 @@
+"""
+Hedged IPFS fetches across an ordered list of gateways.
+
+A file is requested from the first healthy gateway. If no response has
+arrived once the gateway's usual latency (a percentile of its recent
+successful requests) has passed, the next gateway is asked as well, and so on
+down the list; the first valid response wins, and the requests still running
+are abandoned: queued ones are cancelled and the others stop reading their
+response at the next chunk, closing the connection. A gateway that fails is
+followed by the next one immediately. Response bodies are handed to the caller
+as an iterator of chunks, so a file can be parsed as it arrives instead of
+being held whole.
+
+Each gateway has a circuit breaker: after several consecutive failures it is
+skipped for a cooldown period, then given a single trial request. Per-gateway
+request counts and latency percentiles are recorded and printed at the end of
+a run.
+
+Requests to each gateway host are capped at `IPFS_MAX_REQUESTS_PER_HOST` in
+flight (default 4) across all fetchers in the process.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+REQUEST_TIMEOUT = 60
+CONNECT_TIMEOUT = 10
+HEDGE_PERCENTILE = 90
+DEFAULT_HEDGE_DELAY = 2.0
+MIN_HEDGE_DELAY = 0.1
+MIN_LATENCY_SAMPLES = 5
+LATENCY_WINDOW = 200
+FAILURE_THRESHOLD = 3
+COOLDOWN = 30
+MAX_WORKERS = 32
+CHUNK_SIZE = 1 << 16
+DEFAULT_MAX_REQUESTS_PER_HOST = 4
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+@contextmanager
+def host_limit(url: str, limit: int = None):
+    """
+    Caps the number of in-flight requests to the host serving the given URL.
+
+    Args:
+        url: The URL about to be requested.
+        limit: Maximum in-flight requests to the host; defaults to
+            `IPFS_MAX_REQUESTS_PER_HOST`. Only the first request to a host sets it.
+    """
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            if limit is None:
+                limit = int(os.environ.get("IPFS_MAX_REQUESTS_PER_HOST") or DEFAULT_MAX_REQUESTS_PER_HOST)
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+        semaphore = _host_semaphores[host]
+    with semaphore:
+        yield
+
+
+class _Cancelled(Exception):
+    """Raised while reading a response once another gateway has won."""
+
+
+def _percentile(values: list, percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class Gateway:
+    """
+    Health and latency of one IPFS gateway.
+
+    Args:
+        url: Gateway URL prefix that CIDs are appended to.
+        failure_threshold: Consecutive failures after which the circuit opens.
+        cooldown: Seconds an open circuit stays open before a trial request.
+    """
+
+    def __init__(self, url: str, failure_threshold: int = FAILURE_THRESHOLD, cooldown: float = COOLDOWN):
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.counts = {"requests": 0, "successes": 0, "failures": 0, "misses": 0, "invalid": 0, "cancelled": 0,
+                       "wins": 0}
+        self.lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Returns whether the circuit is closed, or open but due for a trial request."""
+        with self.lock:
+            if self.consecutive_failures < self.failure_threshold:
+                return True
+            if time.monotonic() >= self.open_until:
+                # Half-open: let one request through and re-open until it resolves
+                self.open_until = time.monotonic() + self.cooldown
+                return True
+            return False
+
+    def hedge_delay(self) -> float:
+        """Returns how long to wait for this gateway before asking the next one."""
+        with self.lock:
+            if len(self.latencies) < MIN_LATENCY_SAMPLES:
+                return DEFAULT_HEDGE_DELAY
+            return max(MIN_HEDGE_DELAY, _percentile(self.latencies, HEDGE_PERCENTILE))
+
+    def record(self, outcome: str, latency: float = None) -> None:
+        """
+        Records the outcome of a request.
+
+        Args:
+            outcome: "success", "failure" (network error or 5xx), "miss" (other
+                HTTP error), "invalid" (content rejected by the caller) or
+                "cancelled" (abandoned after another gateway won).
+            latency: Seconds the request took, for successes.
+        """
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts[{"success": "successes", "failure": "failures", "miss": "misses"}.get(outcome, outcome)] += 1
+            if outcome == "success":
+                self.latencies.append(latency)
+                self.consecutive_failures = 0
+            elif outcome in ("failure", "invalid"):
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failure_threshold:
+                    self.open_until = time.monotonic() + self.cooldown
+
+    def stats(self) -> dict:
+        """Returns the gateway's request counts, latency percentiles and circuit state."""
+        with self.lock:
+            stats = dict(self.counts)
+            latencies = list(self.latencies)
+            is_open = self.consecutive_failures >= self.failure_threshold
+        stats["p50_seconds"] = _percentile(latencies, 50) if latencies else None
+        stats["p90_seconds"] = _percentile(latencies, 90) if latencies else None
+        stats["circuit"] = "open" if is_open else "closed"
+        return stats
+
+
+class GatewayFetcher:
+    """
+    Fetches IPFS files from a list of gateways with hedged requests; safe to share across threads.
+
+    Args:
+        gateways: Gateway URL prefixes, in order of preference.
+        timeout: Read timeout of each request, in seconds.
+        max_workers: Maximum number of requests in flight across all fetches.
+    """
+
+    def __init__(self, gateways: list, timeout: float = REQUEST_TIMEOUT, max_workers: int = MAX_WORKERS):
+        self.gateways = [Gateway(url) for url in dict.fromkeys(gateways)]
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ipfs")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.gateways), pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _candidates(self) -> list:
+        available = [g for g in self.gateways if g.available()]
+        # If every circuit is open, try them all rather than fail without a request
+        return available or list(self.gateways)
+
+    def _get(self, gateway: Gateway, cid: str, validate, read, cancelled: threading.Event):
+        with host_limit(gateway.url):
+            if cancelled.is_set():
+                return None
+            start = time.monotonic()
+            try:
+                with self.session.get(f"{gateway.url}{cid}", timeout=(CONNECT_TIMEOUT, self.timeout),
+                                      stream=True) as response:
+                    if response.status_code >= 500 or response.status_code == 429:
+                        gateway.record("failure")
+                        return None
+                    if response.status_code != 200:
+                        gateway.record("miss")
+                        return None
+
+                    def chunks():
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            if cancelled.is_set():
+                                raise _Cancelled
+                            yield chunk
+
+                    content = read(chunks())
+            except _Cancelled:
+                # Another gateway won; closing the response drops the connection
+                gateway.record("cancelled")
+                return None
+            except requests.exceptions.RequestException as e:
+                print(f"{gateway.url}{cid}: {e}")
+                gateway.record("failure")
+                return None
+            except ValueError:
+                gateway.record("invalid")
+                return None
+        if validate is not None and not validate(content):
+            gateway.record("invalid")
+            return None
+        gateway.record("success", time.monotonic() - start)
+        return content
+
+    def fetch(self, cid: str, validate=None, read=b"".join):
+        """
+        Fetches a file, hedging across gateways.
+
+        Args:
+            cid: The content identifier of the file, including any path.
+            validate: Optional function that returns whether the content of a
+                response is acceptable; rejected responses count as failures of
+                that gateway and the next one is tried.
+            read: Function that consumes an iterator over the chunks of a
+                response body as they arrive and returns the content; by default
+                the chunks are joined. A ValueError rejects the response like
+                `validate` does.
+
+        Returns:
+            The content of the first valid response, or None if every gateway failed.
+        """
+        candidates = self._candidates()
+        futures = {}
+        cancelled = threading.Event()
+
+        def launch(gateway):
+            future = self.executor.submit(self._get, gateway, cid, validate, read, cancelled)
+            futures[future] = gateway
+            return future
+
+        pending = {launch(candidates[0])}
+        launched = 1
+        while pending:
+            delay = candidates[launched - 1].hedge_delay() if launched < len(candidates) else None
+            done, pending = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            failed = False
+            for future in done:
+                content = future.result()
+                if content is not None:
+                    cancelled.set()
+                    for loser in pending:
+                        loser.cancel()
+                    gateway = futures[future]
+                    with gateway.lock:
+                        gateway.counts["wins"] += 1
+                    return content
+                failed = True
+            # Ask the next gateway when the current ones are slow or have failed
+            if launched < len(candidates) and (failed or not done):
+                pending.add(launch(candidates[launched]))
+                launched += 1
+        return None
+
+    def stats(self) -> dict:
+        """Returns the stats of every gateway, keyed by URL."""
+        return {gateway.url: gateway.stats() for gateway in self.gateways}
+
+    def print_stats(self) -> None:
+        """Prints a per-gateway summary."""
+        for url, stats in self.stats().items():
+            p50 = f"{stats['p50_seconds']:.3f}s" if stats["p50_seconds"] is not None else "-"
+            p90 = f"{stats['p90_seconds']:.3f}s" if stats["p90_seconds"] is not None else "-"
+            print(f"{url}: {stats['requests']} requests, {stats['wins']} used, {stats['failures']} failures, "
+                  f"{stats['misses']} misses, {stats['invalid']} invalid, {stats['cancelled']} cancelled, "
+                  f"p50 {p50}, p90 {p90}, "
+                  f"circuit {stats['circuit']}")
+
+
+_fetchers = {}
+_fetchers_lock = threading.Lock()
+
+
+def get_fetcher(gateways: list) -> GatewayFetcher:
+    """
+    Returns the process-wide fetcher for a list of gateways, creating it on first use.
+
+    Args:
+        gateways: Gateway URL prefixes, in order of preference.
+    """
+    key = tuple(dict.fromkeys(gateways))
+    with _fetchers_lock:
+        if key not in _fetchers:
+            _fetchers[key] = GatewayFetcher(list(key))
+        return _fetchers[key]
+
+
+def print_stats() -> None:
+    """Prints the summary of every fetcher created with `get_fetcher`."""
+    with _fetchers_lock:
+        fetchers = list(_fetchers.values())
+    for fetcher in fetchers:
+        fetcher.print_stats()
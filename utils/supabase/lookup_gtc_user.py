@@ -1,8 +1,13 @@
 from dotenv import load_dotenv
+import csv
+import itertools
+import json
 import os
 from supabase import create_client, Client
 import sys
 
+import supabase_prefetch
+
 load_dotenv()
 url = os.environ.get("SUPABASE_URL")
 key = os.environ.get("SUPABASE_KEY")
@@ -11,6 +16,9 @@ supabase: Client = create_client(url, key)
 allowlist_source = "gtc-alpha-allowlist"
 allowlist_cache  = "optimism-allowlistCache"
 
+# Addresses per `in_()` filter; 200 addresses keep the request URL under ~10 KB
+ADDRESS_CHUNK_SIZE = 200
+
 def lookup_user(user_address):
 
    user_address = user_address.lower()
@@ -39,5 +47,102 @@ def lookup_user(user_address):
    
 
 
+def read_addresses(lines):
+   """
+   Yields the lowercased addresses in the lines of a file.
+
+   A file whose first line is a CSV header with an `address` column is read with
+   `csv.DictReader`, whatever the column's position; otherwise each line holds
+   one address, or a CSV row starting with one.
+   """
+   lines = iter(lines)
+   first = next(lines, None)
+   if first is None:
+      return
+   header = [name.strip().lower() for name in next(csv.reader([first]), [])]
+   if "address" in header:
+      rows = csv.DictReader(lines, fieldnames=header)
+      addresses = (row["address"] for row in rows)
+   else:
+      addresses = (row[0] if row else "" for row in csv.reader(itertools.chain([first], lines)))
+   for address in addresses:
+      address = (address or "").strip().lower()
+      if address:
+         yield address
+
+
+def fetch_by_address(table, column, addresses):
+   """Returns a dictionary mapping each of the addresses to the sorted values of `column` in its rows of `table`."""
+   build_query = lambda: (supabase
+                          .table(table)
+                          .select(f'{column}, address', count="exact")
+                          .in_('address', addresses)
+                          .order('address')
+                          .order(column))
+   values = {address: [] for address in addresses}
+   for row in supabase_prefetch.fetch_all_rows(build_query):
+      values.setdefault(row["address"], []).append(row[column])
+   return {address: sorted(v) for address, v in values.items()}
+
+
+def lookup_users(addresses, chunk_size=ADDRESS_CHUNK_SIZE):
+   """
+   Looks up many addresses, `chunk_size` at a time with one query per table.
+
+   Yields one result per distinct address, in input order, with its Gitcoin
+   projects and the hypercerts it may claim.
+   """
+   seen = set()
+   chunk = []
+
+   def resolve(chunk):
+      projects = fetch_by_address(allowlist_source, 'project', chunk)
+      claims = fetch_by_address(allowlist_cache, 'claimId', chunk)
+      for address in chunk:
+         yield {"address": address, "projects": projects[address], "claimIds": claims[address]}
+
+   for address in addresses:
+      if address in seen:
+         continue
+      seen.add(address)
+      chunk.append(address)
+      if len(chunk) >= chunk_size:
+         yield from resolve(chunk)
+         chunk = []
+   if chunk:
+      yield from resolve(chunk)
+
+
+def lookup_batch(infile, outfile, fmt="json"):
+   """
+   Looks up the addresses listed in `infile` and streams the results to `outfile`.
+
+   The output is JSON Lines (one object per address) or CSV with `;`-separated lists.
+   """
+   results = lookup_users(read_addresses(infile))
+   if fmt == "csv":
+      writer = csv.writer(outfile, lineterminator="\n")
+      writer.writerow(["address", "projects", "claimIds"])
+      for result in results:
+         writer.writerow([result["address"], ";".join(map(str, result["projects"])), ";".join(result["claimIds"])])
+         outfile.flush()
+   elif fmt == "json":
+      for result in results:
+         outfile.write(json.dumps(result) + "\n")
+         outfile.flush()
+   else:
+      raise ValueError(f"Unknown output format {fmt}; use json or csv")
+
+
 if __name__ == "__main__":
-   lookup_user(user_address=sys.argv[1]) 
\ No newline at end of file
+   if sys.argv[1:2] == ["batch"]:
+      # python lookup_gtc_user.py batch [addresses.txt | -] [json | csv]
+      path = sys.argv[2] if len(sys.argv) > 2 else "-"
+      fmt = sys.argv[3] if len(sys.argv) > 3 else "json"
+      if path == "-":
+         lookup_batch(sys.stdin, sys.stdout, fmt)
+      else:
+         with open(path) as f:
+            lookup_batch(f, sys.stdout, fmt)
+   else:
+      lookup_user(user_address=sys.argv[1])
@@ -0,0 +1,308 @@
+"""
+Decoder for allowlists stored as OpenZeppelin StandardMerkleTree dumps.
+
+Hypercert allowlists are `StandardMerkleTree.dump()` objects encoded as a JSON
+string and pinned to IPFS:
+
+    {"format": "standard-v1", "tree": [...], "values": [{"value": [address, units], "treeIndex": i}, ...],
+     "leafEncoding": ["address", "uint256"]}
+
+Only the `values` array is needed for accounting. The decoder reads the dump
+in chunks without building the document: the wrapping JSON string is
+unescaped chunk by chunk, the `tree` hashes are skipped, and entries of
+`values` are decoded one at a time into columnar arrays. Besides the chunk
+being read, memory holds 28 bytes per entry rather than the whole dump.
+"""
+
+import base64
+import codecs
+import json
+import re
+
+import numpy as np
+
+ADDRESS_BYTES = 20
+LEAF_ENCODING = ["address", "uint256"]
+INT64_MAX = np.iinfo(np.int64).max
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+_structural = re.compile(r'["\[\]{}]')
+_string_special = re.compile(r'["\\]')
+# The longest run of complete characters and escapes at the start of a JSON string's contents
+_string_body = re.compile(r'(?:[^"\\]+|\\(?:u[0-9a-fA-F]{4}|[^u]))*')
+
+
+class MerkleAllowlist:
+    """
+    Columnar allowlist: one row per merkle tree leaf, in tree `values` order.
+
+    Attributes:
+        addresses: NumPy `uint8` array of shape (n, 20) holding the address bytes.
+        units: NumPy array of units per leaf (`int64`, or `object` if any
+            value does not fit in 64 bits).
+    """
+
+    def __init__(self, addresses: np.ndarray, units: np.ndarray):
+        self.addresses = addresses
+        self.units = units
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def hex_address_array(self) -> np.ndarray:
+        """Returns the addresses as a NumPy array of lowercase `0x`-prefixed hex strings."""
+        digits = np.frombuffer(self.addresses.tobytes().hex().encode(), dtype=f"S{2 * ADDRESS_BYTES}")
+        return np.char.add("0x", digits.astype(f"U{2 * ADDRESS_BYTES}"))
+
+    def hex_addresses(self) -> list:
+        """Returns the addresses as lowercase `0x`-prefixed hex strings."""
+        return self.hex_address_array().tolist()
+
+    def to_json(self) -> dict:
+        """Returns a compact JSON-serializable form of the allowlist."""
+        return {
+            "addresses": base64.b64encode(self.addresses.tobytes()).decode(),
+            "units": self.units.tolist()
+        }
+
+    @classmethod
+    def from_json(cls, data) -> "MerkleAllowlist":
+        """
+        Loads an allowlist from `to_json` output.
+
+        The `[[address, units], ...]` pairs written by earlier versions of the
+        accounting script are also accepted.
+        """
+        if isinstance(data, dict):
+            return cls(_addresses_array(base64.b64decode(data["addresses"])), _units_array(data["units"]))
+        return _from_pairs(data)
+
+
+def _address_bytes(address: str) -> bytes:
+    raw = bytes.fromhex(address[2:] if address[:2] in ("0x", "0X") else address)
+    if len(raw) != ADDRESS_BYTES:
+        raise ValueError(f"Invalid address in allowlist: {address}")
+    return raw
+
+
+def _addresses_array(raw: bytes) -> np.ndarray:
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, ADDRESS_BYTES)
+
+
+def _units_array(units: list) -> np.ndarray:
+    if units and max(units) > INT64_MAX:
+        return np.array(units, dtype=object)
+    return np.array(units, dtype=np.int64)
+
+
+def _from_pairs(pairs) -> MerkleAllowlist:
+    addresses = bytearray()
+    units = []
+    for address, amount in pairs:
+        addresses += _address_bytes(address)
+        units.append(int(amount))
+    return MerkleAllowlist(_addresses_array(bytes(addresses)), _units_array(units))
+
+
+def _text_chunks(content, chunk_size: int):
+    # Yields the dump as text in pieces of about `chunk_size`, decoding UTF-8 incrementally
+    if isinstance(content, str):
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+        return
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        view = memoryview(content)
+        source = (view[i:i + chunk_size] for i in range(0, len(view), chunk_size))
+    elif hasattr(content, "read"):
+        source = iter(lambda: content.read(chunk_size) or None, None)
+    else:
+        source = content
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in source:
+        yield chunk if isinstance(chunk, str) else decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def _unwrap(chunks):
+    # Yields the decoded contents of a JSON string, given the text that
+    # follows its opening quote; an escape cut by a chunk boundary is carried over
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        end = _string_body.match(pending).end()
+        yield json.loads(f'"{pending[:end]}"')
+        if pending[end:end + 1] == '"':
+            return
+        pending = pending[end:]
+    raise ValueError("Unterminated string in merkle tree dump")
+
+
+class _Reader:
+    """Cursor over a JSON text arriving in chunks; only the unread part of the current chunk is kept."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text = ""
+        self.idx = 0
+        self.eof = False
+
+    def _more(self) -> bool:
+        for chunk in self.chunks:
+            if chunk:
+                self.text = self.text[self.idx:] + chunk
+                self.idx = 0
+                return True
+        self.eof = True
+        return False
+
+    def remaining(self):
+        """Yields the unread text."""
+        yield self.text[self.idx:]
+        yield from self.chunks
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character, or "" at the end of the text."""
+        while True:
+            self.idx = _whitespace.match(self.text, self.idx).end()
+            if self.idx < len(self.text) or not self._more():
+                return self.text[self.idx:self.idx + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in merkle tree dump")
+        self.idx += 1
+
+    def decode(self):
+        """Decodes the next value, which must fit in memory."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.idx)
+                # A number at the end of the text may continue in the next chunk
+                if end < len(self.text) or self.eof:
+                    self.idx = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._more()
+
+    def skip(self) -> None:
+        """Steps over the next value without decoding it."""
+        if self.peek() not in ("[", "{"):
+            self.decode()
+            return
+        depth = 0
+        in_string = False
+        while True:
+            text, idx = self.text, self.idx
+            while True:
+                if in_string:
+                    match = _string_special.search(text, idx)
+                    if match is None:
+                        idx = len(text)
+                        break
+                    if match.group() == "\\":
+                        if match.end() == len(text):
+                            # Keep the backslash with the character it escapes
+                            idx = match.start()
+                            break
+                        idx = match.end() + 1
+                        continue
+                    in_string = False
+                    idx = match.end()
+                    continue
+                match = _structural.search(text, idx)
+                if match is None:
+                    idx = len(text)
+                    break
+                token = match.group()
+                idx = match.end()
+                if token == '"':
+                    in_string = True
+                elif token in "[{":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        self.idx = idx
+                        return
+            self.idx = idx
+            if not self._more():
+                raise ValueError("Unterminated value in merkle tree dump")
+
+
+def _read_values(reader: _Reader, addresses: bytearray, units: list) -> None:
+    """Appends each entry of the `values` array at the reader's position to the columns."""
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.idx += 1
+        return
+    while True:
+        entry = reader.decode()
+        address, amount = entry["value"]
+        addresses += _address_bytes(address)
+        units.append(int(amount))
+        if reader.peek() == "]":
+            reader.idx += 1
+            return
+        reader.expect(",")
+
+
+def decode_standard_merkle_tree(content, chunk_size: int = CHUNK_SIZE) -> MerkleAllowlist:
+    """
+    Decodes an OpenZeppelin StandardMerkleTree dump into a columnar allowlist.
+
+    The dump is read `chunk_size` characters at a time, so besides the
+    content passed in, memory holds one chunk and the decoded columns.
+
+    Args:
+        content: The dump as bytes or str, a binary file, or an iterable of
+            bytes or str chunks; either the raw JSON object or the object
+            wrapped in a JSON string as stored on IPFS by the hypercerts SDK.
+        chunk_size: Number of bytes or characters read at a time.
+
+    Returns:
+        The allowlist entries as a MerkleAllowlist.
+
+    Raises:
+        ValueError: If the content is not a StandardMerkleTree dump with an
+            `["address", "uint256"]` leaf encoding.
+    """
+    reader = _Reader(_text_chunks(content, chunk_size))
+    if reader.peek() == '"':
+        reader.idx += 1
+        reader = _Reader(_unwrap(reader.remaining()))
+
+    addresses = bytearray()
+    units = []
+    leaf_encoding = LEAF_ENCODING
+    found_values = False
+
+    reader.expect("{")
+    while reader.peek() != "}":
+        if reader.eof:
+            raise ValueError("Unexpected end of merkle tree dump")
+        key = reader.decode()
+        reader.expect(":")
+        if key == "values":
+            found_values = True
+            _read_values(reader, addresses, units)
+        elif key == "leafEncoding":
+            leaf_encoding = reader.decode()
+        else:
+            reader.skip()
+        if reader.peek() == ",":
+            reader.idx += 1
+    reader.idx += 1
+    if reader.peek():
+        raise ValueError("Extra data after merkle tree dump")
+
+    if not found_values:
+        raise ValueError("Merkle tree dump has no values")
+    if leaf_encoding != LEAF_ENCODING:
+        raise ValueError(f"Unsupported leaf encoding: {leaf_encoding}")
+
+    return MerkleAllowlist(_addresses_array(bytes(addresses)), _units_array(units))
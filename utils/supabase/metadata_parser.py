@@ -0,0 +1,241 @@
+"""
+Streaming parser for hypercert metadata files that skips unwanted top-level fields.
+
+Hypercert metadata is a flat JSON object whose `image` field is usually a
+base64 data URI of several megabytes, while the scripts only need a few small
+fields. The parser is fed the file in chunks as they arrive and scans them for
+the span of each top-level value, keeping the bytes of wanted values and
+decoding them once complete. Skipped values are stepped over with byte
+searches and dropped with the chunk they arrived in, so memory is bounded by
+the chunk size and the kept fields rather than by the size of the file.
+
+The fields skipped by default are read from `METADATA_SKIP_KEYS`, a
+comma-separated list of top-level keys (default `image`).
+"""
+
+import json
+import os
+import re
+
+DEFAULT_METADATA_SKIP_KEYS = ["image"]
+
+_whitespace = re.compile(rb"[ \t\n\r]*")
+_structural = re.compile(rb'["\[\]{}]')
+_scalar = re.compile(rb"[^,\]}\s]*")
+
+
+def get_skip_keys() -> list:
+    """Returns the top-level metadata keys configured in the environment to be skipped."""
+    keys = os.environ.get("METADATA_SKIP_KEYS")
+    if not keys:
+        return list(DEFAULT_METADATA_SKIP_KEYS)
+    return [key.strip() for key in keys.split(",") if key.strip()]
+
+
+class MetadataParser:
+    """
+    Incremental parser of a metadata file fed in chunks.
+
+    Call `feed` with each chunk of the file in order, then `close` to get the
+    metadata. Values that span chunk boundaries are tracked with a small scan
+    state (nesting depth, whether inside a string, a pending backslash), so no
+    chunk is kept once it has been fed, apart from the bytes of kept values.
+
+    Args:
+        skip_keys: Top-level keys whose values are skipped; defaults to `get_skip_keys()`.
+        keys: If given, only these top-level keys are decoded.
+    """
+
+    def __init__(self, skip_keys: list = None, keys: list = None):
+        self.skip = set(get_skip_keys() if skip_keys is None else skip_keys)
+        self.wanted = set(keys) if keys is not None else None
+        self.metadata = {}
+        # One of "start", "first_key", "key_start", "key", "colon", "value_start",
+        # "value", "comma", "done", or "other" for a document that is not an object
+        self._state = "start"
+        self._offset = 0
+        self._key = None
+        self._value = None
+        self._reset_scan()
+
+    def _reset_scan(self):
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._scalar = False
+
+    def _scan(self, buf, pos: int, offset: int):
+        # Returns where the current key or value ends, or None if it continues past `buf`
+        n = len(buf)
+        if not self._started:
+            self._started = True
+            char = buf[pos]
+            if char == 0x22:
+                self._in_string = True
+                pos += 1
+            elif char in (0x5B, 0x7B):
+                self._depth = 1
+                pos += 1
+            elif char in b",:]}":
+                raise ValueError(f"Expected a value at byte {offset + pos}")
+            else:
+                self._scalar = True
+        while True:
+            if self._scalar:
+                end = _scalar.match(buf, pos).end()
+                return end if end < n else None
+            if self._escape:
+                if pos == n:
+                    return None
+                pos += 1
+                self._escape = False
+            if self._in_string:
+                # Two byte searches are much faster than a regex over a long string
+                quote = buf.find(b'"', pos)
+                backslash = buf.find(b"\\", pos, n if quote < 0 else quote)
+                if backslash >= 0:
+                    self._escape = True
+                    pos = backslash + 1
+                    continue
+                if quote < 0:
+                    return None
+                pos = quote + 1
+                self._in_string = False
+                if self._depth == 0:
+                    return pos
+                continue
+            m = _structural.search(buf, pos)
+            if m is None:
+                return None
+            pos = m.end()
+            char = buf[m.start()]
+            if char == 0x22:
+                self._in_string = True
+            elif char in (0x5B, 0x7B):
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return pos
+
+    def _finish(self):
+        if self._state == "key":
+            self._key = json.loads(self._value)
+            self._state = "colon"
+        else:
+            if self._value is not None:
+                self.metadata[self._key] = json.loads(self._value)
+            self._state = "comma"
+        self._value = None
+
+    def feed(self, chunk) -> None:
+        """
+        Parses the next chunk of the file.
+
+        Raises:
+            ValueError: If the content is not valid JSON.
+        """
+        offset = self._offset
+        self._offset += len(chunk)
+        if self._state == "other":
+            self._value += chunk
+            return
+        pos = 0
+        n = len(chunk)
+        while pos < n:
+            state = self._state
+            if state in ("key", "value"):
+                end = self._scan(chunk, pos, offset)
+                if self._value is not None:
+                    self._value += chunk[pos:n if end is None else end]
+                if end is None:
+                    return
+                self._finish()
+                pos = end
+                continue
+            pos = _whitespace.match(chunk, pos).end()
+            if pos == n:
+                return
+            char = chunk[pos]
+            if state == "start":
+                if char != 0x7B:
+                    # Not an object, so there are no fields to skip
+                    self._state = "other"
+                    self._value = bytearray(chunk[pos:])
+                    return
+                self._state = "first_key"
+                pos += 1
+            elif state in ("first_key", "key_start"):
+                if state == "first_key" and char == 0x7D:
+                    self._state = "done"
+                    pos += 1
+                elif char != 0x22:
+                    raise ValueError(f"Expected a key at byte {offset + pos}")
+                else:
+                    self._state = "key"
+                    self._value = bytearray()
+                    self._reset_scan()
+            elif state == "colon":
+                if char != 0x3A:
+                    raise ValueError(f"Expected ':' at byte {offset + pos}")
+                self._state = "value_start"
+                pos += 1
+            elif state == "value_start":
+                keep = self._key not in self.skip and (self.wanted is None or self._key in self.wanted)
+                self._state = "value"
+                self._value = bytearray() if keep else None
+                self._reset_scan()
+            elif state == "comma":
+                if char == 0x7D:
+                    self._state = "done"
+                elif char == 0x2C:
+                    self._state = "key_start"
+                else:
+                    raise ValueError(f"Expected ',' or '}}' at byte {offset + pos}")
+                pos += 1
+            else:
+                raise ValueError(f"Extra data at byte {offset + pos}")
+
+    def close(self):
+        """
+        Finishes parsing.
+
+        Returns:
+            The metadata as a dictionary without the skipped fields.
+
+        Raises:
+            ValueError: If the content is not valid JSON or ends early.
+        """
+        if self._state == "other":
+            return json.loads(self._value)
+        if self._state == "value" and self._scalar:
+            self._finish()
+        if self._state != "done":
+            raise ValueError("Unexpected end of JSON")
+        return self.metadata
+
+
+def parse_metadata(content, skip_keys: list = None, keys: list = None) -> dict:
+    """
+    Parses a metadata file, decoding only the wanted top-level fields.
+
+    Args:
+        content: Raw bytes (or text) of the JSON file, or an iterable of byte chunks.
+        skip_keys: Top-level keys whose values are skipped; defaults to `get_skip_keys()`.
+        keys: If given, only these top-level keys are decoded.
+
+    Returns:
+        The metadata as a dictionary without the skipped fields.
+
+    Raises:
+        ValueError: If the content is not valid JSON.
+    """
+    parser = MetadataParser(skip_keys, keys)
+    if isinstance(content, str):
+        content = [content.encode()]
+    elif isinstance(content, (bytes, bytearray, memoryview)):
+        content = [content]
+    for chunk in content:
+        parser.feed(chunk)
+    return parser.close()
@@ -0,0 +1,246 @@
+"""
+Near-duplicate claim detection with MinHash and locality-sensitive hashing.
+
+Each claim is reduced to a text made of its title, its description (when the
+snapshot has one) and its work scopes. The text is cut into overlapping
+character shingles, and a MinHash signature of `NUM_PERM` values is computed
+for every claim: the fraction of equal values in two signatures estimates the
+Jaccard similarity of the claims' shingle sets. Signatures are split into
+bands, and claims that share a whole band land in the same bucket; only those
+candidate pairs are considered, so the work grows with the number of claims
+and candidates rather than with the number of pairs. Candidates whose
+signatures agree closely enough are then scored with their exact Jaccard
+similarity against the threshold.
+
+Shingling and hashing are done with NumPy over batches of claims.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from claims_table import dimension_values, parse_field
+
+DEFAULT_THRESHOLD = 0.8
+NUM_PERM = 64
+SHINGLE_SIZE = 5
+BATCH_SIZE = 10000
+SCORE_BATCH_SIZE = 1000000
+SMALL_BUCKET_SIZE = 64
+MIN_RECALL = 0.95
+ESTIMATE_MARGIN = 0.1
+SEED = 42
+
+_whitespace = re.compile(r"\s+")
+
+
+def work_scope(hypercert) -> list:
+    """
+    Returns the work scopes of a claim's `hypercert` field.
+
+    Args:
+        hypercert: The field as a dictionary, or as stored in the claims CSV
+            (a JSON or Python literal string).
+
+    Returns:
+        List of work scopes, empty if the field is missing or unreadable.
+    """
+    return dimension_values(parse_field(hypercert), "work_scope") or []
+
+
+def claim_texts(df: pd.DataFrame) -> list:
+    """
+    Builds the text compared for each claim: title, description if present, and work scopes.
+
+    Args:
+        df: Claims with `title` and either `work_scope` or `hypercert` columns,
+            and optionally `description`.
+
+    Returns:
+        List of normalized texts, in the order of `df`.
+    """
+    fields = [df["title"]]
+    if "description" in df.columns:
+        fields.append(df["description"])
+    if "work_scope" in df.columns:
+        # Already structured in the typed claims snapshot
+        fields.append(df["work_scope"].map(lambda scopes: " ".join(scopes) if scopes is not None else None))
+    else:
+        fields.append(df["hypercert"].map(lambda h: " ".join(work_scope(h))))
+    texts = []
+    for values in zip(*fields):
+        text = " ".join(v for v in values if isinstance(v, str))
+        texts.append(_whitespace.sub(" ", text).strip().lower())
+    return texts
+
+
+def lsh_params(threshold: float, num_perm: int = NUM_PERM, min_recall: float = MIN_RECALL) -> tuple:
+    """
+    Chooses the number of bands and rows per band for a similarity threshold.
+
+    A pair with similarity `s` shares at least one band with probability
+    `1 - (1 - s ** rows) ** bands`. The split with the most rows per band (and
+    so the fewest candidate pairs) that still catches pairs at the threshold
+    with probability `min_recall` is chosen.
+
+    Returns:
+        (bands, rows) with `bands * rows <= num_perm`.
+    """
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= min_recall:
+            return bands, rows
+    return num_perm, 1
+
+
+def _shingle_values(texts: list, shingle_size: int) -> tuple:
+    # Packs every window of `shingle_size` bytes into an integer, and returns
+    # the windows of all texts back to back with the offset of each text's first one
+    encoded = [t.encode().ljust(shingle_size) for t in texts]
+    lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+    buf = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(buf, shingle_size)
+    values = np.zeros(len(windows), dtype=np.uint64)
+    for column in range(shingle_size):
+        values = (values << np.uint64(8)) | windows[:, column]
+
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    counts = lengths - shingle_size + 1
+    # Keep only windows that lie within one text
+    keep = np.concatenate([np.arange(s, s + c) for s, c in zip(starts, counts)]) if len(texts) else []
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return values[keep], offsets
+
+
+def minhash_signatures(texts: list, num_perm: int = NUM_PERM, shingle_size: int = SHINGLE_SIZE,
+                       seed: int = SEED, batch_size: int = BATCH_SIZE) -> np.ndarray:
+    """
+    Computes the MinHash signature of each text's character shingles.
+
+    Args:
+        texts: Normalized claim texts; empty texts get no meaningful signature.
+        num_perm: Number of hash functions, i.e. signature length.
+        shingle_size: Number of bytes per shingle.
+        seed: Seed of the hash functions; signatures are only comparable with the same seed.
+        batch_size: Number of texts hashed at a time.
+
+    Returns:
+        `uint32` array of shape (len(texts), num_perm).
+    """
+    rng = np.random.default_rng(seed)
+    # Multiply-add-shift hash functions: the top 32 bits of a * x + b modulo 2**64
+    a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), batch_size):
+        values, offsets = _shingle_values(texts[start:start + batch_size], shingle_size)
+        for p in range(num_perm):
+            hashed = (values * a[p] + b[p]) >> np.uint64(32)
+            signatures[start:start + len(offsets), p] = np.minimum.reduceat(hashed, offsets)
+    return signatures
+
+
+def _bucket_pairs(members: np.ndarray, batch_size: int):
+    # Every (later, earlier) pair of one large bucket's sorted members, about
+    # `batch_size` pairs at a time
+    k = 1
+    while k < len(members):
+        end, total = k + 1, k
+        while end < len(members) and total + end <= batch_size:
+            total += end
+            end += 1
+        ks = np.arange(k, end)
+        i = np.repeat(ks, ks)
+        j = np.arange(len(i)) - np.repeat(np.cumsum(ks) - ks, ks)
+        yield members[i], members[j]
+        k = end
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int, rows: int, rows_mask: np.ndarray = None,
+                    batch_size: int = SCORE_BATCH_SIZE):
+    """
+    Finds the pairs of rows that share at least one band of their signatures.
+
+    Pairs are produced band by band, so a pair sharing several bands is
+    produced once per band.
+
+    Args:
+        signatures: MinHash signatures, one row per claim.
+        bands: Number of bands.
+        rows: Number of signature values per band.
+        rows_mask: Optional boolean array selecting the rows to consider.
+        batch_size: Approximate number of pairs per yielded batch.
+
+    Yields:
+        (i, j) arrays of row positions with `j < i`.
+    """
+    positions = np.arange(len(signatures)) if rows_mask is None else np.flatnonzero(rows_mask)
+    for band in range(bands):
+        keys = np.zeros(len(positions), dtype=np.uint64)
+        for column in range(band * rows, (band + 1) * rows):
+            keys = (keys * np.uint64(0x100000001B3)) ^ signatures[positions, column].astype(np.uint64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(order)])
+        for size in np.unique(sizes[sizes > 1]).tolist():
+            bucket_starts = starts[sizes == size]
+            if size > SMALL_BUCKET_SIZE:
+                for start in bucket_starts.tolist():
+                    yield from _bucket_pairs(positions[order[start:start + size]], batch_size)
+                continue
+            # Buckets of the same size are expanded together
+            j, i = np.triu_indices(size, 1)
+            step = max(1, batch_size // len(i))
+            for chunk in range(0, len(bucket_starts), step):
+                index = bucket_starts[chunk:chunk + step, None] + np.arange(size)
+                members = np.sort(positions[order[index]], axis=1)
+                yield members[:, i].ravel(), members[:, j].ravel()
+
+
+def _shingles(text: str, shingle_size: int) -> set:
+    encoded = text.encode().ljust(shingle_size)
+    return {encoded[k:k + shingle_size] for k in range(len(encoded) - shingle_size + 1)}
+
+
+def jaccard(a: str, b: str, shingle_size: int = SHINGLE_SIZE) -> float:
+    """Returns the Jaccard similarity of two texts' character shingle sets."""
+    a, b = _shingles(a, shingle_size), _shingles(b, shingle_size)
+    return len(a & b) / len(a | b)
+
+
+def find_near_duplicates(texts: list, threshold: float = DEFAULT_THRESHOLD, num_perm: int = NUM_PERM):
+    """
+    Finds the earlier claims each claim is a near-duplicate of.
+
+    Candidate pairs whose estimated similarity is within `ESTIMATE_MARGIN` of
+    the threshold are scored with their exact Jaccard similarity.
+
+    Args:
+        texts: Normalized claim texts (see `claim_texts`), in the order claims are compared.
+        threshold: Minimum Jaccard similarity of a reported pair.
+        num_perm: Signature length; longer signatures give closer estimates.
+
+    Yields:
+        (i, j, similarity) tuples, where text `j` comes before text `i`,
+        ordered by `i`, then by `j`.
+    """
+    n = len(texts)
+    signatures = minhash_signatures(texts, num_perm)
+    bands, rows = lsh_params(threshold - ESTIMATE_MARGIN, num_perm)
+    rows_mask = np.array([bool(t) for t in texts], dtype=bool)
+
+    # Candidates are filtered as they are produced, so only plausible pairs are kept
+    matches = []
+    for i, j in candidate_pairs(signatures, bands, rows, rows_mask):
+        estimate = (signatures[i] == signatures[j]).mean(axis=1)
+        keep = estimate >= threshold - ESTIMATE_MARGIN
+        matches.append(i[keep].astype(np.int64) * n + j[keep])
+    if not matches:
+        return
+    for pair in np.unique(np.concatenate(matches)).tolist():
+        i, j = divmod(pair, n)
+        similarity = jaccard(texts[i], texts[j])
+        if similarity >= threshold:
+            yield i, j, similarity
@@ -0,0 +1,212 @@
+"""
+Helpers for querying the hypercerts subgraph on The Graph.
+
+Claim tokens are paged with keyset pagination (`id_gt` on the last token id
+seen) instead of `skip`, which gets slower on deep pages and is capped by The
+Graph. All pages of a run are pinned to one indexed block so they describe a
+consistent snapshot. In batched mode, tokens for many claims are fetched in a
+single request using GraphQL aliases.
+
+For delta syncs, `iter_changed_tokens` pages through only the tokens changed
+since a given block, using The Graph's `_change_block` filter.
+"""
+
+import os
+
+import graph_client
+
+DEFAULT_SUBGRAPH_URL = "https://api.thegraph.com/subgraphs/name/hypercerts-admin/hypercerts-optimism-mainnet"
+
+PAGE_SIZE = 1000
+BATCH_SIZE = 25
+
+
+def get_subgraph_url() -> str:
+    """Returns the subgraph URL, overridable with `HYPERCERTS_SUBGRAPH_URL`."""
+    return os.environ.get("HYPERCERTS_SUBGRAPH_URL") or DEFAULT_SUBGRAPH_URL
+
+
+def query_subgraph(query: str) -> dict:
+    """
+    Sends a query to the subgraph through the shared Graph client.
+
+    Args:
+        query: The GraphQL query string.
+
+    Returns:
+        Response data in dictionary format.
+
+    Raises:
+        graph_client.GraphQLError: If the query fails or returns errors.
+    """
+    return graph_client.get_client(get_subgraph_url()).query(query)
+
+
+def get_indexed_block(query=query_subgraph) -> int:
+    """
+    Fetches the latest block number indexed by the subgraph.
+
+    Args:
+        query: Function used to send the GraphQL query.
+
+    Returns:
+        The block number, or None if the subgraph did not report one.
+    """
+    data = query('{ _meta { block { number } } }')
+    try:
+        return int(data['_meta']['block']['number'])
+    except (KeyError, TypeError):
+        return None
+
+
+def claim_tokens_selection(claim_id: str, fields: str, last_id: str = "", block: int = None,
+                           alias: str = None) -> str:
+    """
+    Builds a `claimTokens` selection for one page of a claim's tokens.
+
+    Args:
+        claim_id: The ID of the claim.
+        fields: The token fields to select.
+        last_id: The last token ID of the previous page, or "" for the first page.
+        block: Block number to pin the query to.
+        alias: Optional GraphQL alias for the selection.
+
+    Returns:
+        The selection as a GraphQL string.
+    """
+    block_arg = f"block: {{ number: {block} }}" if block is not None else ""
+    prefix = f"{alias}: " if alias else ""
+    return f'''
+        {prefix}claimTokens(
+            where: {{ claim: "{claim_id}", id_gt: "{last_id}" }}
+            first: {PAGE_SIZE}
+            orderBy: id
+            orderDirection: asc
+            {block_arg}
+        ) {{
+            {fields}
+        }}
+    '''
+
+
+def get_claim_tokens_page(claim_id: str, fields: str, last_id: str = "", block: int = None,
+                          query=query_subgraph) -> list:
+    """
+    Fetches one page of tokens for a claim, starting after `last_id`.
+
+    Args:
+        claim_id: The ID of the claim.
+        fields: The token fields to select; must include `id`.
+        last_id: The last token ID of the previous page, or "" for the first page.
+        block: Block number to pin the query to.
+        query: Function used to send the GraphQL query.
+
+    Returns:
+        List of token data.
+    """
+    selection = claim_tokens_selection(claim_id, fields, last_id, block)
+    data = query(f"{{ {selection} }}")
+    return data.get('claimTokens', [])
+
+
+def iter_claim_token_pages(claim_ids: list, fields: str, block: int = None, batch_size: int = BATCH_SIZE,
+                           query=query_subgraph):
+    """
+    Pages through the tokens of many claims, batching claims into aliased queries.
+
+    Each request asks for the next page of up to `batch_size` claims. Claims
+    whose page came back full are carried into the next request with their
+    cursor advanced; the rest are done.
+
+    Args:
+        claim_ids: IDs of the claims to fetch tokens for.
+        fields: The token fields to select; must include `id`.
+        block: Block number to pin every page to.
+        batch_size: Number of claims per request; 1 sends one request per claim page.
+        query: Function used to send the GraphQL query.
+
+    Yields:
+        Tuples of (claim_id, list of token data), one per page.
+
+    Raises:
+        ValueError: If a response is missing a claim's page, e.g. because the query failed.
+    """
+    pending = [(claim_id, "") for claim_id in dict.fromkeys(claim_ids)]
+    batch_size = max(1, batch_size)
+    while pending:
+        batch, pending = pending[:batch_size], pending[batch_size:]
+        selections = [
+            claim_tokens_selection(claim_id, fields, last_id, block, alias=f"c{i}")
+            for i, (claim_id, last_id) in enumerate(batch)
+        ]
+        data = query("{" + "".join(selections) + "}")
+        for i, (claim_id, _) in enumerate(batch):
+            if f"c{i}" not in data:
+                raise ValueError(f"Subgraph returned no claimTokens for claim {claim_id}")
+            tokens = data[f"c{i}"]
+            yield claim_id, tokens
+            if len(tokens) == PAGE_SIZE:
+                pending.append((claim_id, tokens[-1]['id']))
+
+
+def fetch_claim_tokens(claim_ids: list, fields: str, block: int = None, batch_size: int = BATCH_SIZE,
+                       query=query_subgraph) -> dict:
+    """
+    Fetches all tokens of many claims.
+
+    Args:
+        claim_ids: IDs of the claims to fetch tokens for.
+        fields: The token fields to select; must include `id`.
+        block: Block number to pin every page to.
+        batch_size: Number of claims per request.
+        query: Function used to send the GraphQL query.
+
+    Returns:
+        Dictionary mapping each claim ID to its list of token data.
+    """
+    tokens_by_claim = {claim_id: [] for claim_id in claim_ids}
+    for claim_id, tokens in iter_claim_token_pages(claim_ids, fields, block, batch_size, query):
+        tokens_by_claim[claim_id].extend(tokens)
+    return tokens_by_claim
+
+
+def iter_changed_tokens(fields: str, since_block: int, block: int = None, query=query_subgraph):
+    """
+    Pages through the tokens of all claims that changed at or after `since_block`.
+
+    Tokens that were removed since then are not reported.
+
+    Args:
+        fields: The token fields to select; must include `id`.
+        since_block: First block whose changes are included.
+        block: Block number to pin every page to.
+        query: Function used to send the GraphQL query.
+
+    Yields:
+        Lists of token data, one per page.
+
+    Raises:
+        ValueError: If a response is missing its claimTokens, e.g. because the query failed.
+    """
+    block_arg = f"block: {{ number: {block} }}" if block is not None else ""
+    last_id = ""
+    while True:
+        data = query(f'''{{
+            claimTokens(
+                where: {{ _change_block: {{ number_gte: {since_block} }}, id_gt: "{last_id}" }}
+                first: {PAGE_SIZE}
+                orderBy: id
+                orderDirection: asc
+                {block_arg}
+            ) {{
+                {fields}
+            }}
+        }}''')
+        if 'claimTokens' not in data:
+            raise ValueError(f"Subgraph returned no claimTokens changed since block {since_block}")
+        tokens = data['claimTokens']
+        if tokens:
+            yield tokens
+        if len(tokens) < PAGE_SIZE:
+            return
+        last_id = tokens[-1]['id']
@@ -0,0 +1,192 @@
+"""
+Bulk prefetch of Supabase lookups used by the accounting scripts.
+
+Instead of one PostgREST query per claim, the allowlist cache is pulled for
+many claims at once with `in_()` filters and paged with `range()`. PostgREST
+silently caps each response at its max-rows setting, so pages are requested
+until the exact row count reported by the server has been read. The rows are
+indexed in memory by claimId and by address, and can be snapshotted to disk
+and reused for a limited time.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+ALLOWLIST_CACHE_TABLE = "optimism-allowlistCache"
+CLAIMS_TABLE = "claims-metadata-mapping"
+
+PAGE_SIZE = 1000
+CLAIM_CHUNK_SIZE = 50
+SNAPSHOT_PATH = "data/allowlistCacheSnapshot.json"
+DEFAULT_SNAPSHOT_TTL = 3600
+
+
+def iter_pages(build_query, page_size: int = PAGE_SIZE):
+    """
+    Reads every row of a PostgREST query, page by page.
+
+    Pages are requested until the exact row count reported by the server has
+    been read. If a response carries no count, paging continues until a page
+    comes back empty, since a page cut short by max-rows looks like the last one.
+
+    Args:
+        build_query: Function returning a fresh, ordered query builder whose
+            `select` was called with `count="exact"`.
+        page_size: Number of rows to request per page.
+
+    Yields:
+        Lists of rows, one per page.
+    """
+    offset = 0
+    while True:
+        response = build_query().range(offset, offset + page_size - 1).execute()
+        if not response.data:
+            return
+        yield response.data
+        offset += len(response.data)
+        if response.count is not None and offset >= response.count:
+            return
+
+
+def fetch_all_rows(build_query, page_size: int = PAGE_SIZE) -> list:
+    """
+    Reads every row of a PostgREST query.
+
+    Args:
+        build_query: Function returning a fresh, ordered query builder whose
+            `select` was called with `count="exact"`.
+        page_size: Number of rows to request per page.
+
+    Returns:
+        List of rows.
+    """
+    return [row for page in iter_pages(build_query, page_size) for row in page]
+
+
+class AllowlistCacheIndex:
+    """
+    In-memory hash indexes over rows of the allowlist cache table.
+
+    Attributes:
+        claim_ids: The claims the index was built for.
+        by_claim: Dictionary mapping each claimId to its list of addresses.
+        by_address: Dictionary mapping each address to its list of claimIds.
+    """
+
+    def __init__(self, claim_ids, rows: list):
+        self.claim_ids = set(claim_ids)
+        self.rows = rows
+        self.by_claim = {claim_id: [] for claim_id in self.claim_ids}
+        self.by_address = {}
+        for claim_id, address in rows:
+            self.by_claim.setdefault(claim_id, []).append(address)
+            self.by_address.setdefault(address, []).append(claim_id)
+
+    def addresses_for(self, claim_id: str) -> list:
+        """Returns the cached addresses for a claim."""
+        return self.by_claim.get(claim_id, [])
+
+    def claims_for(self, address: str) -> list:
+        """Returns the claims an address is cached for."""
+        return self.by_address.get(address, [])
+
+    def save(self, snapshot_path: str) -> None:
+        """Atomically writes the index rows to a JSON snapshot."""
+        directory = os.path.dirname(snapshot_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"claimIds": sorted(self.claim_ids), "rows": self.rows}, f)
+        os.replace(tmp_path, snapshot_path)
+
+    @classmethod
+    def load(cls, snapshot_path: str) -> "AllowlistCacheIndex":
+        """Reads an index from a JSON snapshot."""
+        with open(snapshot_path) as f:
+            snapshot = json.load(f)
+        return cls(snapshot["claimIds"], [tuple(row) for row in snapshot["rows"]])
+
+
+def fetch_allowlist_cache(supabase, claim_ids: list, chunk_size: int = CLAIM_CHUNK_SIZE,
+                          page_size: int = PAGE_SIZE) -> AllowlistCacheIndex:
+    """
+    Fetches the allowlist cache rows of many claims.
+
+    Claims are queried `chunk_size` at a time with an `in_()` filter, and each
+    chunk is paged until all of its rows have been read.
+
+    Args:
+        supabase: Supabase client.
+        claim_ids: IDs of the claims to fetch.
+        chunk_size: Number of claimIds per query.
+        page_size: Number of rows per page.
+
+    Returns:
+        The rows, indexed by claimId and address.
+    """
+    claim_ids = list(dict.fromkeys(claim_ids))
+    rows = []
+    for i in range(0, len(claim_ids), chunk_size):
+        chunk = claim_ids[i:i + chunk_size]
+        build_query = lambda: (supabase
+                               .table(ALLOWLIST_CACHE_TABLE)
+                               .select("claimId, address", count="exact")
+                               .in_("claimId", chunk)
+                               .order("claimId")
+                               .order("address"))
+        rows.extend((row["claimId"], row["address"]) for row in fetch_all_rows(build_query, page_size))
+    print(f"Prefetched {len(rows)} allowlist cache rows for {len(claim_ids)} claims.")
+    return AllowlistCacheIndex(claim_ids, rows)
+
+
+def load_allowlist_cache(supabase, claim_ids: list, snapshot_path: str = SNAPSHOT_PATH,
+                         ttl: int = None) -> AllowlistCacheIndex:
+    """
+    Returns the allowlist cache for the given claims, reusing a recent snapshot if possible.
+
+    A snapshot is reused when it is younger than `ttl` seconds and covers all
+    of `claim_ids`; otherwise the rows are fetched and a new snapshot written.
+
+    Args:
+        supabase: Supabase client.
+        claim_ids: IDs of the claims to look up.
+        snapshot_path: Path of the on-disk snapshot, or None to disable it.
+        ttl: Maximum age of a reusable snapshot, in seconds; defaults to
+            `ALLOWLIST_CACHE_SNAPSHOT_TTL` or one hour.
+
+    Returns:
+        The rows, indexed by claimId and address.
+    """
+    if ttl is None:
+        ttl = int(os.environ.get("ALLOWLIST_CACHE_SNAPSHOT_TTL") or DEFAULT_SNAPSHOT_TTL)
+    if snapshot_path and os.path.exists(snapshot_path):
+        if time.time() - os.path.getmtime(snapshot_path) < ttl:
+            index = AllowlistCacheIndex.load(snapshot_path)
+            if index.claim_ids.issuperset(claim_ids):
+                print(f"Using allowlist cache snapshot at {snapshot_path}.")
+                return index
+
+    index = fetch_allowlist_cache(supabase, claim_ids)
+    if snapshot_path:
+        index.save(snapshot_path)
+    return index
+
+
+def fetch_hidden_claim_ids(supabase) -> set:
+    """
+    Fetches the IDs of hypercerts that are supposed to be hidden from users.
+
+    Args:
+        supabase: Supabase client.
+
+    Returns:
+        Set of claimIds.
+    """
+    build_query = lambda: (supabase
+                           .table(CLAIMS_TABLE)
+                           .select("claimId", count="exact")
+                           .eq("hidden", True)
+                           .order("claimId"))
+    return {row["claimId"] for row in fetch_all_rows(build_query)}
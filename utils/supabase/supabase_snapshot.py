@@ -0,0 +1,170 @@
+"""
+Streaming snapshots of Supabase tables to CSV.
+
+A single `select("*")` is silently truncated at PostgREST's max-rows setting
+and holds the whole table in memory. Here the table is paged with `range()`,
+ordered by its key, and each page is written straight to the CSV and to its
+typed Parquet copy (see `claims_table`), converted from the values as fetched
+so the analysis scripts never parse the CSV text. A full snapshot is written
+to temporary files and swapped in when complete, so readers never see a
+partial file.
+
+In incremental mode only rows whose change column (e.g. an `updated_at`
+column maintained by the database) is at or after the newest value of the
+previous snapshot are fetched, and they replace their previous versions in the
+CSV. Deleted rows are only dropped by a full snapshot.
+"""
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import claims_table
+import supabase_prefetch
+from append_writer import AppendWriter
+
+PAGE_SIZE = supabase_prefetch.PAGE_SIZE
+
+
+def state_path(csv_filepath: str) -> str:
+    """Returns the path of the file recording a snapshot's change column watermark."""
+    return os.path.splitext(csv_filepath)[0] + ".snapshot.json"
+
+
+def _frame(rows: list, key: str, columns: list = None) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=columns)
+    return df.set_index(key)
+
+
+def _newest(rows: list, change_column: str, newest):
+    values = [row.get(change_column) for row in rows if row.get(change_column) is not None]
+    return max([newest] + values) if newest is not None else max(values, default=None)
+
+
+def export_table(supabase, table: str, csv_filepath: str, key: str = "claimId", change_column: str = None,
+                 page_size: int = PAGE_SIZE) -> int:
+    """
+    Writes a full snapshot of a table to a CSV file and its typed copy, page by page.
+
+    Args:
+        supabase: Supabase client.
+        table: Name of the table.
+        csv_filepath: Path to the CSV file.
+        key: Column the table is ordered and indexed by.
+        change_column: Optional column whose newest value is recorded for incremental updates.
+        page_size: Number of rows to request per page.
+
+    Returns:
+        Number of rows written.
+    """
+    directory = os.path.dirname(csv_filepath) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=directory, prefix=".snapshot-")
+    tmp_csv = os.path.join(tmp_dir, os.path.basename(csv_filepath))
+    tmp_table = claims_table.table_path(tmp_csv)
+    build_query = lambda: supabase.table(table).select("*", count="exact").order(key)
+
+    count = 0
+    columns = None
+    newest = None
+    writer = None
+    try:
+        with open(tmp_csv, "w", newline="") as f:
+            for rows in supabase_prefetch.iter_pages(build_query, page_size):
+                df = _frame(rows, key, columns)
+                if columns is None:
+                    columns = [key] + list(df.columns)
+                df.to_csv(f, header=count == 0)
+                typed = claims_table.typed_rows(rows, columns)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_table, typed.schema)
+                writer.write_table(typed)
+                if change_column:
+                    newest = _newest(rows, change_column, newest)
+                count += len(rows)
+            if count == 0:
+                csv.writer(f, lineterminator="\n").writerow([key])
+        # Closed after the CSV, so the typed copy is never older than it
+        if writer is None:
+            writer = pq.ParquetWriter(tmp_table, claims_table.typed_rows([], columns or [key]).schema)
+        writer.close()
+        writer = None
+
+        os.replace(tmp_csv, csv_filepath)
+        os.replace(tmp_table, claims_table.table_path(csv_filepath))
+    finally:
+        if writer is not None:
+            writer.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _save_state(csv_filepath, table, change_column, newest)
+    print(f"Saved a snapshot of {count} rows from {table} to {csv_filepath}.")
+    return count
+
+
+def update_table(supabase, table: str, csv_filepath: str, key: str = "claimId", change_column: str = None,
+                 page_size: int = PAGE_SIZE) -> int:
+    """
+    Brings a snapshot up to date, fetching only rows changed since it was taken.
+
+    Falls back to a full snapshot if there is no previous snapshot of the same
+    table and change column, or no change column is given.
+
+    Args:
+        supabase: Supabase client.
+        table: Name of the table.
+        csv_filepath: Path to the CSV file.
+        key: Column the table is ordered and indexed by.
+        change_column: Column that changes whenever a row is written.
+        page_size: Number of rows to request per page.
+
+    Returns:
+        Number of rows fetched.
+    """
+    state = _load_state(csv_filepath)
+    if (not change_column or not os.path.exists(csv_filepath) or state is None
+            or state.get("table") != table or state.get("changeColumn") != change_column
+            or state.get("newest") is None):
+        return export_table(supabase, table, csv_filepath, key, change_column, page_size)
+
+    build_query = lambda: (supabase.table(table)
+                           .select("*", count="exact")
+                           .gte(change_column, state["newest"])
+                           .order(key))
+    changed = supabase_prefetch.fetch_all_rows(build_query, page_size)
+    if not changed:
+        print(f"No rows of {table} changed since {state['newest']}.")
+        return 0
+
+    current = claims_table.is_current(csv_filepath)
+    AppendWriter(csv_filepath, key=key, mirror=False).replace(changed)
+    if current:
+        claims_table.add_rows(changed, csv_filepath, key=key, replace=True)
+
+    _save_state(csv_filepath, table, change_column, _newest(changed, change_column, state["newest"]))
+    print(f"Updated {len(changed)} changed rows of {table} in {csv_filepath}.")
+    return len(changed)
+
+
+def _load_state(csv_filepath: str) -> dict:
+    path = state_path(csv_filepath)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(csv_filepath: str, table: str, change_column: str, newest) -> None:
+    path = state_path(csv_filepath)
+    if not change_column:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"table": table, "changeColumn": change_column, "newest": newest}, f)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from accounting_store import AccountingStore
+from merkle_allowlist import MerkleAllowlist, _from_pairs
+
+OWNER = "0x" + "11" * 20
+HOLDER = "0x" + "22" * 20
+BUYER = "0x" + "33" * 20
+
+
+def token(claim_id: str, n: int, owner: str = OWNER, units: int = 100) -> dict:
+    return {"id": f"{claim_id}-{n:04d}", "owner": owner, "units": str(units)}
+
+
+def claim_record(k: int, tokens: list = None, allowlist=None) -> dict:
+    claim_id = f"claim-{k}"
+    pairs = [(HOLDER, 100), (OWNER, 50)]
+    return {
+        "claimId": claim_id,
+        "createdAt": 1680000000 + k,
+        "createdDate": "2023-03-28 10:40:00",
+        "creatorAddress": OWNER,
+        "ownerAddress": OWNER,
+        "totalUnits": 10000,
+        "metadataUri": f"ipfs://meta{k}",
+        "allowlistUri": f"ipfs://allowlist{k}",
+        "metadata": {"name": f"Claim {k}"},
+        "allowlist": _from_pairs(pairs).to_json() if allowlist is None else allowlist,
+        "userClaims": [token(claim_id, 0), token(claim_id, 1, HOLDER)] if tokens is None else tokens,
+        "supabaseList": [HOLDER],
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AccountingStore(str(tmp_path / "accounting.db"))
+    yield store
+    store.close()
+
+
+def stored_tokens(store: AccountingStore) -> dict:
+    return {
+        token_id: (owner, units, block)
+        for token_id, owner, units, block in store.conn.execute(
+            "SELECT tokenId, owner, units, updatedBlock FROM claim_tokens"
+        )
+    }
+
+
+def test_indexed_and_synced_blocks(store):
+    store.upsert_claim(claim_record(0), block=100)
+    store.upsert_claim(claim_record(1), block=200)
+    store.upsert_claim(claim_record(2))
+
+    assert store.unindexed_claims() == ["claim-2"]
+    assert store.oldest_indexed_block() == 100
+    assert store.claims_indexed_before(150) == ["claim-0", "claim-2"]
+    assert store.claims_synced_before(150) == ["claim-0", "claim-2"]
+
+    # A merge of changes advances the indexed block only
+    store.merge_tokens({}, ["claim-0", "claim-2"], 300)
+    assert store.unindexed_claims() == []
+    assert store.claims_indexed_before(250) == ["claim-1"]
+    assert store.claims_synced_before(250) == ["claim-0", "claim-1", "claim-2"]
+
+    # A full sync advances both
+    store.sync_tokens("claim-1", claim_record(1)["userClaims"], 400)
+    assert store.claims_indexed_before(350) == ["claim-0", "claim-2"]
+    assert store.claims_synced_before(350) == ["claim-0", "claim-2"]
+    assert store.oldest_indexed_block() == 300
+
+
+def test_merge_writes_only_changed_tokens(store):
+    store.upsert_claim(claim_record(0, [token("claim-0", n) for n in range(4)]), block=100)
+    store.upsert_claim(claim_record(1, [token("claim-1", 0)]), block=100)
+
+    changes = {
+        # One transfer, one unchanged token re-reported, one new token from a split
+        "claim-0": [token("claim-0", 1, BUYER), token("claim-0", 2), token("claim-0", 9, BUYER, 30)],
+    }
+    assert store.merge_tokens(changes, ["claim-0", "claim-1"], 200) == 2
+
+    tokens = stored_tokens(store)
+    assert tokens["claim-0-0001"] == (BUYER, "100", 200)
+    assert tokens["claim-0-0009"] == (BUYER, "30", 200)
+    # Tokens missing from the changes are kept as they were
+    assert tokens["claim-0-0002"] == (OWNER, "100", 100)
+    assert tokens["claim-0-0003"] == (OWNER, "100", 100)
+    assert tokens["claim-1-0000"] == (OWNER, "100", 100)
+
+
+def test_full_sync_removes_burned_tokens(store):
+    store.upsert_claim(claim_record(0, [token("claim-0", n) for n in range(3)]), block=100)
+
+    tokens = [token("claim-0", 0), token("claim-0", 2, BUYER, 60)]
+    assert store.sync_tokens("claim-0", tokens, 200) == 2
+    assert stored_tokens(store) == {
+        "claim-0-0000": (OWNER, "100", 100),
+        "claim-0-0002": (BUYER, "60", 200),
+    }
+    assert store.sync_tokens("claim-0", tokens, 300) == 0
+
+
+def test_import_legacy_json(store, tmp_path):
+    # hypercertAccounting.json as written before the store, with allowlists as pairs
+    legacy = [claim_record(0, allowlist=[[HOLDER, 100], [OWNER, 50], [HOLDER, 7]]), claim_record(1)]
+    json_path = tmp_path / "hypercertAccounting.json"
+    json_path.write_text(json.dumps(legacy, indent=4))
+
+    assert store.import_json(str(json_path)) == 2
+    # Imported claims have no known block, so their tokens are fetched in full on the next run
+    assert store.unindexed_claims() == ["claim-0", "claim-1"]
+
+    claims = list(store.iter_claims())
+    assert [claim["claimId"] for claim in claims] == ["claim-0", "claim-1"]
+    allowlist = MerkleAllowlist.from_json(claims[0]["allowlist"])
+    assert list(zip(allowlist.hex_addresses(), allowlist.units.tolist())) == [(HOLDER, 100), (OWNER, 50), (HOLDER, 7)]
+    for claim, record in zip(claims, legacy):
+        assert {k: v for k, v in claim.items() if k != "allowlist"} == {k: v for k, v in record.items() if k != "allowlist"}
+
+    # The export reads back to the same records
+    export_path = tmp_path / "export.json"
+    assert store.export_json(str(export_path)) == 2
+    assert json.loads(export_path.read_text()) == claims
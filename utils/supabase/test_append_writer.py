@@ -0,0 +1,82 @@
+import os
+
+import pandas as pd
+
+from append_writer import AppendWriter, parquet_mirror_path
+
+
+def record(n: int, owner: str = "alice", units=100) -> dict:
+    return {"tokenId": f"token-{n}", "ownerAddress": owner, "units": units}
+
+
+def read_csv(path) -> pd.DataFrame:
+    return pd.read_csv(path, dtype=str)
+
+
+def read_mirror(path) -> pd.DataFrame:
+    mirror = parquet_mirror_path(str(path))
+    parts = sorted(name for name in os.listdir(mirror) if name.endswith(".parquet"))
+    return pd.concat([pd.read_parquet(os.path.join(mirror, name)) for name in parts], ignore_index=True)
+
+
+def rows(df: pd.DataFrame) -> list:
+    return [[None if pd.isna(v) else v for v in row] for row in df.itertuples(index=False)]
+
+
+def assert_mirrored(path):
+    # The mirror holds the CSV's text, with empty cells as nulls
+    mirror, df = read_mirror(path), read_csv(path)
+    assert list(mirror.columns) == list(df.columns)
+    assert rows(mirror) == rows(df)
+
+
+def test_append_skips_known_keys(tmp_path):
+    path = tmp_path / "userTokenData.csv"
+    writer = AppendWriter(str(path), key="tokenId")
+    assert writer.append([record(0), record(1), record(0, "bob")]) == 2
+    assert writer.append([record(1, "bob"), record(2, units=None)], chunk_rows=1) == 1
+    assert_mirrored(path)
+
+    # A new writer reads the keys and header back; fields not in the header are dropped
+    writer = AppendWriter(str(path), key="tokenId", columns=["ignored"])
+    assert writer.append([record(2), {**record(3), "extra": 1}]) == 1
+    df = read_csv(path)
+    assert list(df.columns) == ["tokenId", "ownerAddress", "units"]
+    assert df["tokenId"].tolist() == [f"token-{n}" for n in range(4)]
+    assert pd.isna(df["units"][2])
+    assert_mirrored(path)
+    # One part file per appended batch
+    assert len(os.listdir(parquet_mirror_path(str(path)))) == 3
+
+
+def test_replace_rewrites_changed_rows_and_rebuilds_mirror(tmp_path):
+    path = tmp_path / "userTokenData.csv"
+    writer = AppendWriter(str(path), key="tokenId")
+    writer.append([record(n) for n in range(5)])
+
+    assert writer.replace([record(1, "bob"), record(3, units=7), record(1, "carol"), record(9)]) == 3
+    df = read_csv(path)
+    # Replaced rows move to the end, after the unchanged ones, with the last record of a key winning
+    assert df["tokenId"].tolist() == ["token-0", "token-2", "token-4", "token-1", "token-3", "token-9"]
+    assert df.set_index("tokenId").loc["token-1", "ownerAddress"] == "carol"
+    assert df.set_index("tokenId").loc["token-3", "units"] == "7"
+    assert_mirrored(path)
+    assert len(os.listdir(parquet_mirror_path(str(path)))) == 1
+
+    # Records already in the file are skipped by a later append
+    assert writer.append([record(9), record(10)]) == 1
+
+
+def test_mirror_is_rebuilt_when_it_disagrees_with_the_csv(tmp_path):
+    path = tmp_path / "userTokenData.csv"
+    AppendWriter(str(path), key="tokenId").append([record(n) for n in range(3)], chunk_rows=1)
+    mirror = parquet_mirror_path(str(path))
+    os.remove(os.path.join(mirror, "part-00002.parquet"))
+
+    AppendWriter(str(path), key="tokenId")
+    assert_mirrored(path)
+
+    # Without a mirror, nothing is written next to the CSV
+    other = tmp_path / "claimsData.csv"
+    AppendWriter(str(other), key="tokenId", mirror=False).append([record(0)])
+    assert not os.path.exists(parquet_mirror_path(str(other)))
@@ -0,0 +1,76 @@
+import json
+import random
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from claim_tags import load_tag_rules, tag_claims
+
+
+def tagger(x):
+    # claim_stats.tagger as it was before tag_rules.json
+    search = lambda ss, s: re.search(ss, s, re.IGNORECASE)
+    if isinstance(x['title'], str):
+        if isinstance(x['properties'], str) and search("gitcoin", x['properties']):
+            return "1. Gitcoin"
+        if search("givegratitude", x['title']):
+            return "2. GiveGratitude.io"
+        if search("zuzalu", x['title']) or search("zuzalu", x['hypercert']):
+            return "3. Zuzalu"
+        if x['totalUnits'] != 10000:
+            return "4. Other Community Generated"
+    return "5. Random (No Collection, No Allowlist)"
+
+
+def claims(rng: random.Random, n: int) -> pd.DataFrame:
+    titles = ["Cleanup", "GiveGratitude to Alice", "ZUZALU week", "Gitcoin grant", np.nan]
+    properties = ["[{'trait_type': 'Gitcoin Round'}]", "[{'trait_type': 'Other'}]", "[]", np.nan]
+    hypercerts = ["{'work_scope': {'value': ['Zuzalu']}}", "{'work_scope': {'value': ['Climate']}}"]
+    return pd.DataFrame({
+        'title': [rng.choice(titles) for _ in range(n)],
+        'properties': [rng.choice(properties) for _ in range(n)],
+        'hypercert': [rng.choice(hypercerts) for _ in range(n)],
+        'totalUnits': [rng.choice([10000, 10000, 100]) for _ in range(n)],
+    })
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_row_tagger(seed):
+    df = claims(random.Random(seed), 200)
+    expected = df.apply(tagger, axis=1)
+    # Every rule and the default are exercised
+    assert expected.nunique() == 5
+    assert tag_claims(df).tolist() == expected.tolist()
+
+
+def test_missing_values_do_not_match():
+    df = pd.DataFrame({
+        'title': ["Zuzalu", "Plain", np.nan],
+        'properties': [np.nan, np.nan, "gitcoin"],
+        'hypercert': [np.nan, np.nan, np.nan],
+        'totalUnits': [10000, 10000, 5],
+    })
+    assert tag_claims(df).tolist() == [
+        "3. Zuzalu", "5. Random (No Collection, No Allowlist)", "5. Random (No Collection, No Allowlist)"
+    ]
+
+
+def test_custom_rule_table(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({
+        "default": "other",
+        "rules": [
+            {"tag": "small", "any": [{"column": "totalUnits", "equal": 100}]},
+            {"tag": "climate", "any": [{"column": "hypercert", "contains": "clim[a-z]+"}]},
+        ]
+    }))
+    df = claims(random.Random(0), 50)
+    expected = np.where(df['totalUnits'] == 100, "small",
+                        np.where(df['hypercert'].str.contains("climate", case=False), "climate", "other"))
+    assert tag_claims(df, load_tag_rules(str(path))).tolist() == expected.tolist()
+
+    path.write_text(json.dumps({"default": "other", "rules": [{"tag": "x", "any": [{"column": "title"}]}]}))
+    with pytest.raises(ValueError, match="Unknown condition"):
+        load_tag_rules(str(path))
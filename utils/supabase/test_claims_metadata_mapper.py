@@ -0,0 +1,70 @@
+import pytest
+from postgrest.exceptions import APIError
+from supabase import create_client
+
+import claims_metadata_mapper
+from fake_services import FakeServices, Portfolio
+
+
+@pytest.fixture
+def services(monkeypatch):
+    services = FakeServices(Portfolio(50)).start()
+    for key, value in services.env.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setenv("GRAPH_RATE_LIMIT", "100000")
+    # Claims share creation times in threes, so pages of 4 end in the middle of a tie
+    monkeypatch.setattr(claims_metadata_mapper, "PAGE_SIZE", 4)
+    monkeypatch.setattr(claims_metadata_mapper, "supabase",
+                        create_client(services.env["SUPABASE_URL"], services.env["SUPABASE_KEY"]))
+    yield services
+    services.stop()
+
+
+def test_keyset_paging_reads_every_claim_once(services):
+    claims = claims_metadata_mapper.get_all_claims()
+    expected = sorted(services.portfolio.claims, key=lambda c: (int(c["creation"]), c["id"]))
+    assert [c["id"] for c in claims] == [c["id"] for c in expected]
+
+
+def test_watermark_resumes_after_last_claim(services):
+    portfolio = services.portfolio
+    watermark = claims_metadata_mapper.advance_watermark(None, claims_metadata_mapper.get_all_claims())
+    assert watermark == {"creation": int(portfolio.claims[-1]["creation"]), "id": max(c["id"] for c in portfolio.claims[-2:])}
+
+    portfolio.claims.extend(portfolio._claim(i) for i in range(50, 55))
+    new_ids = sorted(c["id"] for c in portfolio.claims[50:])
+
+    claims = claims_metadata_mapper.get_all_claims(watermark)
+    assert sorted(c["id"] for c in claims) == new_ids
+    assert claims_metadata_mapper.get_all_claims(claims_metadata_mapper.advance_watermark(watermark, claims)) == []
+
+
+def test_upsert_fills_missing_metadata_fields(services):
+    claims = claims_metadata_mapper.get_all_claims()[:5]
+    records = [
+        claims_metadata_mapper.create_claim_record(claim, {"name": f"Claim {i}"} if i % 2 else None)
+        for i, claim in enumerate(claims)
+    ]
+    # PostgREST rejects a bulk payload whose records have different keys
+    with pytest.raises(APIError):
+        claims_metadata_mapper.upsert_claims_chunk(records)
+
+    claims_metadata_mapper.store_claims_in_supabase(records, batch_size=2, max_retries=0)
+    rows = {row["claimId"]: row for row in services.postgrest.tables[claims_metadata_mapper.TABLE_NAME]}
+    for i, claim in enumerate(claims):
+        assert rows[claim["id"]]["title"] == (f"Claim {i}" if i % 2 else None)
+        assert "hypercert" in rows[claim["id"]]
+
+
+def test_upsert_without_unique_constraint_fails_at_once(monkeypatch):
+    calls = []
+
+    def upsert(claims):
+        calls.append(claims)
+        raise APIError({"code": "42P10", "message": "there is no unique or exclusion constraint "
+                                                    "matching the ON CONFLICT specification"})
+
+    monkeypatch.setattr(claims_metadata_mapper, "upsert_claims_chunk", upsert)
+    with pytest.raises(RuntimeError, match="unique constraint"):
+        claims_metadata_mapper.store_claims_in_supabase([{"claimId": "claim-1"}], max_workers=1)
+    assert len(calls) == 1
@@ -0,0 +1,131 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from supabase import create_client
+
+import claims_metadata_mapper
+import claims_table
+import supabase_snapshot
+from fake_services import FakeServices, Portfolio
+
+TABLE = "claims-metadata-mapping"
+
+
+def hypercert(k: int) -> dict:
+    return {
+        "work_scope": {"name": "Work Scope", "value": ["Public goods", f"scope-{k}"] if k % 2 else [f"scope-{k}"]},
+        "impact_scope": {"name": "Impact Scope", "value": ["all"]},
+        "work_timeframe": {"name": "Work Timeframe", "value": [1680000000 + k, 1690000000 if k % 3 else 0]},
+        "contributors": {"name": "Contributors", "value": [f"0x{k:040x}"]},
+    }
+
+
+def claim_row(k: int) -> dict:
+    # As the Supabase table returns it, with the hypercert dimensions as a JSON object
+    return {
+        "claimId": f"0x822f17a9a5eecfd66dbaff7946a8071c265d1d07-{k}",
+        "title": f"Hypercert {k}",
+        "creatorAddress": f"0x{k % 3:040x}",
+        "createdAt": 1680000000 + k,
+        "date": pd.Timestamp(1680000000 + k, unit="s").strftime(claims_table.DATE_FORMAT),
+        "totalUnits": 10000,
+        "hypercert": hypercert(k) if k % 5 else None,
+        "updatedAt": k,
+    }
+
+
+def write_csv(path, rows: list) -> str:
+    # As the snapshot and the mapper write it: dictionaries as their Python text
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return str(path)
+
+
+def typed(path: str) -> list:
+    return pq.read_table(path).to_pylist()
+
+
+def test_load_types_columns_and_filters_on_work_scope(tmp_path):
+    csv_file = write_csv(tmp_path / "claimsData.csv", [claim_row(k) for k in range(12)])
+    df = claims_table.load_claims(csv_file)
+
+    assert isinstance(df["creatorAddress"].dtype, pd.CategoricalDtype)
+    assert df["createdAt"].dtype == "int64" and df["totalUnits"].dtype == "int64"
+    assert df["date"].iloc[1] == pd.Timestamp(1680000001, unit="s")
+    assert list(df["work_scope"].iloc[1]) == ["Public goods", "scope-1"]
+    assert list(df["contributors"].iloc[2]) == [f"0x{2:040x}"]
+    # Claims without a hypercert field have no dimensions
+    assert df["work_scope"].iloc[0] is None and pd.isna(df["work_timeframe_start"].iloc[0])
+    # An end of 0 is an open-ended timeframe
+    assert df["work_timeframe_start"].iloc[3] == pd.Timestamp(1680000003, unit="s")
+    assert pd.isna(df["work_timeframe_end"].iloc[3])
+    assert df["work_timeframe_end"].iloc[2] == pd.Timestamp(1690000000, unit="s")
+
+    public = claims_table.load_claims(csv_file, columns=["claimId", "title"], work_scope="Public goods")
+    assert list(public.columns) == ["claimId", "title"]
+    assert list(public["title"]) == [f"Hypercert {k}" for k in (1, 3, 7, 9, 11)]
+    assert claims_table.load_claims(csv_file, columns=["title", "missing"], work_scope="scope-4")["title"].tolist() == [
+        "Hypercert 4"
+    ]
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    services = FakeServices(Portfolio(0)).start()
+    services.postgrest.max_rows = 5
+    services.postgrest.tables[TABLE] = [claim_row(k) for k in range(12)]
+    yield services, create_client(services.env["SUPABASE_URL"], services.env["SUPABASE_KEY"])
+    services.stop()
+
+
+def rebuilt(csv_file: str, tmp_path) -> list:
+    path = str(tmp_path / "rebuilt.parquet")
+    claims_table.write_claims_table(csv_file, path)
+    return typed(path)
+
+
+def test_snapshot_writes_typed_table_without_parsing_text(supabase, tmp_path, monkeypatch):
+    services, client = supabase
+    csv_file = str(tmp_path / "claimsData.csv")
+    assert supabase_snapshot.export_table(client, TABLE, csv_file, change_column="updatedAt", page_size=5) == 12
+    assert claims_table.is_current(csv_file)
+    assert typed(claims_table.table_path(csv_file)) == rebuilt(csv_file, tmp_path)
+
+    # Loads read the snapshot's table as is
+    def fail(value):
+        raise AssertionError("hypercert text parsed")
+
+    monkeypatch.setattr(claims_table.ast, "literal_eval", fail)
+    assert len(claims_table.load_claims(csv_file, work_scope="Public goods")) == 5
+
+    # An incremental update replaces the changed rows in both files
+    rows = services.postgrest.tables[TABLE]
+    rows[4].update(title="Renamed", hypercert=hypercert(5), updatedAt=20)
+    rows.append(claim_row(12) | {"updatedAt": 21})
+    assert supabase_snapshot.update_table(client, TABLE, csv_file, change_column="updatedAt", page_size=5) == 3
+    assert claims_table.is_current(csv_file)
+    df = claims_table.load_claims(csv_file, columns=["claimId", "title"], work_scope="Public goods")
+    assert df["title"].tolist() == [f"Hypercert {k}" for k in (1, 3, 7, 9, 11)] + ["Renamed"]
+    monkeypatch.undo()
+    assert typed(claims_table.table_path(csv_file)) == rebuilt(csv_file, tmp_path)
+
+
+def test_mapper_appends_new_claims_to_typed_table(tmp_path):
+    csv_file = write_csv(tmp_path / "claimsData.csv", [claim_row(k) for k in range(4)])
+    claims_table.ensure_claims_table(csv_file)
+
+    claims_metadata_mapper.append_to_csv_file([claim_row(k) for k in range(2, 7)], csv_file)
+    assert claims_table.is_current(csv_file)
+    assert typed(claims_table.table_path(csv_file)) == rebuilt(csv_file, tmp_path)
+    assert claims_table.load_claims(csv_file)["claimId"].str.rsplit("-", n=1).str[1].tolist() == [
+        str(k) for k in range(7)
+    ]
+
+
+def test_empty_snapshot_has_a_typed_table(supabase, tmp_path):
+    services, client = supabase
+    services.postgrest.tables[TABLE] = []
+    csv_file = str(tmp_path / "claimsData.csv")
+    assert supabase_snapshot.export_table(client, TABLE, csv_file) == 0
+    assert pq.read_schema(claims_table.table_path(csv_file)).names == ["claimId"]
+    assert claims_table.load_claims(csv_file).empty
@@ -0,0 +1,132 @@
+import json
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import claim_stats
+import collisions
+import gtc_collisions
+from claims_table import DATE_FORMAT
+from collisions import IGNORED_TITLES
+
+
+def check_collisions_loop(df):
+    # gtc_collisions.check_collisions as it was before find_collisions, comparing every pair
+    collisions = []
+    for i, (id1, row1) in enumerate(df.iterrows()):
+        for (id2, row2) in df.head(i).iterrows():
+            if row1['creatorAddress'] == row2['creatorAddress']:
+                creator = "same creator"
+            else:
+                creator = f"by {row1['creatorAddress']} & {row2['creatorAddress']}"
+            if row1['hypercert'] == row2['hypercert']:
+                case = f'duplicate claim in hyperspace ({creator} creator)'
+            elif row1['title'] == row2['title'] and row1['title'] != 'The name of your hypercert':
+                case = f'duplicate title in hypercerts ({creator})'
+            else:
+                continue
+            collisions.append({
+                'id': id1,
+                'collision': id2,
+                'creator': row1['creatorAddress'],
+                'date': row1['date'],
+                'title': row1['title'],
+                'case': case
+            })
+    return collisions
+
+
+def claim_stats_loop(df):
+    # claim_stats.check_collisions as it was before find_collisions
+    collision_list = []
+    collisions = []
+    for i, (id1, row1) in enumerate(df.iterrows()):
+        collision = False
+        tag = row1['tag']
+        for (id2, row2) in df.head(i).iterrows():
+            creator = "same" if row1['creatorAddress'] == row2['creatorAddress'] else "diff"
+            if row1['hypercert'] == row2['hypercert']:
+                collisions.append({
+                    'id': id1,
+                    'creator': row1['creatorAddress'],
+                    'collision': id2,
+                    'case': f'duplicate claim in hyperspace ({creator} creator)',
+                    'details': row1['hypercert'],
+                    'tag': tag
+                })
+                collision = True
+            elif row1['title'] == row2['title'] and row1['title'] != 'The name of your hypercert':
+                collisions.append({
+                    'id': id1,
+                    'creator': row1['creatorAddress'],
+                    'collision': id2,
+                    'case': f'duplicate title in hypercerts ({creator} creator)',
+                    'details': f"Title is {row1['title']}",
+                    'tag': tag
+                })
+                collision = True
+        collision_list.append(collision)
+    return collision_list, collisions
+
+
+def claims(rng: random.Random, n: int) -> pd.DataFrame:
+    hypercerts = [f"{{'work_scope': ['scope-{k}']}}" for k in range(max(2, n // 4))] + [np.nan]
+    titles = [f"Title {k}" for k in range(max(2, n // 3))] + IGNORED_TITLES + [np.nan]
+    creators = [f"0x{k:040x}" for k in range(4)]
+    # Unique timestamps, so that sorting by date gives one order for both implementations
+    seconds = rng.sample(range(10 ** 6), n)
+    df = pd.DataFrame({
+        'claimId': [f"0x822f17a9a5eecfd66dbaff7946a8071c265d1d07-{k}" for k in range(n)],
+        'title': [rng.choice(titles) for _ in range(n)],
+        'creatorAddress': [rng.choice(creators) for _ in range(n)],
+        'date': pd.to_datetime(1680000000 + np.array(seconds), unit="s"),
+        'hypercert': [rng.choice(hypercerts) for _ in range(n)],
+        'tag': True,
+    }).set_index('claimId')
+    return df.sort_values(by='date')
+
+
+def formatted(df: pd.DataFrame) -> pd.DataFrame:
+    # The old scripts read dates as text in the snapshot's format
+    df = df.copy()
+    df['date'] = df['date'].dt.strftime(DATE_FORMAT)
+    return df
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_pairwise_loop(seed):
+    df = claims(random.Random(seed), 60)
+    expected = check_collisions_loop(formatted(df))
+    assert expected
+    assert gtc_collisions.check_collisions(df) == expected
+    assert claim_stats.check_collisions(formatted(df)) == claim_stats_loop(formatted(df))
+
+
+def run_incrementally(df, tmp_path, batches: int) -> str:
+    index_path, outpath = str(tmp_path / "index.db"), str(tmp_path / "collisions.json")
+    bounds = np.linspace(0, len(df), batches + 1).astype(int)
+    for end in bounds[1:]:
+        gtc_collisions.update_collisions(df.iloc[:end], index_path, outpath)
+    with open(outpath) as f:
+        return f.read()
+
+
+def dumped(collisions: list) -> str:
+    # As written by update_collisions; NaN titles only compare equal as text
+    return json.dumps(collisions, indent=4)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_runs_match_pairwise_loop(seed, tmp_path):
+    df = claims(random.Random(seed), 60)
+    assert run_incrementally(df, tmp_path, batches=4) == dumped(check_collisions_loop(formatted(df)))
+
+
+def test_hash_collisions_are_not_reported(tmp_path, monkeypatch):
+    # With every value hashing alike, only the stored values tell claims apart
+    monkeypatch.setattr(collisions, "fingerprint", lambda value: 0)
+    df = claims(random.Random(11), 60)
+    assert run_incrementally(df, tmp_path, batches=3) == dumped(check_collisions_loop(formatted(df)))
+
@@ -0,0 +1,104 @@
+import os
+import uuid
+
+import pytest
+from supabase import create_client
+
+import insert_allowlist
+from fake_services import FakeServices, Portfolio
+
+TABLE = "optimism-allowlistCache"
+CLAIM_ID = "0x822f17a9a5eecfd66dbaff7946a8071c265d1d07-42"
+
+
+def address(n: int) -> str:
+    return "0x" + format(n * 2654435761 % (1 << 160), "040x")
+
+
+def mixed_case(address: str) -> str:
+    return "0x" + address[2:].upper()
+
+
+def write_csv(path, addresses: list) -> str:
+    path.write_text("index,address,units\n" + "".join(f"{k},{a},1\n" for k, a in enumerate(addresses)))
+    return str(path)
+
+
+def test_addresses_are_lowercased_and_deduplicated(tmp_path):
+    csv_file = write_csv(tmp_path / "allowlist.csv", [mixed_case(address(1)), address(2), address(1)])
+    assert list(insert_allowlist.read_addresses(csv_file)) == [address(1), address(2)]
+
+
+def test_byte_order_mark_is_ignored(tmp_path):
+    csv_file = tmp_path / "allowlist.csv"
+    csv_file.write_bytes(b"\xef\xbb\xbfaddress,units\n" + f"{mixed_case(address(1))},1\n".encode())
+    assert list(insert_allowlist.read_addresses(str(csv_file))) == [address(1)]
+
+
+def test_missing_address_column_raises(tmp_path):
+    csv_file = tmp_path / "allowlist.csv"
+    csv_file.write_text("wallet,units\n" + f"{address(1)},1\n")
+    with pytest.raises(ValueError, match="no address column"):
+        list(insert_allowlist.read_addresses(str(csv_file)))
+
+
+@pytest.fixture
+def services():
+    services = FakeServices(Portfolio(0)).start()
+    services.postgrest.max_rows = 4
+    yield services
+    services.stop()
+
+
+def test_postgrest_inserts_new_addresses_in_chunks(services, monkeypatch, tmp_path):
+    monkeypatch.setattr(insert_allowlist, "supabase",
+                        create_client(services.env["SUPABASE_URL"], services.env["SUPABASE_KEY"]))
+    insert = services.postgrest.insert
+    payloads = []
+
+    def record_insert(table, params, payload, prefer):
+        payloads.append(len(payload))
+        return insert(table, params, payload, prefer)
+
+    monkeypatch.setattr(services.postgrest, "insert", record_insert)
+    # Rows already loaded for this claim, more than one page of them, and one for another claim
+    services.postgrest.tables[TABLE] = (
+        [{"address": address(n), "claimId": CLAIM_ID} for n in range(6)]
+        + [{"address": address(20), "claimId": "other"}]
+    )
+    csv_file = write_csv(tmp_path / "allowlist.csv", [address(n) for n in range(25)] + [mixed_case(address(3))])
+
+    assert insert_allowlist.upsert_allowlist(csv_file, TABLE, CLAIM_ID, chunk_size=8) == (25, 19)
+    assert payloads == [8, 8, 3]
+    rows = [row for row in services.postgrest.tables[TABLE] if row["claimId"] == CLAIM_ID]
+    assert sorted(row["address"] for row in rows) == sorted(address(n) for n in range(25))
+
+    # A rerun finds every address in the table and sends no inserts
+    assert insert_allowlist.upsert_allowlist(csv_file, TABLE, CLAIM_ID, chunk_size=8) == (25, 0)
+    assert payloads == [8, 8, 3]
+
+
+@pytest.mark.skipif(not os.environ.get("DATABASE_URL"), reason="needs DATABASE_URL for a local Postgres")
+def test_copy_load_is_idempotent(tmp_path):
+    psycopg2 = pytest.importorskip("psycopg2")
+    database_url = os.environ["DATABASE_URL"]
+    table = f"allowlist_test_{uuid.uuid4().hex[:8]}"
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE TABLE "{table}" (id serial PRIMARY KEY, address text, "claimId" text, '
+                        f'UNIQUE (address, "claimId"))')
+            cur.execute(f'INSERT INTO "{table}" (address, "claimId") VALUES (%s, %s)', (address(0), CLAIM_ID))
+        csv_file = write_csv(tmp_path / "allowlist.csv", [mixed_case(address(n)) for n in range(5000)])
+
+        # insert_allowlist loads through COPY when DATABASE_URL is set
+        assert insert_allowlist.insert_allowlist(csv_file, table, CLAIM_ID) == 4999
+        assert insert_allowlist.insert_allowlist(csv_file, table, CLAIM_ID) == 0
+        with conn.cursor() as cur:
+            cur.execute(f'SELECT COUNT(*), COUNT(*) FILTER (WHERE address = lower(address)) FROM "{table}"')
+            assert cur.fetchone() == (5000, 5000)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.close()
@@ -0,0 +1,202 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ipfs_gateways
+from ipfs_gateways import GatewayFetcher
+
+
+class Server:
+    """A local gateway whose responses are produced by `respond(handler)`."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    server.respond(self)
+                except ConnectionError:
+                    pass
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/ipfs/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def send(handler, status=200, body=b'{"name": "ok"}', delay=0.0):
+    time.sleep(delay)
+    handler.send_response(status)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(respond):
+        servers.append(Server(respond))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_requests_per_host_are_capped(serve, monkeypatch):
+    monkeypatch.setenv("IPFS_MAX_REQUESTS_PER_HOST", "2")
+    server = serve(lambda handler: send(handler, delay=0.05))
+    fetcher = GatewayFetcher([server.url])
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(fetcher.fetch, [f"bafy{i}" for i in range(10)]))
+
+    assert results == [b'{"name": "ok"}'] * 10
+    assert server.requests == 10
+    assert server.max_in_flight == 2
+
+
+def fail(handler):
+    send(handler, status=500, body=b"unavailable")
+
+
+def test_circuit_opens_after_consecutive_failures(serve):
+    failing, healthy = serve(fail), serve(send)
+    fetcher = GatewayFetcher([failing.url, healthy.url])
+
+    for i in range(6):
+        assert fetcher.fetch(f"bafy{i}") == b'{"name": "ok"}'
+
+    # Each failure was followed by the next gateway at once; after three the first was skipped
+    assert failing.requests == ipfs_gateways.FAILURE_THRESHOLD
+    assert healthy.requests == 6
+    assert fetcher.stats()[failing.url]["circuit"] == "open"
+
+
+def test_half_open_circuit_lets_one_trial_through(serve):
+    responses = {"failing": True}
+    flaky = serve(lambda handler: fail(handler) if responses["failing"] else send(handler))
+    healthy = serve(send)
+    fetcher = GatewayFetcher([flaky.url, healthy.url])
+    fetcher.gateways[0].cooldown = 0.2
+
+    for i in range(3):
+        fetcher.fetch(f"bafy{i}")
+    assert flaky.requests == 3
+
+    # Still open: skipped
+    fetcher.fetch("bafy3")
+    assert flaky.requests == 3
+
+    # After the cooldown a single trial is let through; it fails and the circuit re-opens
+    time.sleep(0.25)
+    fetcher.fetch("bafy4")
+    fetcher.fetch("bafy5")
+    assert flaky.requests == 4
+
+    # A successful trial closes the circuit, and the gateway is used first again
+    responses["failing"] = False
+    time.sleep(0.25)
+    healthy_before = healthy.requests
+    for i in range(6, 9):
+        assert fetcher.fetch(f"bafy{i}") == b'{"name": "ok"}'
+    assert flaky.requests == 7
+    assert healthy.requests == healthy_before
+    assert fetcher.stats()[flaky.url]["circuit"] == "closed"
+
+
+def test_hedges_after_p90_latency(serve, monkeypatch):
+    # A floor well above the primary's latency, so a slow response on a busy machine is not hedged
+    monkeypatch.setattr(ipfs_gateways, "MIN_HEDGE_DELAY", 0.3)
+    delays = {"primary": 0.05}
+    arrivals = {"primary": [], "backup": []}
+
+    def respond(name):
+        def handler(request):
+            arrivals[name].append(time.monotonic())
+            send(request, delay=delays[name] if name == "primary" else 0.0)
+        return handler
+
+    primary, backup = serve(respond("primary")), serve(respond("backup"))
+    fetcher = GatewayFetcher([primary.url, backup.url])
+
+    # Below the minimum number of samples the default delay applies
+    assert fetcher.gateways[0].hedge_delay() == ipfs_gateways.DEFAULT_HEDGE_DELAY
+    for i in range(10):
+        fetcher.fetch(f"bafy{i}")
+    assert backup.requests == 0
+
+    gateway = fetcher.gateways[0]
+    latencies = sorted(gateway.latencies)
+    hedge_delay = gateway.hedge_delay()
+    assert hedge_delay == max(ipfs_gateways.MIN_HEDGE_DELAY, latencies[int(len(latencies) * 0.9)])
+
+    # The primary slows down: the backup is asked once the p90 latency has passed, and wins
+    delays["primary"] = 1.0
+    start = time.monotonic()
+    assert fetcher.fetch("bafyslow") == b'{"name": "ok"}'
+    elapsed = time.monotonic() - start
+    waited = arrivals["backup"][-1] - arrivals["primary"][-1]
+    assert hedge_delay - 0.02 <= waited <= hedge_delay + 0.3
+    assert elapsed < 0.8
+    assert fetcher.stats()[backup.url]["wins"] == 1
+
+
+def test_losing_request_stops_reading(serve):
+    pieces = 40
+    written = {"pieces": 0, "aborted": False}
+    piece = b"x" * ipfs_gateways.CHUNK_SIZE
+
+    def trickle(handler):
+        handler.send_response(200)
+        handler.send_header("Content-Length", str(len(piece) * pieces))
+        handler.end_headers()
+        try:
+            for _ in range(pieces):
+                handler.wfile.write(piece)
+                handler.wfile.flush()
+                written["pieces"] += 1
+                time.sleep(0.05)
+        except ConnectionError:
+            written["aborted"] = True
+
+    slow, fast = serve(trickle), serve(send)
+    fetcher = GatewayFetcher([slow.url, fast.url])
+    fetcher.gateways[0].latencies.extend([0.1] * ipfs_gateways.MIN_LATENCY_SAMPLES)
+
+    assert fetcher.fetch("bafy") == b'{"name": "ok"}'
+    deadline = time.monotonic() + 2
+    while fetcher.stats()[slow.url]["cancelled"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fetcher.stats()[slow.url]["cancelled"] == 1
+
+    time.sleep(0.3)
+    assert written["aborted"]
+    assert written["pieces"] < pieces / 2
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from supabase import create_client
+
+import lookup_gtc_user
+from fake_services import FakeServices, Portfolio
+
+
+def address(n: int) -> str:
+    return "0x" + format(n * 2654435761 % (1 << 160), "040x")
+
+
+@pytest.mark.parametrize("text", [
+    "0xAB\n\n0xcd\n",
+    "address\n0xab\n0xCD\n",
+    '"Address"\n"0xab"\n"0xcd"\n',
+    "0xab,10\n0xcd,20\n",
+    "index,units,address\n1,10,0xAB\n2,20, 0xcd \n3,30,\n",
+])
+def test_reads_addresses(text):
+    assert list(lookup_gtc_user.read_addresses(io.StringIO(text))) == ["0xab", "0xcd"]
+
+
+@pytest.fixture
+def services():
+    services = FakeServices(Portfolio(0)).start()
+    services.postgrest.max_rows = 5
+    yield services
+    services.stop()
+
+
+def test_lookup_users_in_chunks(services, monkeypatch):
+    monkeypatch.setattr(lookup_gtc_user, "supabase",
+                        create_client(services.env["SUPABASE_URL"], services.env["SUPABASE_KEY"]))
+    tables = services.postgrest.tables
+    # More rows per chunk than fit in one response, so every chunk is paged
+    tables[lookup_gtc_user.allowlist_source] = [
+        {"project": f"project-{(n * 7) % 5}", "address": address(n % 9)} for n in range(30)
+    ]
+    tables[lookup_gtc_user.allowlist_cache] = [
+        {"claimId": f"claim-{(n * 3) % 11}", "address": address(n % 6)} for n in range(25)
+    ]
+    requests = []
+    select = services.postgrest.select
+    monkeypatch.setattr(services.postgrest, "select",
+                        lambda table, params: requests.append(table) or select(table, params))
+
+    addresses = [address(n) for n in (3, 0, 12, 3, 8, 1, 5, 7, 2, 4, 6)]
+    results = list(lookup_gtc_user.lookup_users(addresses, chunk_size=4))
+
+    def expected(table, column, a):
+        return sorted(row[column] for row in tables[table] if row["address"] == a)
+
+    assert results == [
+        {
+            "address": a,
+            "projects": expected(lookup_gtc_user.allowlist_source, "project", a),
+            "claimIds": expected(lookup_gtc_user.allowlist_cache, "claimId", a),
+        }
+        for a in dict.fromkeys(addresses)
+    ]
+    assert any(result["projects"] and result["claimIds"] for result in results)
+    assert results[2] == {"address": address(12), "projects": [], "claimIds": []}
+    # One query per table for each chunk of 4 addresses, paged 5 rows at a time
+    distinct = list(dict.fromkeys(addresses))
+    chunks = [set(distinct[k:k + 4]) for k in range(0, len(distinct), 4)]
+    pages = [
+        max(1, -(-sum(row["address"] in chunk for row in tables[table]) // 5))
+        for chunk in chunks for table in (lookup_gtc_user.allowlist_source, lookup_gtc_user.allowlist_cache)
+    ]
+    assert len(requests) == sum(pages)
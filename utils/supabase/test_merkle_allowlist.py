@@ -0,0 +1,146 @@
+import io
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import hypercert_accounting
+import ipfs_cache
+from fake_services import FakeServices, Portfolio
+from merkle_allowlist import INT64_MAX, MerkleAllowlist, decode_standard_merkle_tree
+
+
+def checksum_case(address: str, rng: random.Random) -> str:
+    # Mixed case like an EIP-55 checksummed address; the decoder must not depend on it
+    return "0x" + "".join(c.upper() if rng.random() < 0.5 else c for c in address[2:])
+
+
+def random_dump(rng: random.Random, n: int) -> tuple:
+    values = []
+    expected = []
+    for k in range(n):
+        address = "0x" + "".join(rng.choice("0123456789abcdef") for _ in range(40))
+        units = rng.choice([rng.randrange(1, 10 ** 6), rng.randrange(INT64_MAX, 2 ** 256)])
+        values.append({"value": [checksum_case(address, rng), str(units)], "treeIndex": n - 1 + k})
+        expected.append((address, units))
+    fields = {
+        "format": "standard-v1",
+        "tree": ["0x" + "".join(rng.choice("0123456789abcdef") for _ in range(64)) for _ in range(2 * n - 1)],
+        "values": values,
+        "leafEncoding": ["address", "uint256"],
+        # Nested values with brackets, quotes and backslashes in strings must be skipped intact
+        "notes": {"text": 'brackets ] } [ { "quoted" \\ and é中', "list": [[], {}, [1, [2]]]},
+    }
+    keys = list(fields)
+    rng.shuffle(keys)
+    text = json.dumps({key: fields[key] for key in keys}, indent=rng.choice([None, 1, 2]),
+                      ensure_ascii=rng.random() < 0.5)
+    if rng.random() < 0.5:
+        # As stored by the SDK: the dump wrapped in a JSON string
+        text = json.dumps(text, ensure_ascii=rng.random() < 0.5)
+    return text, expected
+
+
+def decoded(allowlist: MerkleAllowlist) -> list:
+    return list(zip(allowlist.hex_addresses(), allowlist.units.tolist()))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_dumps_match_json_decoding(seed):
+    rng = random.Random(seed)
+    text, expected = random_dump(rng, rng.randrange(0, 40))
+
+    # Reference: the dump decoded as a whole, as the accounting script used to
+    document = json.loads(text)
+    if isinstance(document, str):
+        document = json.loads(document)
+    reference = [(address.lower(), int(units)) for address, units in (v["value"] for v in document["values"])]
+    assert reference == expected
+
+    content = text.encode()
+    for chunk_size in (1, 3, 64, 1 << 16):
+        assert decoded(decode_standard_merkle_tree(content, chunk_size)) == expected
+    assert decoded(decode_standard_merkle_tree(text, 5)) == expected
+    assert decoded(decode_standard_merkle_tree(io.BytesIO(content), 7)) == expected
+    chunks = [content[i:i + 11] for i in range(0, len(content), 11)]
+    assert decoded(decode_standard_merkle_tree(iter(chunks))) == expected
+
+
+@pytest.mark.parametrize("content", [
+    "",
+    '{"values": [',
+    '"{\\"values\\": []}',
+    '{"tree": [], "leafEncoding": ["address", "uint256"]}',
+    '{"values": [], "leafEncoding": ["bytes32"]}',
+    '{"values": [{"value": ["0x1234", "1"]}]}',
+])
+def test_invalid_dumps_raise(content):
+    with pytest.raises(ValueError):
+        decode_standard_merkle_tree(content, 4)
+
+
+def test_addresses_are_lowercased_for_reconciliation():
+    owner = "0x" + "ab" * 20
+    dump = json.dumps(json.dumps({
+        "format": "standard-v1",
+        "tree": ["0x00"],
+        "values": [{"value": ["0x" + "aB" * 20, "100"], "treeIndex": 0}],
+        "leafEncoding": ["address", "uint256"],
+    }))
+    allowlist = decode_standard_merkle_tree(dump.encode())
+    assert allowlist.hex_addresses() == [owner]
+
+    # The subgraph and Supabase hold lowercase addresses. With the checksummed
+    # address kept as is, the holder showed up as an unlisted row and the
+    # allowlist entry as an unclaimed error.
+    claim = {
+        "claimId": "claim-1",
+        "metadata": {"name": "Claim 1"},
+        "creatorAddress": "0x" + "cd" * 20,
+        "allowlist": allowlist.to_json(),
+        "userClaims": [{"id": "token-1", "owner": owner, "units": "100"}],
+        "supabaseList": [owner],
+    }
+    df = hypercert_accounting.build_reconciliation([claim], set())
+    assert df[["address", "units", "claimed", "supabase", "slots", "error"]].to_dict("records") == [
+        {"address": owner, "units": 100, "claimed": 100, "supabase": True, "slots": 1, "error": False}
+    ]
+
+
+class MovedGateway(BaseHTTPRequestHandler):
+    """A gateway answering every request with an HTML page and status 200."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b"<html>gateway moved</html>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_html_page_is_not_cached_as_allowlist(monkeypatch, tmp_path):
+    moved = ThreadingHTTPServer(("127.0.0.1", 0), MovedGateway)
+    threading.Thread(target=moved.serve_forever, daemon=True).start()
+    services = FakeServices(Portfolio(1)).start()
+    try:
+        monkeypatch.setenv("IPFS_GATEWAYS", f"http://127.0.0.1:{moved.server_port}/ipfs/,"
+                                            f"{services.env['IPFS_GATEWAYS']}")
+        cache = ipfs_cache.IPFSCache(str(tmp_path))
+        monkeypatch.setattr(ipfs_cache, "_default_cache", cache)
+        expected = decode_standard_merkle_tree(services.ipfs.content("bafyallowlist0000000"))
+
+        allowlist = hypercert_accounting.retrieve_allowlist("ipfs://bafyallowlist0000000")
+        assert decoded(allowlist) == decoded(expected)
+        assert services.ipfs.counters.requests == 1
+        assert cache.get("bafyallowlist0000000") == services.ipfs.content("bafyallowlist0000000")
+    finally:
+        services.stop()
+        moved.shutdown()
+        moved.server_close()
@@ -0,0 +1,140 @@
+import json
+import os
+import random
+
+import pytest
+
+import ipfs_cache
+from fake_services import FakeServices, Portfolio
+from metadata_parser import parse_metadata
+
+STRING_PIECES = ["a", "Z", " ", '"', "\\", "/", "]", "}", "[", "{", ",", ":", "é", "中", "\n", "\t", " ", "😀"]
+
+
+def random_string(rng: random.Random) -> str:
+    return "".join(rng.choice(STRING_PIECES) for _ in range(rng.randrange(0, 12)))
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(8 if depth < 3 else 6)
+    if kind == 0:
+        return None
+    if kind == 1:
+        return rng.random() < 0.5
+    if kind == 2:
+        return rng.randrange(-10 ** 20, 10 ** 20)
+    if kind == 3:
+        return rng.uniform(-1e6, 1e6)
+    if kind in (4, 5):
+        return random_string(rng)
+    if kind == 6:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(0, 4))]
+    return {random_string(rng): random_value(rng, depth + 1) for _ in range(rng.randrange(0, 4))}
+
+
+def random_document(rng: random.Random) -> str:
+    fields = {random_string(rng): random_value(rng) for _ in range(rng.randrange(0, 6))}
+    fields["image"] = "data:image/png;base64," + "QUJD" * rng.randrange(0, 5000)
+    keys = list(fields)
+    rng.shuffle(keys)
+    separators = rng.choice([(",", ":"), (", ", ": "), (" ,\n", " :\t")])
+    return json.dumps({key: fields[key] for key in keys}, indent=rng.choice([None, 0, 2]),
+                      ensure_ascii=rng.random() < 0.5, separators=separators)
+
+
+def chunked(content: bytes, rng: random.Random) -> list:
+    chunks = []
+    pos = 0
+    while pos < len(content):
+        size = rng.choice([1, 2, 3, 7, 64, 1 << 16])
+        chunks.append(content[pos:pos + size])
+        pos += size
+    return chunks
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_json_loads(seed):
+    rng = random.Random(seed)
+    text = random_document(rng)
+    content = text.encode()
+    document = json.loads(text)
+    keys = rng.sample(sorted(document), rng.randrange(0, len(document) + 1)) if rng.random() < 0.3 else None
+    skip_keys = ["image"] + rng.sample(sorted(document), rng.randrange(0, 2) if document else 0)
+
+    expected = {
+        key: value for key, value in document.items()
+        if key not in skip_keys and (keys is None or key in keys)
+    }
+    assert parse_metadata(content, skip_keys, keys) == expected
+    assert parse_metadata(text, skip_keys, keys) == expected
+    assert parse_metadata(chunked(content, rng), skip_keys, keys) == expected
+
+    # Any truncation is rejected, like json.loads does
+    cut = rng.randrange(0, len(content))
+    with pytest.raises(ValueError):
+        json.loads(content[:cut])
+    with pytest.raises(ValueError):
+        parse_metadata(chunked(content[:cut], rng), skip_keys, keys)
+
+
+@pytest.mark.parametrize("content", [
+    b"",
+    b"{",
+    b'{"name"',
+    b'{"name": }',
+    b'{"name": 1,}',
+    b'{"name": 1} x',
+    b'{1: 2}',
+    b'{"name" 1}',
+    b'{"name": "a", "image": "unterminated}',
+    b"<html>Bad gateway</html>",
+])
+def test_invalid_documents_raise(content):
+    with pytest.raises(ValueError):
+        parse_metadata([content[i:i + 3] for i in range(0, len(content), 3)])
+
+
+def test_non_object_documents_are_decoded_whole():
+    assert parse_metadata(b' [1, {"image": 2}] ') == [1, {"image": 2}]
+    assert parse_metadata([b'"ab', b'c"']) == "abc"
+
+
+@pytest.fixture
+def services():
+    services = FakeServices(Portfolio(2, image_bytes=1 << 20)).start()
+    yield services
+    services.stop()
+
+
+def test_cache_stores_only_kept_fields(services, monkeypatch, tmp_path):
+    monkeypatch.setenv("IPFS_GATEWAYS", services.env["IPFS_GATEWAYS"])
+    cache = ipfs_cache.IPFSCache(str(tmp_path))
+    full = services.portfolio.metadata(0)
+
+    metadata = ipfs_cache.retrieve_ipfs_metadata("ipfs://bafymeta0000000", cache=cache)
+    assert metadata == {key: value for key, value in full.items() if key != "image"}
+    assert services.ipfs.counters.requests == 1
+
+    # Only the parsed fields are cached, not the file with its image
+    assert cache.get("bafymeta0000000") is None
+    entries = [os.path.join(root, name) for root, _, names in os.walk(tmp_path) for name in names]
+    assert len(entries) == 1
+    assert os.path.getsize(entries[0]) < 2000
+
+    assert ipfs_cache.retrieve_ipfs_metadata("bafymeta0000000", cache=cache) == metadata
+    assert services.ipfs.counters.requests == 1
+
+    # A different selection of fields is a different entry
+    names = ipfs_cache.retrieve_ipfs_metadata("bafymeta0000000", keys=["name"], cache=cache)
+    assert names == {"name": full["name"]}
+    assert services.ipfs.counters.requests == 2
+
+
+def test_file_cached_whole_is_parsed_from_cache(services, monkeypatch, tmp_path):
+    monkeypatch.setenv("IPFS_GATEWAYS", services.env["IPFS_GATEWAYS"])
+    cache = ipfs_cache.IPFSCache(str(tmp_path))
+    cache.put("bafymeta0000001", json.dumps(services.portfolio.metadata(1)).encode())
+
+    metadata = ipfs_cache.retrieve_ipfs_metadata("bafymeta0000001", keys=["name", "image"], cache=cache)
+    assert metadata == {"name": "Hypercert 1"}
+    assert services.ipfs.counters.requests == 0
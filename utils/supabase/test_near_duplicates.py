@@ -0,0 +1,79 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import near_duplicates
+from near_duplicates import claim_texts, find_near_duplicates
+
+WORDS = ["climate", "public", "goods", "open", "source", "research", "ocean", "cleanup", "education",
+         "zuzalu", "gitcoin", "grant", "community", "solar", "forest", "water", "health", "data"]
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randrange(6, 14)))
+
+
+def edited(rng: random.Random, text: str) -> str:
+    # A near-duplicate: one word changed, or a few characters appended
+    words = text.split()
+    if rng.random() < 0.5:
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+        return " ".join(words)
+    return text + rng.choice(["!", " 2", " v2"])
+
+
+def texts(rng: random.Random, n: int) -> list:
+    texts = []
+    for _ in range(n):
+        texts.append(edited(rng, rng.choice(texts)) if texts and rng.random() < 0.3 else sentence(rng))
+    return texts
+
+
+def all_pairs(texts: list, threshold: float) -> dict:
+    # Exact similarity of every pair, as `jaccard` computes it
+    shingles = [near_duplicates._shingles(text, near_duplicates.SHINGLE_SIZE) for text in texts]
+    pairs = {}
+    for i in range(len(texts)):
+        for j in range(i):
+            if texts[i] and texts[j]:
+                similarity = len(shingles[i] & shingles[j]) / len(shingles[i] | shingles[j])
+                if similarity >= threshold:
+                    pairs[i, j] = similarity
+    return pairs
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("threshold", [0.6, 0.8])
+def test_recall_on_known_pairs(seed, threshold):
+    sample = texts(random.Random(seed), 300)
+    expected = all_pairs(sample, threshold)
+    found = list(find_near_duplicates(sample, threshold))
+
+    # Every reported pair is exact, and pairs come ordered by the later claim
+    assert [(i, j) for i, j, _ in found] == sorted((i, j) for i, j, _ in found)
+    assert all(j < i and similarity == expected[i, j] for i, j, similarity in found)
+    # Candidates are sampled, but pairs clearly above the threshold are never missed
+    found = {(i, j) for i, j, _ in found}
+    assert len(found) >= near_duplicates.MIN_RECALL * len(expected)
+    assert {pair for pair, similarity in expected.items() if similarity >= threshold + 0.1} <= found
+
+
+def test_large_buckets_report_every_pair():
+    # More copies of one text than fit a small bucket, and empty texts that never match
+    sample = ["open source public goods"] * (near_duplicates.SMALL_BUCKET_SIZE + 6) + ["", ""]
+    n = near_duplicates.SMALL_BUCKET_SIZE + 6
+    found = [(i, j) for i, j, _ in find_near_duplicates(sample)]
+    assert found == [(i, j) for i in range(n) for j in range(i)]
+
+
+def test_claim_texts_use_title_description_and_work_scopes():
+    df = pd.DataFrame({
+        "title": ["Ocean  Cleanup", np.nan],
+        "description": ["Beach\nday", "Only a description"],
+        "work_scope": [np.array(["Climate", "Water"], dtype=object), None],
+    })
+    assert claim_texts(df) == ["ocean cleanup beach day climate water", "only a description"]
+    df = df.drop(columns="work_scope").assign(hypercert=["{'work_scope': {'value': ['Climate']}}", None])
+    assert claim_texts(df) == ["ocean cleanup beach day climate", "only a description"]
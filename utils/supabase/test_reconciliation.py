@@ -0,0 +1,152 @@
+import random
+
+import pandas as pd
+import pytest
+
+import hypercert_accounting
+from accounting_store import AccountingStore
+from merkle_allowlist import INT64_MAX, MerkleAllowlist, _from_pairs
+
+
+def reconcile_claims_loop(claims_data, hidden_claims, csv_outpath, errors_outpath):
+    # reconcile_claims as it was before build_reconciliation, one claim at a time
+    results = []
+    for claim in claims_data:
+        if claim['claimId'] in hidden_claims:
+            continue
+
+        allowlist = {}
+
+        def create_entry(address, units, slots):
+            return {
+                'address': address,
+                'claimId': claim['claimId'],
+                'claimName': claim['metadata']['name'],
+                'creator': claim['creatorAddress'] == address,
+                'units': units,
+                'claimed': 0,
+                'supabase': False,
+                'slots': slots
+            }
+
+        leaves = MerkleAllowlist.from_json(claim['allowlist'])
+        for (address, units) in zip(leaves.hex_addresses(), leaves.units.tolist()):
+            if address in allowlist:
+                allowlist[address]['units'] += units
+                allowlist[address]['slots'] += 1
+            else:
+                allowlist[address] = create_entry(address, units, 1)
+
+        for user_claim in claim['userClaims']:
+            owner = user_claim['owner']
+            num_units = int(user_claim['units'])
+            if owner not in allowlist:
+                allowlist[owner] = create_entry(owner, 0, 0)
+            allowlist[owner]['claimed'] += num_units
+
+        for address in claim['supabaseList']:
+            if address in allowlist:
+                allowlist[address]['supabase'] = True
+
+        results.extend(allowlist.values())
+
+    df = pd.DataFrame(results)
+    df['error'] = df.apply(lambda x: not(x['supabase']) and not(x['claimed']), axis=1)
+    df.to_csv(csv_outpath, index=False)
+
+    df_error = df[df['error']][['address', 'claimId']].sort_values(by='address')
+    df_error.to_csv(errors_outpath, index=False)
+
+
+def address(n: int) -> str:
+    return "0x" + format(n * 2654435761 % (1 << 160), "040x")
+
+
+def claim_record(rng: random.Random, k: int, allowlist_size: int = None, big_units: bool = False) -> dict:
+    pool = [address(k * 100 + n) for n in range(12)]
+    if allowlist_size is None:
+        allowlist_size = rng.randrange(1, 15)
+    pairs = [(rng.choice(pool), rng.randrange(1, 1000)) for _ in range(allowlist_size)]
+    if big_units and pairs:
+        pairs[0] = (pairs[0][0], INT64_MAX + rng.randrange(1, 1000))
+    tokens = [
+        {"id": f"claim-{k}-{t:04d}", "owner": rng.choice(pool), "units": str(rng.randrange(0, 500))}
+        for t in range(rng.randrange(0, 12))
+    ]
+    return {
+        "claimId": f"claim-{k}",
+        "createdAt": 1680000000 + k,
+        "createdDate": "2023-03-28 10:40:00",
+        "creatorAddress": rng.choice(pool),
+        "ownerAddress": pool[0],
+        "totalUnits": 10000,
+        "metadataUri": f"ipfs://meta{k}",
+        "allowlistUri": f"ipfs://allowlist{k}",
+        "metadata": {"name": f"Claim {k}"},
+        "allowlist": _from_pairs(pairs).to_json(),
+        "userClaims": tokens,
+        "supabaseList": rng.sample(pool, rng.randrange(0, 6)),
+    }
+
+
+def store_records(tmp_path, records) -> str:
+    db_path = str(tmp_path / "accounting.db")
+    store = AccountingStore(db_path)
+    for record in records:
+        store.upsert_claim(record)
+    store.close()
+    return db_path
+
+
+def reconcile_old(tmp_path, db_path, hidden) -> tuple:
+    outpaths = tmp_path / "old.csv", tmp_path / "old_errors.csv"
+    store = AccountingStore(db_path)
+    try:
+        reconcile_claims_loop(store.iter_claims(), hidden, *outpaths)
+    finally:
+        store.close()
+    return tuple(path.read_text() for path in outpaths)
+
+
+def reconcile_new(tmp_path, monkeypatch, db_path, hidden) -> tuple:
+    outpaths = tmp_path / "new.csv", tmp_path / "new_errors.csv"
+    monkeypatch.setattr(hypercert_accounting, "CSV_OUTPATH", str(outpaths[0]))
+    monkeypatch.setattr(hypercert_accounting, "SUPABASE_UPDATE", str(outpaths[1]))
+    monkeypatch.setattr(hypercert_accounting, "fetch_hidden_hypercerts", lambda: set(hidden))
+    hypercert_accounting.reconcile_claims(db_path)
+    return tuple(path.read_text() for path in outpaths)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_reconciliation_matches_per_claim_loop(tmp_path, monkeypatch, seed):
+    rng = random.Random(seed)
+    records = [claim_record(rng, k, big_units=(k == 3)) for k in range(rng.randrange(1, 20))]
+    hidden = {record["claimId"] for record in records if rng.random() < 0.2}
+    db_path = store_records(tmp_path, records)
+
+    assert reconcile_new(tmp_path, monkeypatch, db_path, hidden) == reconcile_old(tmp_path, db_path, hidden)
+
+
+def test_empty_allowlist(tmp_path, monkeypatch):
+    rng = random.Random(1)
+    records = [claim_record(rng, 0, allowlist_size=0), claim_record(rng, 1), claim_record(rng, 2, allowlist_size=0)]
+    records[0]["userClaims"] = [{"id": "claim-0-0000", "owner": address(1), "units": "5"}]
+    records[2]["userClaims"] = []
+    db_path = store_records(tmp_path, records)
+
+    assert reconcile_new(tmp_path, monkeypatch, db_path, set()) == reconcile_old(tmp_path, db_path, set())
+
+
+def test_all_claims_hidden(tmp_path, monkeypatch):
+    rng = random.Random(2)
+    records = [claim_record(rng, k) for k in range(3)]
+    hidden = {record["claimId"] for record in records}
+    db_path = store_records(tmp_path, records)
+
+    # The per-claim loop failed on an empty report; now only the headers are written
+    with pytest.raises(ValueError):
+        reconcile_old(tmp_path, db_path, hidden)
+    assert reconcile_new(tmp_path, monkeypatch, db_path, hidden) == (
+        ",".join(hypercert_accounting.RECONCILIATION_COLUMNS + ["error"]) + "\n",
+        "address,claimId\n",
+    )
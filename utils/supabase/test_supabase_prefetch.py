@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+from supabase import create_client
+
+import supabase_prefetch
+from fake_services import FakeServices, Portfolio
+
+
+class UncountedQuery:
+    """A query builder stand-in whose responses carry no count and are capped at `max_rows`."""
+
+    def __init__(self, rows: list, max_rows: int):
+        self.rows = rows
+        self.max_rows = max_rows
+        self.requests = 0
+
+    def range(self, start: int, end: int):
+        self.start, self.end = start, end
+        return self
+
+    def execute(self):
+        self.requests += 1
+        end = min(self.end + 1, self.start + self.max_rows)
+        return SimpleNamespace(data=self.rows[self.start:end], count=None)
+
+
+def test_pages_without_count_until_empty_page():
+    rows = [{"n": n} for n in range(10)]
+    query = UncountedQuery(rows, max_rows=3)
+
+    assert supabase_prefetch.fetch_all_rows(lambda: query, page_size=5) == rows
+    assert query.requests == 5
+
+
+@pytest.fixture
+def services():
+    services = FakeServices(Portfolio(0)).start()
+    services.postgrest.max_rows = 7
+    yield services
+    services.stop()
+
+
+def test_allowlist_cache_without_id_column(services):
+    # Rows as the table may hold them: no `id` column, in no particular order
+    rows = [{"claimId": f"claim-{n % 3}", "address": f"0x{(n * 7919) % 100:040x}"} for n in range(40)]
+    services.postgrest.tables[supabase_prefetch.ALLOWLIST_CACHE_TABLE] = list(rows)
+    supabase = create_client(services.env["SUPABASE_URL"], services.env["SUPABASE_KEY"])
+
+    index = supabase_prefetch.fetch_allowlist_cache(supabase, ["claim-0", "claim-1", "claim-3"], chunk_size=2)
+
+    for claim_id in ("claim-0", "claim-1"):
+        assert index.addresses_for(claim_id) == sorted(r["address"] for r in rows if r["claimId"] == claim_id)
+    assert index.addresses_for("claim-3") == []
+    assert index.addresses_for("claim-2") == []
@@ -0,0 +1,75 @@
+import pytest
+
+import user_claims
+from token_index import TokenIndex
+
+OWNER = "0x" + "11" * 20
+BUYER = "0x" + "33" * 20
+
+
+def token(n: int, owner: str = OWNER, units: int = 100) -> dict:
+    return {
+        "id": f"claim-1-{n:04d}",
+        "owner": owner,
+        "units": str(units),
+        "claim": {"id": "claim-1", "totalUnits": "10000", "creator": OWNER}
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "index.db")
+
+
+def test_only_new_or_changed_tokens_are_written(db_path):
+    index = TokenIndex(db_path)
+    assert index.update(user_claims.create_record(token(n)) for n in range(3)) == 3
+    records = [user_claims.create_record(t) for t in (token(0), token(1, BUYER), token(2, units=60), token(3))]
+    assert index.update(records) == 3
+    index.close()
+
+    # The index is read back when reopened
+    index = TokenIndex(db_path)
+    assert len(index) == 4 and "claim-1-0003" in index
+    assert index.get("claim-1-0001") == (BUYER, "100")
+    assert index.get("claim-1-0002") == (OWNER, "60")
+    assert index.get("claim-1-9999") is None
+    # Fetched tokens are compared with the index by owner and units text
+    unchanged = [token(0), token(1, BUYER), token(2, units=60)]
+    assert list(user_claims.parse_tokens(unchanged + [token(3, BUYER)], index.tokens)) == [
+        user_claims.create_record(token(3, BUYER))
+    ]
+    index.close()
+
+
+def test_synced_blocks(db_path):
+    index = TokenIndex(db_path)
+    assert index.synced_blocks() == {}
+    index.mark_synced(["claim-1", "claim-2"], 100)
+    index.mark_synced(["claim-2", "claim-3"], 200)
+    index.close()
+    index = TokenIndex(db_path)
+    assert index.synced_blocks() == {"claim-1": 100, "claim-2": 200, "claim-3": 200}
+    index.close()
+
+
+def test_import_csv(db_path, tmp_path):
+    csv_file = tmp_path / "userTokenData.csv"
+    index = TokenIndex(db_path)
+    assert index.import_csv(str(csv_file)) == 0
+    csv_file.write_text("")
+    assert index.import_csv(str(csv_file)) == 0
+
+    # userTokenData.csv as written by user_claims, with a row missing its tokenId
+    csv_file.write_text(
+        "tokenId,ownerAddress,units,claimId,totalUnits,creatorAddress\n"
+        f"claim-1-0000,{OWNER},100,claim-1,10000,{OWNER}\n"
+        f"claim-1-0001,{BUYER},25,claim-1,10000,{OWNER}\n"
+        f",{BUYER},25,claim-1,10000,{OWNER}\n"
+    )
+    assert index.import_csv(str(csv_file)) == 2
+    assert index.tokens == {"claim-1-0000": (OWNER, "100"), "claim-1-0001": (BUYER, "25")}
+    # Importing again writes nothing, and the imported tokens match fetched ones
+    assert index.import_csv(str(csv_file)) == 0
+    assert list(user_claims.parse_tokens([token(0), token(1, BUYER, 25)], index.tokens)) == []
+    index.close()
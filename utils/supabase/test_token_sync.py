@@ -0,0 +1,217 @@
+import csv
+
+import pytest
+from supabase import create_client
+
+import hypercert_accounting
+import user_claims
+from accounting_store import AccountingStore
+from fake_services import INDEXED_BLOCK, FakeServices, Portfolio, address
+from merkle_allowlist import _from_pairs
+from token_index import TokenIndex
+
+BUYER = "0x" + "33" * 20
+
+
+@pytest.fixture
+def services(monkeypatch):
+    services = FakeServices(Portfolio(6, tokens_per_claim=5, existing_fraction=1)).start()
+    for key, value in services.env.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setenv("GRAPH_RATE_LIMIT", "100000")
+    yield services
+    services.stop()
+
+
+@pytest.fixture
+def token_requests(services, monkeypatch):
+    # Arguments of every claimTokens selection the fake subgraph answers
+    requests = []
+    claim_tokens = services.graph._claimTokens
+
+    def record(args):
+        requests.append(args)
+        return claim_tokens(args)
+
+    monkeypatch.setattr(services.graph, "_claimTokens", record)
+    return requests
+
+
+def full_fetches(requests: list) -> set:
+    """Returns the claims whose tokens were fetched in full."""
+    claim_ids = set()
+    for args in requests:
+        if "change_block" in args:
+            continue
+        claim_ids.update([args["claim"]] if "claim" in args else args["claim_in"].replace('"', "").split(","))
+    return {claim_id.strip() for claim_id in claim_ids}
+
+
+def change_blocks(requests: list) -> set:
+    return {int(args["change_block"]) for args in requests if "change_block" in args}
+
+
+def claim_record(portfolio: Portfolio, i: int, tokens: list = None) -> dict:
+    claim = portfolio.claims[i]
+    return {
+        "claimId": claim["id"],
+        "createdAt": int(claim["creation"]),
+        "createdDate": hypercert_accounting.timestamp_to_date_string(claim["creation"]),
+        "creatorAddress": claim["creator"],
+        "ownerAddress": claim["owner"],
+        "totalUnits": int(claim["totalUnits"]),
+        "metadataUri": claim["uri"],
+        "allowlistUri": "",
+        "metadata": {"name": f"Hypercert {i}"},
+        "allowlist": _from_pairs(portfolio.allowlist(i)).to_json(),
+        "userClaims": portfolio.tokens(claim["id"]) if tokens is None else tokens,
+        "supabaseList": [],
+    }
+
+
+def stored_tokens(store: AccountingStore) -> dict:
+    return {
+        token_id: (owner, units, block)
+        for token_id, owner, units, block in store.conn.execute(
+            "SELECT tokenId, owner, units, updatedBlock FROM claim_tokens"
+        )
+    }
+
+
+def current_tokens(portfolio: Portfolio) -> dict:
+    return {t["id"]: (t["owner"], t["units"]) for c in portfolio.claims for t in portfolio.tokens(c["id"])}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AccountingStore(str(tmp_path / "accounting.db"))
+    yield store
+    store.close()
+
+
+def test_delta_refresh_merges_changes_since_oldest_indexed_block(services, token_requests, store):
+    portfolio = services.portfolio
+    claims = [c["id"] for c in portfolio.claims]
+    for i in range(4):
+        store.upsert_claim(claim_record(portfolio, i), block=INDEXED_BLOCK - i)
+    # Imported from the JSON file with no known block, and with tokens that are out of date
+    for i in (4, 5):
+        store.upsert_claim(claim_record(portfolio, i, portfolio.tokens(claims[i])[:2]))
+    before = stored_tokens(store)
+
+    portfolio.transfer(f"{claims[0]}-000001", BUYER)
+    portfolio.transfer(f"{claims[3]}-000004", BUYER)
+    block = portfolio.block
+    hypercert_accounting.refresh_claim_tokens(store, block, mode="delta")
+
+    # Changes are fetched since the oldest indexed block; only unindexed claims are fetched in full
+    assert change_blocks(token_requests) == {INDEXED_BLOCK - 3}
+    assert full_fetches(token_requests) == set(claims[4:])
+    assert store.unindexed_claims() == []
+    assert store.claims_indexed_before(block) == []
+
+    tokens = stored_tokens(store)
+    assert {k: v[:2] for k, v in tokens.items()} == current_tokens(portfolio)
+    rewritten = {k for k in tokens if tokens[k] != before.get(k)}
+    transferred = {f"{claims[0]}-000001", f"{claims[3]}-000004"}
+    added = {f"{claims[i]}-{j:06d}" for i in (4, 5) for j in range(2, 5)}
+    assert rewritten == transferred | added
+    assert all(tokens[k][2] == block for k in rewritten)
+
+
+def test_full_refresh_refetches_only_changed_or_due_claims(services, token_requests, store, monkeypatch):
+    portfolio = services.portfolio
+    claims = [c["id"] for c in portfolio.claims]
+    monkeypatch.setattr(hypercert_accounting, "FULL_SYNC_BLOCKS", 1000)
+    for i in range(6):
+        store.upsert_claim(claim_record(portfolio, i), block=INDEXED_BLOCK)
+    # Synced in full long enough ago to be due
+    store.sync_tokens(claims[5], portfolio.tokens(claims[5]), INDEXED_BLOCK - 1000)
+    before = stored_tokens(store)
+
+    portfolio.transfer(f"{claims[2]}-000000", BUYER)
+    block = portfolio.block
+    hypercert_accounting.refresh_claim_tokens(store, block, mode="full")
+
+    assert change_blocks(token_requests) == {INDEXED_BLOCK - 1000}
+    assert full_fetches(token_requests) == {claims[2], claims[5]}
+    assert store.claims_indexed_before(block) == []
+    tokens = stored_tokens(store)
+    assert {k: v[:2] for k, v in tokens.items()} == current_tokens(portfolio)
+    assert {k for k in tokens if tokens[k] != before[k]} == {f"{claims[2]}-000000"}
+
+    # With every claim due, all are fetched again, but unchanged rows are not rewritten
+    token_requests.clear()
+    monkeypatch.setattr(hypercert_accounting, "FULL_SYNC_BLOCKS", 0)
+    hypercert_accounting.refresh_claim_tokens(store, block + 1, mode="full")
+    assert full_fetches(token_requests) == set(claims)
+    assert stored_tokens(store) == tokens
+
+
+def read_csv(path) -> dict:
+    with open(path, newline="") as f:
+        return {row["tokenId"]: (row["ownerAddress"], row["units"]) for row in csv.DictReader(f)}
+
+
+def test_user_claims_sync_rewrites_only_changed_tokens(services, token_requests, monkeypatch, tmp_path):
+    portfolio = services.portfolio
+    claims = [c["id"] for c in portfolio.claims]
+    monkeypatch.setattr(user_claims, "supabase",
+                        create_client(services.env["SUPABASE_URL"], services.env["SUPABASE_KEY"]))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+
+    # The first run has no synced claims and fetches every claim in full
+    user_claims.main()
+    assert change_blocks(token_requests) == set()
+    assert full_fetches(token_requests) == set(claims)
+    index = TokenIndex(user_claims.INDEX_PATH)
+    assert index.synced_blocks() == {claim_id: INDEXED_BLOCK for claim_id in claims}
+    index.close()
+    assert read_csv(user_claims.CSV_FILEPATH) == current_tokens(portfolio)
+
+    token_requests.clear()
+    portfolio.transfer(f"{claims[1]}-000003", BUYER)
+    portfolio.transfer(f"{claims[4]}-000000", address(99))
+    writes = []
+    update = TokenIndex.update
+
+    def record_update(self, records):
+        records = list(records)
+        writes.extend(record["tokenId"] for record in records)
+        return update(self, records)
+
+    monkeypatch.setattr(TokenIndex, "update", record_update)
+    user_claims.main()
+
+    # Only the tokens changed since the last sync are fetched and rewritten
+    assert change_blocks(token_requests) == {INDEXED_BLOCK}
+    assert full_fetches(token_requests) == set()
+    assert sorted(writes) == sorted([f"{claims[1]}-000003", f"{claims[4]}-000000"])
+    assert read_csv(user_claims.CSV_FILEPATH) == current_tokens(portfolio)
+    index = TokenIndex(user_claims.INDEX_PATH)
+    assert set(index.synced_blocks().values()) == {portfolio.block}
+    index.close()
+
+
+def test_tokens_to_sync_fetches_unsynced_claims_in_full(services, token_requests, tmp_path):
+    portfolio = services.portfolio
+    claims = [c["id"] for c in portfolio.claims]
+    index = TokenIndex(str(tmp_path / "index.db"))
+    index.mark_synced(claims[:2], INDEXED_BLOCK - 5)
+    index.mark_synced(claims[2:4], INDEXED_BLOCK)
+    portfolio.transfer(f"{claims[3]}-000002", BUYER)
+
+    tokens = list(user_claims.get_tokens_to_sync(claims, index, portfolio.block, mode="delta"))
+    # Changes are fetched since the oldest sync block of the synced claims
+    assert change_blocks(token_requests) == {INDEXED_BLOCK - 5}
+    assert full_fetches(token_requests) == set(claims[4:])
+    assert sorted(t["id"] for t in tokens) == sorted(
+        [f"{claims[3]}-000002"] + [t["id"] for c in claims[4:] for t in portfolio.tokens(c)]
+    )
+
+    token_requests.clear()
+    tokens = list(user_claims.get_tokens_to_sync(claims, index, portfolio.block, mode="full"))
+    assert change_blocks(token_requests) == set()
+    assert full_fetches(token_requests) == set(claims)
+    index.close()
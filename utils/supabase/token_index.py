@@ -0,0 +1,124 @@
+"""
+Persistent index of the tokens already written by `user_claims.py`.
+
+The index is a SQLite table keyed by tokenId that holds each token's current
+owner and units. It is loaded into a dictionary when opened, so checking
+whether a fetched token is new or changed takes constant time, and only new
+or changed tokens are written back.
+
+The index also records the block each claim's tokens were last synced at, so
+later runs can fetch only the tokens changed since then.
+"""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    tokenId TEXT PRIMARY KEY,
+    ownerAddress TEXT,
+    units TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS synced_claims (
+    claimId TEXT PRIMARY KEY,
+    syncedBlock INTEGER
+) WITHOUT ROWID;
+"""
+
+IMPORT_CHUNK_ROWS = 100000
+
+
+class TokenIndex:
+    """
+    Owner and units of every known token, keyed by tokenId.
+
+    Args:
+        db_path: Path to the SQLite database; created if missing.
+
+    Attributes:
+        tokens: Dictionary mapping each tokenId to its (ownerAddress, units) pair.
+    """
+
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        self.tokens = {
+            token_id: (owner, units)
+            for token_id, owner, units in self.conn.execute("SELECT tokenId, ownerAddress, units FROM tokens")
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __contains__(self, token_id: str) -> bool:
+        return token_id in self.tokens
+
+    def get(self, token_id: str) -> tuple:
+        """Returns the (ownerAddress, units) pair of a token, or None if it is unknown."""
+        return self.tokens.get(token_id)
+
+    def synced_blocks(self) -> dict:
+        """Returns a dictionary mapping each synced claimId to the block it was last synced at."""
+        return dict(self.conn.execute("SELECT claimId, syncedBlock FROM synced_claims"))
+
+    def mark_synced(self, claim_ids: list, block: int) -> None:
+        """
+        Records that the tokens of the given claims are up to date as of `block`.
+
+        Args:
+            claim_ids: IDs of the synced claims.
+            block: Block number the tokens were fetched at.
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO synced_claims (claimId, syncedBlock) VALUES (?, ?) "
+                "ON CONFLICT (claimId) DO UPDATE SET syncedBlock = excluded.syncedBlock",
+                [(claim_id, block) for claim_id in claim_ids]
+            )
+
+    def update(self, records) -> int:
+        """
+        Writes the owner and units of new or changed token records.
+
+        Args:
+            records: Iterable of token records as built by `user_claims.create_record`.
+
+        Returns:
+            Number of tokens written.
+        """
+        rows = []
+        for record in records:
+            state = (record["ownerAddress"], str(record["units"]))
+            if self.tokens.get(record["tokenId"]) != state:
+                self.tokens[record["tokenId"]] = state
+                rows.append((record["tokenId"], *state))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO tokens (tokenId, ownerAddress, units) VALUES (?, ?, ?) "
+                "ON CONFLICT (tokenId) DO UPDATE SET ownerAddress = excluded.ownerAddress, units = excluded.units",
+                rows
+            )
+        return len(rows)
+
+    def import_csv(self, csv_filepath: str) -> int:
+        """
+        Seeds the index from an existing `userTokenData.csv`.
+
+        Args:
+            csv_filepath: Path to the CSV file.
+
+        Returns:
+            Number of tokens imported.
+        """
+        if not os.path.exists(csv_filepath) or not os.path.getsize(csv_filepath):
+            return 0
+        count = 0
+        columns = ["tokenId", "ownerAddress", "units"]
+        for chunk in pd.read_csv(csv_filepath, usecols=columns, dtype=str, chunksize=IMPORT_CHUNK_ROWS):
+            count += self.update(chunk.dropna(subset=["tokenId"]).to_dict("records"))
+        return count
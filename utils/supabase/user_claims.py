@@ -1,11 +1,17 @@
 import os
 import json
-import pandas as pd
-import requests
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+import graph_client
+import subgraph
+import supabase_prefetch
+from append_writer import AppendWriter
+from token_index import TokenIndex
+
 load_dotenv()
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
@@ -13,57 +19,89 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 TABLE_NAME = "claims-metadata-mapping"
 CSV_FILEPATH = "data/userTokenData.csv"
+INDEX_PATH = "data/userTokenIndex.db"
+WRITE_CHUNK_SIZE = 10000
+
+TOKEN_FIELDS = """
+    id
+    owner
+    units
+    claim {
+        id
+        totalUnits
+        creator
+    }
+"""
+# Number of claims whose tokens are fetched per subgraph request; 1 disables batching
+BATCH_SIZE = int(os.environ.get("USER_CLAIMS_BATCH_SIZE", subgraph.BATCH_SIZE))
+# Number of claim batches fetched concurrently
+MAX_WORKERS = int(os.environ.get("USER_CLAIMS_MAX_WORKERS", 4))
+
+
+def get_claim_group_tokens(claim_ids: list, block: int, batch_size: int = BATCH_SIZE) -> list:
+    """Fetches every token of a group of claims, batching the claims into aliased requests."""
+    tokens = []
+    for _, page in subgraph.iter_claim_token_pages(claim_ids, TOKEN_FIELDS, block, batch_size):
+        tokens.extend(page)
+    return tokens
 
-CALL_LIMIT = 1000
-
-
-def get_tokens_claimed_by_hypercert(claim_id: str, offset: int = 0) -> list:
-    """Fetches tokens from The Graph for a given hypercert id."""
-    query = f'''
-        {{
-            claimTokens(          
-               where: {{
-                    claim_: {{
-                        id: "{claim_id}"
-                    }}
-                }}
-                first: {CALL_LIMIT}
-                offset: {offset}
-                orderBy: units
-                orderDirection: desc
-            ) {{
-                id
-                owner
-                units
-                claim {{
-                    id
-                    totalUnits
-                    creator
-                }} 
-            }}
-        }}
-    '''
-    url = "https://api.thegraph.com/subgraphs/name/hypercerts-admin/hypercerts-optimism-mainnet"
-    response = requests.post(url, json={'query': query})
-    json_data = response.json()
-    data = json_data['data']['claimTokens']
-    return data
-
-
-def get_all_tokens(list_of_claim_ids: list) -> list:
-    """Fetches all tokens from The Graph."""
-    all_tokens = []
-    for claim_id in list_of_claim_ids:
-        calls = 0
-        while True:
-            tokens = get_tokens_claimed_by_hypercert(claim_id, offset=(calls*CALL_LIMIT))
-            if not tokens:
-                break
-            all_tokens.extend(tokens)
-            calls += 1
-            if calls >= 5:
-                break
-    return all_tokens
+
+def get_all_tokens(list_of_claim_ids: list, batch_size: int = BATCH_SIZE, max_workers: int = MAX_WORKERS,
+                   block: int = None):
+    """Yields all tokens from The Graph, fetching groups of claims concurrently, pinned to one indexed block."""
+    if block is None:
+        block = subgraph.get_indexed_block()
+    groups = [list_of_claim_ids[i:i + batch_size] for i in range(0, len(list_of_claim_ids), batch_size)]
+    count = 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep a bounded number of groups in flight so finished groups don't pile up in memory
+        pending = set()
+        for group in groups:
+            pending.add(executor.submit(get_claim_group_tokens, group, block, batch_size))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tokens = future.result()
+                    count += len(tokens)
+                    yield from tokens
+        for future in as_completed(pending):
+            tokens = future.result()
+            count += len(tokens)
+            yield from tokens
+
+    elapsed = time.monotonic() - start
+    rate = count / elapsed if elapsed else 0
+    print(f"Fetched {count} tokens of {len(list_of_claim_ids)} claims in {elapsed:.1f}s ({rate:.1f} tokens/s).")
+
+
+def get_changed_tokens(list_of_claim_ids: list, since_block: int, block: int = None):
+    """Yields the tokens of the given claims that changed at or after `since_block`."""
+    claim_ids = set(list_of_claim_ids)
+    count = 0
+    for tokens in subgraph.iter_changed_tokens(TOKEN_FIELDS, since_block, block):
+        for token in tokens:
+            if token["claim"]["id"] in claim_ids:
+                count += 1
+                yield token
+    print(f"Fetched {count} tokens changed since block {since_block}.")
+
+
+def get_tokens_to_sync(list_of_claim_ids: list, index: TokenIndex, block: int, mode: str = None):
+    """
+    Yields the tokens needed to bring the index up to `block`.
+
+    In delta mode, claims synced before are covered by the tokens changed
+    since their oldest sync block, and only claims never synced are fetched in
+    full. In full mode, or when the subgraph reports no block, every claim is
+    fetched in full.
+    """
+    mode = mode or os.environ.get("TOKEN_SYNC_MODE") or "delta"
+    synced = index.synced_blocks() if mode == "delta" and block is not None else {}
+    stale = [c for c in list_of_claim_ids if c in synced]
+    yield from get_all_tokens([c for c in list_of_claim_ids if c not in synced], block=block)
+    if stale:
+        yield from get_changed_tokens(stale, min(synced[c] for c in stale), block)
 
 
 def create_record(token: dict) -> dict:
@@ -79,48 +117,74 @@ def create_record(token: dict) -> dict:
     }
 
 
-def parse_tokens(list_of_tokens: list, existing_tokens: list = []) -> list:
-    """Parses tokens, filtering out existing ones, and creates records."""
+def parse_tokens(list_of_tokens, existing_tokens: dict = None):
+    """Parses tokens, filtering out existing ones whose owner and units are unchanged, and yields records."""
     print("Parsing new tokens...")
-    tokens = []
+    existing_tokens = existing_tokens or {}
+    count = 0
     for token in list_of_tokens:
         token_id = token["id"]
-        if token_id not in existing_tokens:
+        if existing_tokens.get(token_id) != (token["owner"], str(token["units"])):
             record = create_record(token)
             if record:
-                tokens.append(record)
-    print(f"Total of {len(tokens)} new token claims extracted.")
-    return tokens
+                count += 1
+                yield record
+    print(f"Total of {count} new or changed token claims extracted.")
 
 
 def fetch_claim_ids_from_supabase() -> list:
     """Fetches claim IDs from the Supabase table."""
-    data, _ = supabase.table(TABLE_NAME).select("claimId").execute()
-    claims = data[1]
+    build_query = lambda: supabase.table(TABLE_NAME).select("claimId", count="exact").order("claimId")
+    claims = supabase_prefetch.fetch_all_rows(build_query)
     claim_ids = [c["claimId"] for c in claims]
     print(f"Supabase shows a total of {len(claim_ids)} hypercert claims.")
     return claim_ids
 
 
-def append_to_csv_file(tokens: list, csv_filepath: str = CSV_FILEPATH) -> None:
-    """Appends the token records to the local CSV file."""
-    if not os.path.exists(csv_filepath):
-        df = pd.DataFrame(columns=tokens[0].keys())
-        df.set_index("tokenId", inplace=True)
-        df.to_csv(csv_filepath)
-
-    df = pd.read_csv(csv_filepath, index_col="tokenId")
-    for token in tokens:
-        new_row = pd.Series(token, name=token["tokenId"])
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-
-    df.to_csv(csv_filepath)
+def store_token_records(records, index: TokenIndex, csv_filepath: str = CSV_FILEPATH) -> None:
+    """Appends new token records to the CSV file, replaces changed ones and records both in the token index."""
+    writer = AppendWriter(csv_filepath, key="tokenId")
+    added = 0
+    changed = []
+    for chunk in iter_chunks(records, WRITE_CHUNK_SIZE):
+        new = []
+        for record in chunk:
+            if record["tokenId"] in index or record["tokenId"] in writer.keys:
+                changed.append(record)
+            else:
+                new.append(record)
+        # The CSV is written before the index, so a failed run never marks unwritten tokens as known
+        added += writer.append(new)
+        index.update(new)
+    if changed:
+        writer.replace(changed)
+        index.update(changed)
+    print(f"Appended {added} new and updated {len(changed)} changed token records in {csv_filepath}.")
+
+
+def iter_chunks(iterable, size: int):
+    """Yields lists of up to `size` consecutive items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def main():
+    index = TokenIndex(INDEX_PATH)
+    if not len(index):
+        index.import_csv(CSV_FILEPATH)
     claim_ids = fetch_claim_ids_from_supabase()
-    token_data = parse_tokens(get_all_tokens(claim_ids))
-    append_to_csv_file(token_data)
+    block = subgraph.get_indexed_block()
+    store_token_records(parse_tokens(get_tokens_to_sync(claim_ids, index, block), index.tokens), index)
+    if block is not None:
+        index.mark_synced(claim_ids, block)
+    index.close()
+    graph_client.print_stats()
 
 
 if __name__ == "__main__":